@@ -1,7 +1,9 @@
 
 
 # %% load the class
+import logging
 import reduceresiduals
+logging.basicConfig(level = logging.INFO) # logging.DEBUG shows every perturbation
 
 # %% setup some variables
 # update trial path to match where the test data is saved on your system       
@@ -1,7 +1,9 @@
 
 
 # %% load the class
+import logging
 import reduceresiduals
+logging.basicConfig(level = logging.INFO) # logging.DEBUG shows every perturbation
 
 # %% setup some variables
 # update trial path to match where the test data is saved on your system       
@@ -35,3 +37,12 @@ rraopts.runMassItrsRRA()
 
 # %% run TWSA with defaults
 rraopts.optimizeTrackingWeights()
+
+# %% alternatively, run the steps above through a pipeline. Calling run() again only repeats the steps whose settings or input files changed (and the steps after them)
+# import rrapipeline
+# pipe = rrapipeline.trialpipeline(rraopts, twsaOptions = {'max_itrs': 75})
+# pipe.run()
+
+# %% alternatively, optimize one set of tracking weights for all three cycles of the run. The other cycles need their inputs and mass iterations prepared as above
+# cycles = [reduceresiduals.rrasetup(trialpath.replace("Trial_1",t), participant, condition) for t in ["Trial_2","Trial_3"]]
+# rraopts.optimizeTrackingWeights(cycles = cycles, aggregate = "mean")
@@ -1,15 +1,65 @@
 # includes
 from ntpath import join
 import re # regular expression support
-import pandas
-import opensim as osim
+import importlib
 import os # file path and system command control
 import math
 import numpy as np
 import pickle # needed to save/load opt results
+import json
 import subprocess # copy/rename/move files
+import shutil
+import time
+import random
+import uuid
+import atexit
+import tempfile
+import logging # verbose TWSA output is at DEBUG level, progress at INFO
+import rrarunner # asyncio launcher for opensim-cmd
+import rrabroker # work distribution of TWSA evaluations
+import rraxml # OpenSim-free task set and setup file templates
+import rrastorage # OpenSim-free .sto/.mot reader
+import rratelemetry # per-trial status files and the batch status endpoint
+import rraindex # columnar study-level index of trial summaries
+import rracalibrate # measured best number of concurrent RRA runs per host and model
+import rrainprocess # RRA runs through the OpenSim bindings with in-memory data exchange
 #
 
+log = logging.getLogger(__name__)
+
+# The OpenSim bindings take seconds and hundreds of MB to load and are not 
+# installed on every machine. They are imported the first time a method 
+# actually uses them, so reading results, scoring and job generation work without them.
+class _lazymodule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return(getattr(self._module, attr))
+
+osim = _lazymodule('opensim')
+
+# files an RRA run writes to its results folder, after '<tool name>_'
+RRAOUTPUTS = ['Actuation_force.sto','Actuation_power.sto','Actuation_speed.sto','avgResiduals.txt',
+              'Controls.sto','controls.xml','Kinematics_dudt.sto','Kinematics_q.sto','Kinematics_u.sto',
+              'pErr.sto','states.sto']
+MAXDRAWS = 50 # redraws of a candidate before the perturbation is widened
+MAXSTEPS = 20000 # maximum_number_of_integrator_steps of the full TWSA runs (per control interval)
+# integrator message in the opensim-cmd output
+_STEPLIMIT = re.compile(r'maximum number of (integrator |integration )?steps|step limit|ReachedStepLimit',re.IGNORECASE)
+# scratch folders of TWSAs in this process that have not finished (yet)
+_SCRATCH = set()
+
+def _removeScratch():
+    for folder in list(_SCRATCH):
+        shutil.rmtree(folder,ignore_errors = True)
+    _SCRATCH.clear()
+
+atexit.register(_removeScratch) # also cleaned up if a TWSA never finishes
+
 # begin class def
 class rrasetup: # constructor method
     def __init__(self, trialpath, participant, condition):
@@ -39,6 +89,24 @@ class rrasetup: # constructor method
         self.initMassChange = 0
         self.totalMassChange = 0
         self.numMassItrs = 0
+        # set runner.timeout to limit the wall-clock time of each RRA run. TWSA evaluations run with the
+        # concurrency, thread cap and CPU pinning calibrated for this host and model unless those are set here
+        self.runner = rrarunner.rrarunner()
+        self._calibrated = None # runner of the TWSA evaluations with the rracalibrate settings (False if never calibrated)
+        self.broker = None # set to an rrabroker.broker to hand TWSA evaluations to (remote) workers
+        self._templates = rraxml.templatecache() # task set and setup files parsed once, patched per TWSA iteration
+        self._session = None # [start time, evaluations at start] of the running TWSA, for the status file
+        self.window = None # (starttime, endtime) of the cropped inputs, set by cropInputs
+        self.indexfile = None # study index (rraindex) the trial summary is added to when the TWSA finishes
+        self._pending = [] # speculative TWSA candidates in flight (speculate > 0)
+        self.cycles = [] # other gait cycles optimized jointly with this trial (optimizeTrackingWeights cycles)
+        self._cycleRuns = [] # (cycle, run status, results folder) of the latest joint evaluation
+        self._batchRunner = None # runner for the runs of a candidate on all cycles when self.runner runs fewer at once
+        self.inprocess = False # run TWSA evaluations with the OpenSim bindings in this process instead of opensim-cmd
+        self._inprocess = None # rrainprocess.inprocessrunner, created on first use
+        self.scratch = None # local (e.g. RAM-backed) folder for per-evaluation TWSA files: a path, 'auto' (/dev/shm if present) or None
+        self.scratchLimit = 2**30 # bytes of scratch space a trial may use
+        self._scratch = None # this trial's folder inside scratch while the TWSA runs
     
     def writeRRATool(self):
         """
@@ -76,11 +144,7 @@ class rrasetup: # constructor method
                 createReserves -- boolean with default to true. Calls createReseves method unless set to false. 
                 createExtLoads -- boolean with default to true. Calls createExtLoads method unless set to false. 
         """
-        ikdata=osim.Storage(os.path.join(self.fileset.trialpath,self.fileset.kinfile))
-        timedata = osim.ArrayDouble()
-        ikdata.getTimeColumn(timedata)
-        self.toolsettings.starttime = timedata.get(0)
-        self.toolsettings.endtime = timedata.getLast()
+        self.toolsettings.starttime, self.toolsettings.endtime = self.__analysisWindow__()
 
         bToolPrinted = self.writeRRATool()
 
@@ -94,10 +158,6 @@ class rrasetup: # constructor method
         if not(os.path.isdir(self.fileset.resultspath)):
             os.mkdir(self.fileset.resultspath)
 
-        # change directory so err and out files are written into the results folder
-        mydir = os.getcwd()
-        os.chdir(self.fileset.resultspath)
-        
         # OpenSim 4.x has started appending to the log file rather than overwriting. Delete existing logs.
         logfile_a = os.path.join(self.toolsettings.resultspath,'out.log') # v3.x - v4.1
         logfile_b = os.path.join(self.toolsettings.resultspath,'opensim.log') # v4.2
@@ -107,10 +167,8 @@ class rrasetup: # constructor method
         elif os.path.isfile(logfile_b):
             os.remove(logfile_b)
 
-        # run the rra tool
-        command_rra = 'opensim-cmd run-tool ' + os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile)
-        os.system(command_rra)
-        os.chdir(mydir) # change back to initial directory
+        # run the rra tool from the results folder so err and out files are written there
+        self.runner.run(os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile),self.fileset.resultspath)
 
         self.initMassChange = self.adjMass()
         self.totalMassChange = self.initMassChange
@@ -132,11 +190,7 @@ class rrasetup: # constructor method
         mass_change = 100 # initialize mass change variable to high value so loop will run 
         
         # create the tool
-        ikdata = osim.Storage(os.path.join(self.fileset.trialpath,self.fileset.kinfile))
-        timedata = osim.ArrayDouble()
-        ikdata.getTimeColumn(timedata)
-        self.toolsettings.starttime = timedata.get(0)
-        self.toolsettings.endtime = timedata.getLast()
+        self.toolsettings.starttime, self.toolsettings.endtime = self.__analysisWindow__()
         self.toolsettings.rrasetupfile = self.fileset.masssetupfile
         self.toolsettings.modelname = self.fileset.adjname
         self.toolsettings.resultspath = self.fileset.adjresultspath
@@ -160,14 +214,8 @@ class rrasetup: # constructor method
             elif os.path.isfile(logfile_b):
                 os.remove(logfile_b)
                 
-            # move into the results directory to run the RRA tool
-            mydir = os.getcwd()
-            os.chdir(self.toolsettings.resultspath)
-            # string to send to the command line
-            command_rra = 'opensim-cmd run-tool ' + os.path.join(self.fileset.trialpath,self.fileset.masssetupfile)
-            os.system(command_rra)
-            # change back to original directory
-            os.chdir(mydir)
+            # run the RRA tool from the results directory
+            self.runner.run(os.path.join(self.fileset.trialpath,self.fileset.masssetupfile),self.toolsettings.resultspath)
             # adjust model mass
             mass_change = self.adjMass()
             # count iters
@@ -192,7 +240,7 @@ class rrasetup: # constructor method
         elif os.path.isfile(logfile_b):
             logfile = logfile_b
         else:
-            print('No matching log file found!')
+            log.warning('No matching log file found!')
 
         
         regexp = re.compile(r"\*  Total mass change: ?([0-9.]+)?") # line to search for in file
@@ -203,7 +251,7 @@ class rrasetup: # constructor method
                 if regexp.match(lines[l]) != None: # find the right line
                     value = re.findall(r"[-+]?\d*\.\d+|\d+", lines[l]) # extract the float value from appropriate line
                     mass_change = float(value[0]) # should be only one entry in the array
-                    print(mass_change)
+                    log.info('total mass change: %s', mass_change)
 
         #Initialize an OpenSim model from the RRA output
         model = osim.Model(os.path.join(self.toolsettings.trialpath,self.toolsettings.outname))
@@ -233,103 +281,61 @@ class rrasetup: # constructor method
             ReserveForce -- a numeric input to specify the optimal force for all other reserves (default is 1600)
             ResidualForce -- a numeric input to specify the optimal force for residual actuators (default is 100)
         """
-        mod = osim.Model(self.modfullpath)
-        s = mod.initSystem()
+        model = rraxml.modelinfo(self.modfullpath) # read straight from the xml, no initSystem needed
         # create set of actuators
-        reserve_set = osim.ForceSet()
-        coords = mod.getCoordinateSet()
-        numc = coords.getSize()
+        reserve_set = []
         reserve_names = [] # i don't think this is used anymore
-        #r = 0
-        for c in range(0,numc-1):
-            cname = coords.get(c).getName()
-            if not(coords.get(c).isConstrained(s)):
+        for cname in model.coordinates:
+            if not(model.isConstrained(cname)):
+                curAct = None
                 if "pelvis" in cname.lower():
-                    if "pelvis" in cname:
+                    if "pelvis" in model.bodies:
                         bodyname = "pelvis"
-                    else:
+                    elif "Pelvis" in model.bodies:
                         bodyname = "Pelvis"
-                #if "pelvis" in cname:
-                    cm = osim.Vec3()
-                    cm = mod.getBodySet().get(bodyname).getMassCenter()
+                    else:
+                        raise ValueError('no "pelvis" or "Pelvis" body in ' + self.modfullpath + ' for the residual actuator of ' + cname)
+                    cm = model.bodies[bodyname][1]
                     if "tilt" in cname:
-                        curAct = osim.CoordinateActuator()
-                        curAct.setOptimalForce(ResidualForce)
-                        curAct.set_coordinate(cname)
-                        curAct.setName("MZ")
+                        curAct = rraxml.element('CoordinateActuator', 'MZ', coordinate = cname, optimal_force = ResidualForce)
                     elif "list" in cname:
-                        curAct = osim.CoordinateActuator()
-                        curAct.setOptimalForce(ResidualForce)
-                        curAct.set_coordinate(cname)
-                        curAct.setName("MX")
+                        curAct = rraxml.element('CoordinateActuator', 'MX', coordinate = cname, optimal_force = ResidualForce)
                     elif "rotation" in cname:
-                        curAct = osim.CoordinateActuator()
-                        curAct.setOptimalForce(ResidualForce)
-                        curAct.set_coordinate(cname)
-                        curAct.setName("MY")
+                        curAct = rraxml.element('CoordinateActuator', 'MY', coordinate = cname, optimal_force = ResidualForce)
                     elif "tx" in cname:
-                        curAct = osim.PointActuator()
-                        curAct.set_body(bodyname)
-                        curAct.setOptimalForce(ResidualForce)
-                        curAct.set_direction(osim.Vec3(1,0,0))
-                        curAct.set_point(cm)
-                        curAct.set_point_is_global(False)
-                        curAct.set_force_is_global(True)
-                        curAct.setName("FX")
+                        curAct = rraxml.element('PointActuator', 'FX', optimal_force = ResidualForce, body = bodyname, point = cm,
+                                                point_is_global = False, direction = [1,0,0], force_is_global = True)
                     elif "ty" in cname:
-                        curAct = osim.PointActuator()
-                        curAct.set_body(bodyname)
-                        curAct.setOptimalForce(ResidualForce)
-                        curAct.set_direction(osim.Vec3(0,1,0))
-                        curAct.set_point(cm)
-                        curAct.set_point_is_global(False)
-                        curAct.set_force_is_global(True)
-                        curAct.setName("FY")
+                        curAct = rraxml.element('PointActuator', 'FY', optimal_force = ResidualForce, body = bodyname, point = cm,
+                                                point_is_global = False, direction = [0,1,0], force_is_global = True)
                     elif "tz" in cname:
-                        curAct = osim.PointActuator()
-                        curAct.set_body(bodyname)
-                        curAct.setOptimalForce(ResidualForce)
-                        curAct.set_direction(osim.Vec3(0,0,1))
-                        curAct.set_point(cm)
-                        curAct.set_point_is_global(False)
-                        curAct.set_force_is_global(True)
-                        curAct.setName("FZ")   
+                        curAct = rraxml.element('PointActuator', 'FZ', optimal_force = ResidualForce, body = bodyname, point = cm,
+                                                point_is_global = False, direction = [0,0,1], force_is_global = True)
                 else:
-                    curAct = osim.CoordinateActuator()
-                    curAct.setName(cname)
-                    curAct.set_coordinate(cname)
                     if cname in skip_coords:
-                        curAct.setOptimalForce(1)
+                        curAct = rraxml.element('CoordinateActuator', cname, coordinate = cname, optimal_force = 1)
                     else:
-                        curAct.setOptimalForce(ReserveForce)
-                curAct.setMaxControl(1000)
-                curAct.setMinControl(-1000)
+                        curAct = rraxml.element('CoordinateActuator', cname, coordinate = cname, optimal_force = ReserveForce)
+                if curAct is None:
+                    continue
+                rraxml.ET.SubElement(curAct, 'min_control').text = '-1000'
+                rraxml.ET.SubElement(curAct, 'max_control').text = '1000'
 
                 # remember names that are already added
                 reserve_names.append(cname)
                 # add actuator to reserve set
-                reserve_set.cloneAndAppend(curAct)
+                reserve_set.append(curAct)
                 
         # add passive force elements. This will add certain passive force elements defined in the model to the reserve set (CoordinateLimitForce, ExpressionBasedBushing). Actuators and other bushings are ignored.  
-        mNames = osim.ArrayStr()
-        fNames = osim.ArrayStr()
-        modForce = mod.getForceSet()
-        modForce.getNames(fNames)
-        modAct = modForce.getActuators()
-        modAct.getNames(mNames)
-
-        for f in range(0,modForce.getSize()):
-            loc = mNames.rfindIndex(fNames.get(f))
-            if loc == -1:
-                #print(fNames.get(f), " not found in actuators")
-                if ( "BushingForce" in str(modForce.get(f).getConcreteClassName()) ):
-                     if ("ExpressionBased" in str(modForce.get(f).getConcreteClassName()) ): 
-                        reserve_set.cloneAndAppend(modForce.get(f))
-                        #print("adding to RRA reserve set")
-                else:
-                    reserve_set.cloneAndAppend(modForce.get(f))
+        for force in model.passiveForces:
+            if "BushingForce" in force.tag:
+                if "ExpressionBased" in force.tag:
+                    reserve_set.append(force)
+            else:
+                reserve_set.append(force)
                 
-        success = reserve_set.printToXML(os.path.join(self.fileset.trialpath,self.fileset.actuatorfile))
+        success = rraxml.writeSet(os.path.join(self.fileset.trialpath,self.fileset.actuatorfile), 'ForceSet', reserve_set,
+                                  version = model.version or '40000')
         return(success)
 
     def createTasksFile(self, skip_coords = ["bp_tx","bp_ty"], Kp = 1600, UniformWeights = True, UserWeights = {"none": 0}):
@@ -344,53 +350,47 @@ class rrasetup: # constructor method
         """    
         Kv = 2*math.sqrt(Kp) # enforce critical damping
         
-        mod = osim.Model(self.modfullpath)
-        s = mod.initSystem()
+        model = rraxml.modelinfo(self.modfullpath) # read straight from the xml, no initSystem needed
         
         #print("creating task set")
-        task_set = osim.CMC_TaskSet()
-        coords = mod.getCoordinateSet()
+        task_set = []
 
-        for c in range(0,coords.getSize()-1):
-            if not(coords.get(c).isConstrained(s)):
-                cname = coords.get(c).getName()
+        for cname in model.coordinates:
+            if not(model.isConstrained(cname)):
                 if not(cname in skip_coords):
-                    curTask = osim.CMC_Joint(cname)
-                    curTask.setName(cname)
-                    curTask.setKP(Kp)
-                    curTask.setKV(Kv)
-                    curTask.setActive(True,False,False)
-                    curTask.setOn(True)
 
                     if UniformWeights:
                         if cname in UserWeights.keys():
-                            curTask.setWeight(UserWeights[cname],1,1)
+                            weight = UserWeights[cname]
                         else:
-                            curTask.setWeight(1,1,1)
+                            weight = 1
                         
                     
                     else:
                         # add statement to match userdefined weights (in MATLAB: contains(userNames, cname))
                         
                         if cname in UserWeights.keys():
-                            curTask.setWeight(UserWeights[cname],1,1)
+                            weight = UserWeights[cname]
                         elif "pelvis" in cname.lower():
-                            curTask.setWeight(1,1,1)
+                            weight = 1
                         elif cname in ['flex_extension','axial_rotation','lat_bending','L5_S1_FE','L5_S1_LB','L5_S1_AR']:
-                            curTask.setWeight(5,1,1)
+                            weight = 5
                         elif "ankle" in cname:
-                            curTask.setWeight(20,1,1)
+                            weight = 20
                         elif "knee" in cname:
-                            curTask.setWeight(10,1,1)
+                            weight = 10
                         elif "hip" in cname:
-                            curTask.setWeight(5,1,1)
+                            weight = 5
                         else:
-                            curTask.setWeight(1,1,1)
+                            weight = 1
                         
 
-                    task_set.cloneAndAppend(curTask)    
+                    curTask = rraxml.element('CMC_Joint', cname, on = True, weight = [weight,1,1], active = [True,False,False],
+                                             kp = [Kp,1,1], kv = [Kv,1,1], coordinate = cname)
+                    task_set.append(curTask)
 
-        success = task_set.printToXML(os.path.join(self.trialpath, self.fileset.taskfile))
+        success = rraxml.writeSet(os.path.join(self.trialpath, self.fileset.taskfile), 'CMC_TaskSet', task_set,
+                                  version = model.version or '40000')
         return(success)
 
     def createExtLoads(self):
@@ -471,13 +471,83 @@ class rrasetup: # constructor method
 
         return(peak_force)
 
+    def cropInputs(self, pad = 0.05, grfRate = None, starttime = None, endtime = None):
+        """
+        Writes copies of the kinematics and GRF files cropped to the simulated
+        window (plus a small pad) and an external loads file pointing at the GRF
+        copy, then points the RRA tool settings at them. Every later RRA run
+        (initial, mass iterations, TWSA) loads and interpolates only the window
+        instead of the whole capture. Copies are written to RRA_inputs/<window>
+        and reused while the source files are unchanged.
+        Call after the kinematics/GRF file names are set and before initialRRA.
+            Optional keyword arguments:
+                pad -- seconds kept before and after the window (default = 0.05)
+                grfRate -- resample the GRF to this rate in Hz (default = None, keep the capture rate)
+                starttime, endtime -- simulated window. Defaults to toolsettings.starttime/endtime
+                                      if set, otherwise the time range of the kinematics file.
+        """
+        kinsrc = os.path.join(self.fileset.trialpath,self.fileset.kinfile)
+        grfsrc = os.path.join(self.fileset.trialpath,self.fileset.grffile)
+        extsrc = os.path.join(self.fileset.trialpath,self.fileset.extloadsetup)
 
-       
-
-    def optimizeTrackingWeights(self, overwrite = False, min_itrs = 25, max_itrs = 75,fcn_threshold = 2, wRes = 2, wErr = 1, pRes = 3, pErr = 3, ResidualNorm = 0, RotationNorm = 3, TranslationNorm = 0.02):
+        if starttime is None or endtime is None:
+            if self.toolsettings.endtime > self.toolsettings.starttime:
+                window = (self.toolsettings.starttime,self.toolsettings.endtime)
+            else:
+                header, labels, kin = rrastorage.readStorage(kinsrc)
+                window = (float(kin[0,0]),float(kin[-1,0]))
+            starttime = window[0] if starttime is None else starttime
+            endtime = window[1] if endtime is None else endtime
+
+        tag = ('%.4f-%.4f_pad%g' % (starttime,endtime,pad)) + ('_%gHz' % grfRate if grfRate else '')
+        folder = os.path.join(self.fileset.inputpath,tag)
+        kindst = os.path.join(folder,self.fileset.kinfile)
+        grfdst = os.path.join(folder,self.fileset.grffile)
+        extdst = os.path.join(folder,self.fileset.extloadsetup)
+
+        # cached per window: only rewrite if a source changed since the copies were made
+        sources = {f: [os.path.getmtime(f),os.path.getsize(f)] for f in [kinsrc,grfsrc,extsrc]}
+        manifest = os.path.join(folder,'inputs.json')
+        cached = False
+        if os.path.isfile(manifest):
+            with open(manifest) as f:
+                cached = json.load(f) == sources
+        
+        if not cached:
+            os.makedirs(folder,exist_ok = True)
+            header, labels, kin = rrastorage.readStorage(kinsrc)
+            rrastorage.writeStorage(kindst,header,labels,rrastorage.crop(kin,starttime,endtime,pad))
+            header, labels, grf = rrastorage.readStorage(grfsrc)
+            grf = rrastorage.crop(grf,starttime,endtime,pad)
+            if grfRate:
+                grf = rrastorage.resample(grf,grfRate)
+            rrastorage.writeStorage(grfdst,header,labels,grf)
+            rraxml.writeExternalLoads(extsrc,extdst,grfdst)
+            with open(manifest,'w') as f:
+                json.dump(sources,f)
+            log.info('cropped inputs written to %s', folder)
+
+        # the RRA setup files written from now on use the copies
+        self.window = (starttime,endtime)
+        self.toolsettings.starttime = starttime
+        self.toolsettings.endtime = endtime
+        self.toolsettings.kinfile = os.path.relpath(kindst,self.fileset.trialpath)
+        self.toolsettings.extloadsetup = os.path.relpath(extdst,self.fileset.trialpath)
+        return(folder)
+
+    def __analysisWindow__(self):
+        # time window simulated by RRA: the cropped window if cropInputs was used, else the whole kinematics file
+        if self.window is not None:
+            return(self.window)
+        header, labels, kin = rrastorage.readStorage(os.path.join(self.fileset.trialpath,self.fileset.kinfile))
+        return(float(kin[0,0]),float(kin[-1,0]))
+
+
+    def optimizeTrackingWeights(self, overwrite = False, min_itrs = 25, max_itrs = 75,fcn_threshold = 2, wRes = 2, wErr = 1, pRes = 3, pErr = 3, ResidualNorm = 0, RotationNorm = 3, TranslationNorm = 0.02, blockCoordinate = False, groupItrs = 3, freezeItrs = 3, screening = None, stopping = None, rerun_final = False, pareto = False, speculate = 0, deadline = None, integrationCost = 0, cycles = None, aggregate = 'mean', symmetry = None):
         """
         Performs the tracking weight optimization algorithm using the mass adjusted model. 
         Optional keyword arguments: 
+            overwrite -- boolean to delete saved progress and start the TWSA from scratch (default = False)
             min_itrs -- integer to specify a minimum number of iterations to use (default = 25)
             max_itrs -- integer to specify a maximum number of iterations (default = 75)
             fcn_threshold -- numeric input to specify target cost function value for good enough convergence 
@@ -496,6 +566,89 @@ class rrasetup: # constructor method
             TranslationNorm -- tolerated translational kinematic error in m
              used to normalize the tracking errors.
 
+            blockCoordinate -- boolean to perturb one coordinate group (pelvis, lumbar,
+             right leg, left leg, arms) per iteration instead of every tracked
+             coordinate at once (default = False). Groups are derived from the 
+             coordinate names in the task file.
+
+            groupItrs -- number of consecutive iterations spent on each coordinate 
+             group before moving to the next one (default = 3, blockCoordinate only)
+
+            freezeItrs -- number of consecutive iterations a coordinate's RMS error 
+             must stay below the lower ("green") bound before its weight is frozen
+             (default = 3, blockCoordinate only)
+
+            screening -- optional fidelityoptions object. When given, every candidate
+             is first run on a cheap RRA (sub-window of the trial, decimated kinematics,
+             looser integrator settings) and only promoted to the full RRA if its 
+             screening score beats the screening score of the current solution.
+
+            stopping -- optional stoppingoptions object. When given, the run also ends
+             (after min_itrs) once it has stagnated: little relative improvement of the
+             best objective value, few accepted candidates and/or small moves of the
+             current solution over a window of recent iterations. The reason the run
+             ended is stored in the results (stopReason).
+
+            rerun_final -- boolean to re-run RRA with the best tracking weights at the end
+             (default = False). The outputs and adjusted model of the best evaluation are
+             kept in RRA_optWeights/Best as it is found and promoted to RRA_Final and the
+             _Final.osim model without recomputing; set to True to verify them with a new
+             run. The best evaluation is always re-run if it is the initial one, which 
+             does not adjust the COM.
+
+            pareto -- boolean to search for the trade-off between residuals and tracking
+             errors instead of a single weighting (default = False). Evaluations are kept
+             in a non-dominated archive over the residual and tracking error terms; a
+             candidate is accepted if it enters the archive, otherwise the next one is 
+             perturbed from a sparse part of the front. wRes and wErr only pick the final
+             solution; selectTradeoff() picks (and runs) the solution for other weightings
+             from the same run.
+
+            speculate -- number of candidates run ahead of the one being evaluated
+             (default = 0). Most candidates are rejected, so while candidate k runs the
+             next ones are drawn and started assuming it will be; if k is accepted they
+             are cancelled and redrawn from the new solution with the random state
+             rewound, which keeps the accept/reject sequence of the serial algorithm.
+             Runs in parallel up to runner.maxConcurrent (with a broker, speculate+1
+             jobs are in flight). Not used with screening, pareto, in-process runs
+             (inprocess) or cycles.
+
+            deadline -- optional wall-clock time (time.time() seconds, e.g. time.time() + 8*3600)
+             by which the TWSA should be done. No new candidate is started once the
+             projected end of another evaluation, estimated from the recent RRA run times,
+             falls after it; the run then finishes with the best solution so far and
+             stopReason 'deadline', regardless of min_itrs. A final re-run (rerun_final)
+             comes on top.
+
+            integrationCost -- numeric penalty steering the search away from tracking
+             weights that make the RRA integrator slow (default = 0, not used). The number
+             of integrator steps of every run is recorded (RunSteps); a candidate whose run
+             took k times the median number of steps is compared to the current solution
+             as if its objective value were integrationCost*(k-1) higher. The recorded
+             objective values and the choice of the best solution are not affected.
+
+            cycles -- optional list of rrasetup objects for other gait cycles of the same
+             run (e.g. Trial_2 and Trial_3 next to this Trial_1; inputs prepared and mass
+             iterations done). One set of tracking weights is then optimized for all of
+             them: every candidate is run on this trial and each cycle at once (locally up
+             to the number of CPUs, or the CPU sets of a pinned runner, even if
+             runner.maxConcurrent is lower) and scored by aggregating the per-cycle
+             objective values. The per-cycle values are recorded (CycleObjFuncValues,
+             CycleResiduals, CycleErrors) and every cycle gets its own RRA_Final results
+             and _Final.osim model. Not used with speculate.
+
+            aggregate -- 'mean' or 'max' (worst case) of the per-cycle objective values,
+             cost terms and RMS errors (default = 'mean', cycles only)
+
+            symmetry -- optional tying of left/right coordinate pairs, detected from the
+             _r/_l names in the task file (default = None, every coordinate is perturbed
+             on its own). A number >= 1 is the largest ratio allowed between the weights
+             of a pair: each pair is perturbed as one shared weight, biased by its worse
+             tracked side, and with symmetry > 1 an asymmetry factor between the sides
+             that is perturbed too and kept within [1/symmetry, symmetry]. symmetry = 1
+             ties both sides to one weight. The initial weights are made to satisfy the
+             bound. With blockCoordinate, the right and left leg groups are merged.
+
         Additional hidden methods contained are helper functions to this main 
         tracking weight optimization method.   
         """
@@ -515,7 +668,31 @@ class rrasetup: # constructor method
         #   Further modifications by Jordan Sturdy March 4, 2021
         
 
+        S = self.beginOptimization(overwrite,min_itrs,max_itrs,fcn_threshold,wRes,wErr,pRes,pErr,ResidualNorm,RotationNorm,TranslationNorm,
+                                   blockCoordinate,groupItrs,freezeItrs,screening,stopping,pareto,speculate,deadline,integrationCost,
+                                   cycles,aggregate,symmetry)
+
+        #loop through rra iterations
+        S.stopReason = None
+        while S.stopReason is None:
+            S.stopReason = self.stopCondition(S)
+            if S.stopReason is None:
+                # exectute task optimization famework (preturb task values, run rra
+                #   iteration, calculate objective function new value
+                log.debug('entering iteration loop...')
+                S = self.stepOptimization(S)
+
+        self.finishOptimization(S,rerun_final)
 
+
+    def beginOptimization(self, overwrite = False, min_itrs = 25, max_itrs = 75,fcn_threshold = 2, wRes = 2, wErr = 1, pRes = 3, pErr = 3, ResidualNorm = 0, RotationNorm = 3, TranslationNorm = 0.02, blockCoordinate = False, groupItrs = 3, freezeItrs = 3, screening = None, stopping = None, pareto = False, speculate = 0, deadline = None, integrationCost = 0, cycles = None, aggregate = 'mean', symmetry = None):
+        """
+        Starts the TWSA, or resumes it from the saved progress: copies the inputs,
+        evaluates (or reloads) the initial tracking weights and returns the optimization
+        structure. With stopCondition(), stepOptimization() and finishOptimization()
+        this runs the TWSA one evaluation at a time, e.g. to share an evaluation budget
+        between trials (rrastudy). Keyword arguments as for optimizeTrackingWeights().
+        """
         #import pickle # needed to save/load opt results
         #import subprocess
 
@@ -525,10 +702,16 @@ class rrasetup: # constructor method
             os.mkdir(self.fileset.optpath)
         if not(os.path.isdir(os.path.join(self.fileset.optpath,"Tasks"))):
             os.mkdir(os.path.join(self.fileset.optpath,"Tasks"))
-        if not(os.path.isdir(os.path.join(self.fileset.optpath,"Results"))):
-            os.mkdir(os.path.join(self.fileset.optpath,"Results"))
-
-        newtaskSetFilename = os.path.join(self.fileset.optpath,'Tasks','optItr_' + str(0) + '_Tasks.xml')
+        self.__openScratch__()
+        self.cycles = list(cycles) if cycles is not None else []
+        self._cycleRuns = []
+        for c in self.cycles:
+            for folder in [c.fileset.optpath,os.path.join(c.fileset.optpath,"Tasks")]:
+                if not(os.path.isdir(folder)):
+                    os.mkdir(folder)
+            c.__openScratch__()
+
+        newtaskSetFilename = os.path.join(self.fileset.workpath,'Tasks','optItr_' + str(0) + '_Tasks.xml')
         
         # copy needed files into optimization folder
         src1 = os.path.join(self.fileset.trialpath,self.fileset.taskfile)
@@ -561,6 +744,7 @@ class rrasetup: # constructor method
         # read current progress. 
         # COULD ADD OPTIONAL "RESTART TWSA" ARGUMENT. Then if true, delete the saved progress and start fresh.
         Sresults_file = os.path.join(self.fileset.optpath,'opt_results.optStruct')
+        self._session = [time.time(),0]
         if os.path.isfile(Sresults_file):
             if overwrite:
                 os.remove(Sresults_file)
@@ -571,6 +755,50 @@ class rrasetup: # constructor method
                 #itr = S.itr
                 S.i_min = min_itrs
                 S.i_max = max_itrs
+                S.blockCoordinate = blockCoordinate
+                S.groupItrs = groupItrs
+                S.freezeItrs = freezeItrs
+                S.screening = screening
+                S.stopping = stopping
+                S.pareto = pareto
+                S.speculate = speculate
+                S.deadline = deadline
+                S.integrationCost = integrationCost
+                if S.cyclePaths != [c.fileset.trialpath for c in self.cycles]:
+                    raise ValueError('the saved TWSA progress in ' + self.fileset.optpath + ' was run on other cycles; use overwrite = True to start again')
+                S.aggregate = aggregate
+                S.symmetry = symmetry
+                if symmetry is not None and not S.pairs:
+                    S.pairs = self.__symmetricPairs__(S.xcurrent.names)
+                if self.numMassItrs > 0:
+                    S.massChange = self.totalMassChange
+                    S.massItrs = self.numMassItrs
+                # fields missing from progress saved by an older version are filled in by _optStruct.__setstate__
+                if not S.coordGroups:
+                    S.coordGroups = self.__coordinateGroups__(S.xcurrent.names)
+                    S.greenCount = [0]*len(S.xcurrent.names)
+                while len(S.ScreenValues) < len(S.ObjFuncValues):
+                    S.ScreenValues.append(math.nan)
+                    S.Promoted.append(True)
+                while len(S.RunStatus) < len(S.ObjFuncValues):
+                    S.RunStatus.append('unknown')
+                    S.RunTimes.append(math.nan)
+                while len(S.RunCPUTimes) < len(S.RunTimes):
+                    S.RunCPUTimes.append(math.nan)
+                    S.RunMemory.append(math.nan)
+                while len(S.RunSteps) < len(S.RunTimes):
+                    S.RunSteps.append(math.nan)
+                    S.RunStepLimit.append(False)
+                while len(S.RMSErrors) < len(S.ObjFuncValues):
+                    S.RMSErrors.append([math.nan]*len(S.xcurrent.names))
+                if len(S.CurrentIndex) < len(S.ObjFuncValues):
+                    # candidates were accepted on strict improvement, so the current solution was the running best
+                    objvals = S.ObjFuncValues.array()
+                    S.Accepted = [bool(i == 0 or objvals[i] < objvals[:i].min()) for i in range(0,len(objvals))]
+                    S.CurrentIndex = rrasetup._history()
+                    S.CurrentIndex.extend([np.argmin(objvals[:i+1]) for i in range(0,len(objvals))])
+                self.__paretoArchive__(S)
+                self._session[1] = len(S.ObjFuncValues)
         else:
             S = self._optStruct() # initialize data structure
 
@@ -582,9 +810,7 @@ class rrasetup: # constructor method
             S.pRes = pRes #  exponential factor
             S.pErr = pErr
 
-            mod = osim.Model(os.path.join(self.fileset.trialpath,self.fileset.adjname))
-            state = mod.initSystem()
-            body_mass = mod.getTotalMass(state)
+            body_mass = rraxml.modelinfo(os.path.join(self.fileset.trialpath,self.fileset.adjname)).totalMass()
             
             if ResidualNorm == 0:
                 optResidNorm = 1.3*body_mass*9.81; # assume max force due to body mass
@@ -599,10 +825,47 @@ class rrasetup: # constructor method
             # load default task values 
             taskFileName = os.path.join(self.fileset.trialpath,self.fileset.taskfile)
             S.trackingWeights = self.__readTrackingWeights__(taskFileName,S.rotNormF,S.transNormF)
-            print(S.trackingWeights.values)
+            log.debug('initial tracking weights: %s', S.trackingWeights.values)
             S.xnew = S.trackingWeights
             S.fnew = 10000
 
+            # block-coordinate (active set) configuration
+            S.blockCoordinate = blockCoordinate
+            S.groupItrs = groupItrs
+            S.freezeItrs = freezeItrs
+            S.coordGroups = self.__coordinateGroups__(S.trackingWeights.names,symmetry is not None)
+            S.greenCount = [0]*len(S.trackingWeights.names)
+
+            # left/right tying: the weights of a pair share one perturbation
+            S.symmetry = symmetry
+            if symmetry is not None:
+                if symmetry < 1:
+                    raise ValueError('symmetry must be at least 1 (the largest right/left weight ratio)')
+                S.pairs = self.__symmetricPairs__(S.trackingWeights.names)
+                for pair in S.pairs:
+                    self.__tiePair__(S,S.trackingWeights.values,pair)
+                log.info('tying %d left/right coordinate pairs: %d of %d weights searched', len(S.pairs),
+                         len(S.trackingWeights.names) - len(S.pairs), len(S.trackingWeights.names))
+
+            # two-level (screening + full) evaluation configuration
+            S.screening = screening
+            S.stopping = stopping
+            S.pareto = pareto
+            S.speculate = speculate
+            S.deadline = deadline
+            S.integrationCost = integrationCost
+
+            # joint optimization over several cycles: residual normalization of each cycle
+            S.cyclePaths = [c.fileset.trialpath for c in self.cycles]
+            S.aggregate = aggregate
+            for c in self.cycles:
+                mass = rraxml.modelinfo(os.path.join(c.fileset.trialpath,c.fileset.adjname)).totalMass()
+                norm = 1.3*mass*9.81 if ResidualNorm == 0 else ResidualNorm
+                S.cycleNorms.append([0.05*norm,0.01*norm])
+            if self.numMassItrs > 0: # mass iterations run by this object
+                S.massChange = self.totalMassChange
+                S.massItrs = self.numMassItrs
+
             #Set iteration limit
 
             S.thresh = fcn_threshold
@@ -611,137 +874,232 @@ class rrasetup: # constructor method
             S.itr = 0
 
             #Run RRA with default values
-            #load RRATool to assess trial variables and update RRA tool for opt itrs.
-            rratool = osim.RRATool(os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile))
-
-            #set RRA parameters (tool name, model files, task list name, results dir)
-            rratool.setName('optItr_' + str(S.itr))
-            rratool.setModelFilename(os.path.join(self.fileset.trialpath,self.fileset.adjname)) 
-            rratool.setOutputModelFileName(os.path.join(self.fileset.optpath,self.fileset.adjname))
-            rratool.setResultsDir(os.path.join(self.fileset.optpath,'Results'))
-            rratool.setTaskSetFileName(newtaskSetFilename)
-            rratool.setMaximumNumberOfSteps(20000)
-            rratool.setAdjustCOMToReduceResiduals(False)
-            # print rra setup file 
-            rraSetupFile = os.path.join(self.fileset.optpath,'optItr_' + str(S.itr) + '_Setup.xml')
-            rratool.printToXML(rraSetupFile)
-
+            rraSetupFile = os.path.join(self.fileset.workpath,'optItr_' + str(S.itr) + '_Setup.xml')
+            self.__writeOptSetup__('optItr_' + str(S.itr),rraSetupFile,newtaskSetFilename,adjustCOM = False)
 
             #Run RRA tool from command line 
-            mydir = os.getcwd()
-            os.chdir(os.path.join(self.fileset.optpath,'Results'))
-            
-            # string to send to the command line
-            command_rra = 'opensim-cmd run-tool ' + rraSetupFile
-            os.system(command_rra)
-            os.chdir(mydir)
-            print('initial opt run completed')
+            status = self.__runEvaluation__(S,rraSetupFile,os.path.join(self.fileset.workpath,'Results'),'optItr_' + str(S.itr),adjustCOM = False)
+            log.info('initial opt run completed')
             
             # calculate objective function values from base rra trial
 
             # START NEW EDITS HERE
-            S = self.__calculateObjectiveFunction__(S)
-            S.xcurrent = S.xnew
+            S = self.__calculateObjectiveFunction__(S,status)
+            S.xcurrent = S.xnew.copy()
 
             #Store default results
-            S.ObjFuncValues = np.append(S.ObjFuncValues,S.fnew)
+            S.ObjFuncValues.append(S.fnew)
             S.fcurrent = S.fnew
-            S.TestedSolutions[0] = np.array(S.trackingWeights.values)
+            S.TestedSolutions.append(S.trackingWeights.values)
+            S.ScreenValues.append(math.nan)
+            S.Promoted.append(True)
+            S.Accepted.append(True)
+            S.CurrentIndex.append(0)
+            self.__updateArchive__(S,0)
+
+        if S.speculate and (S.screening is not None or S.pareto or (self.inprocess and self.broker is None) or self.cycles):
+            log.warning('speculative candidates are not used with screening, pareto, in-process runs or cycles')
+            S.speculate = 0
+        self.__reportProgress__(S)
+
+        if S.screening is not None and S.fcurrentScreen is None:
+            # reference screening score of the current solution
+            S.fcurrentScreen, screenTime = self.__screenCandidate__(S,S.xcurrent)
 
-        #loop through rra iterations
-        while S.itr <= S.i_max:
-            if S.itr >= S.i_min:
-                if min(S.ObjFuncValues) < S.thresh:
-                    break
+        return(S)
 
-            # exectute task optimization famework (preturb task values, run rra
-            #   iteration, calculate objective function new value
-            print('entering iteration loop...')
-            S = self.__executeRRAOptLoop__(S)
 
+    def stepOptimization(self, S):
+        """
+        Runs one TWSA iteration (perturb, evaluate, accept or reject) and saves the progress.
+        """
+        if S.speculate:
+            return(self.__speculativeStep__(S))
+        return(self.__executeRRAOptLoop__(S))
 
-        #Run Final RRA Solution
-        print('solution found, or max iterations reached')
-        # Find the best solution and re-run it to make sure our results are current
-        objVals = np.array(S.ObjFuncValues)
 
-        for i in range(0,len(objVals)):
-            if objVals[i] == objVals.min():
-                idx = i
-                break
+    def stopCondition(self, S):
+        """
+        Returns why the TWSA should end now ('threshold', 'stagnation', 'max_itrs' or
+        'deadline'), or None to go on.
+        """
+        if S.itr > S.i_max:
+            return('max_itrs')
+        if S.deadline is not None:
+            cost = self.evaluationTime(S)
+            if time.time() + (cost if cost is not None else 0) > S.deadline:
+                return('deadline')
+        if S.itr >= S.i_min:
+            if S.ObjFuncValues.array().min() < S.thresh:
+                return('threshold')
+            if S.stopping is not None and self.__stagnated__(S):
+                return('stagnation')
+        return(None)
+
+
+    def evaluationTime(self, S, window = 10):
+        """
+        Projected wall-clock seconds of the next TWSA evaluation: the 90th percentile
+        of the RRA run times of the last window evaluations (screening included), so
+        a slow stretch of the trial is not averaged away. None before any run finished.
+        """
+        runtimes = S.RunTimes.array()[-window:]
+        runtimes = runtimes[np.isfinite(runtimes)]
+        if len(runtimes) == 0:
+            return(None)
+        return(float(np.percentile(runtimes,90)))
+
 
-        bestSoln = S.TestedSolutions[idx]
+    def finishOptimization(self, S, rerun_final = False):
+        """
+        Ends the TWSA: promotes (or re-runs) the best tracking weights to RRA_Final and
+        the _Final.osim model, saves the results and adds the trial to the study index.
+        Optional keyword arguments:
+            rerun_final -- as for optimizeTrackingWeights()
+        """
+        if S.stopReason is None:
+            S.stopReason = 'max_itrs'
+        if self._pending:
+            # candidates started ahead of the stopping decision
+            self.__discardRRA__([c.handle for c in self._pending])
+            S.cancelledRuns = S.cancelledRuns + len(self._pending)
+            self._pending = []
+        self.__closeScratch__() # everything worth keeping is in RRA_optWeights by now
+        for c in self.cycles:
+            c.__closeScratch__()
+
+        #Run Final RRA Solution
+        log.info('solution found, or max iterations reached (%s)', S.stopReason)
+        # Find the best solution and re-run it to make sure our results are current
+        idx = int(np.argmin(S.ObjFuncValues.array())) # first occurrence of the minimum
 
         # Assign the tracking weight values
-        S.xbest = S.xnew #Initialize
-        for i_coord in range(0,len(S.xnew.names)-1):
-            S.xbest.values[i_coord] = bestSoln[i_coord]
+        S.xbest = S.xnew.copy() #Initialize
+        S.xbest.values = S.TestedSolutions[idx].copy()
+        S.xbest.rmsErr = S.RMSErrors[idx].copy()
         
         # Create setup file and task set with final tracking weights
         S.trackingWeights = S.xbest
-        taskSetFilenametemplate = os.path.join(self.fileset.trialpath,'RRA_Tasks.xml')
+        taskSetFilenametemplate = os.path.join(self.fileset.trialpath,self.fileset.taskfile)
         taskSetFilenamenew = os.path.join(self.fileset.optpath,'Tasks','RRA_Final_Tasks.xml')
         newtaskSetFilename = self.__writeTrackingWeights__(taskSetFilenametemplate,taskSetFilenamenew,S.xbest)
 
         # Run RRA with current iteration values
-        #load RRATool to assess trial variables and update RRA tool for opt itrs.
-        rratool = osim.RRATool(os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile))
-
-        # update rra steup tool parameters
-        rratool.setName('RRA')
-        rratool.setModelFilename(os.path.join(self.fileset.trialpath,self.fileset.adjname))
-        rratool.setOutputModelFileName(os.path.join(self.fileset.trialpath,self.fileset.optname))
-        rratool.setResultsDir(self.fileset.finalpath)
-        rratool.setTaskSetFileName(newtaskSetFilename)
-        rratool.setMaximumNumberOfSteps(20000)
         rraSetupFile = os.path.join(self.fileset.optpath,'RRA_Final_Setup.xml')
-        rratool.printToXML(rraSetupFile)
-
+        self.__writeOptSetup__('RRA',rraSetupFile,newtaskSetFilename,resultsdir = self.fileset.finalpath,
+                                outputmodel = os.path.join(self.fileset.trialpath,self.fileset.optname))
 
         #Run RRA tool from command line inside matlab
         if not(os.path.isdir(self.fileset.finalpath)):
             os.mkdir(self.fileset.finalpath)
 
-        mydir = os.getcwd()
-        os.chdir(self.fileset.finalpath)
-        
-        command_rra = 'opensim-cmd run-tool ' + rraSetupFile
-        os.system(command_rra)
+        bestdir = os.path.join(self.fileset.optpath,'Best')
+        if not rerun_final and idx > 0 and S.bestRetained == idx and os.path.isdir(bestdir):
+            # the outputs of the best evaluation were kept when it was found
+            self.__promoteBest__(S,bestdir)
+            for c in self.cycles:
+                if not(os.path.isdir(c.fileset.finalpath)):
+                    os.mkdir(c.fileset.finalpath)
+                c.__promoteBest__(S,os.path.join(c.fileset.optpath,'Best'))
+            S.finalStatus = 'promoted'
+            S.finalTime = 0
+        elif self.cycles:
+            # the same weights on every cycle, run at once
+            jobs = [(rraSetupFile,self.fileset.finalpath)]
+            for c in self.cycles:
+                taskfile = c.__writeTrackingWeights__(os.path.join(c.fileset.trialpath,c.fileset.taskfile),
+                                                      os.path.join(c.fileset.optpath,'Tasks','RRA_Final_Tasks.xml'),S.xbest)
+                csetupfile = os.path.join(c.fileset.optpath,'RRA_Final_Setup.xml')
+                c.__writeOptSetup__('RRA',csetupfile,taskfile,resultsdir = c.fileset.finalpath,
+                                    outputmodel = os.path.join(c.fileset.trialpath,c.fileset.optname))
+                if not(os.path.isdir(c.fileset.finalpath)):
+                    os.mkdir(c.fileset.finalpath)
+                jobs.append((csetupfile,c.fileset.finalpath))
+            statuses = self.__runJobs__(jobs)
+            for c, status in zip(self.cycles,statuses[1:]):
+                if not status.succeeded():
+                    log.warning('final RRA failed on %s (%s)', c.fileset.trialpath, status.status())
+            S.finalStatus = statuses[0].status()
+            S.finalTime = statuses[0].walltime
+        else:
+            status = self.__runRRA__(rraSetupFile,self.fileset.finalpath)
+            S.finalStatus = status.status()
+            S.finalTime = status.walltime
+        self.__saveProgress__(S,'finished')
+
+        if self.indexfile is not None:
+            # incremental update of the study index with this trial
+            # (under the index lock, as other trials may be finishing at the same time)
+            rraindex.add(self.indexfile,rraindex.trialsummary(self.fileset.trialpath,participant = self.participant,condition = self.condition or ''))
+        return(S)
 
-        os.chdir(mydir)
 
+    def selectTradeoff(self, wRes, wErr, run = True):
+        """
+        Picks the tracking weights for another weighting of the residual and tracking
+        error cost terms from a finished TWSA, without repeating the optimization. The
+        evaluation minimizing wRes*sumRMSResiduals/6 + wErr*sumRMSErrors/ncoords (powers
+        pRes and pErr as in the run) always lies on the non-dominated archive, which 
+        optimizeTrackingWeights(pareto = True) spreads along the whole front.
+        Returns the index of the selected evaluation and its tracking weights.
+            Optional keyword arguments:
+                run -- boolean to run RRA with the selected weights (default = True). Results
+                 are written to RRA_Final_<wRes>_<wErr> and the model to <model>_Final_<wRes>_<wErr>.osim
+        """
+        with open(os.path.join(self.fileset.optpath,'opt_results.optStruct'),'rb') as input_file:
+            S = pickle.load(input_file)
+        archive = self.__paretoArchive__(S)
+        if not archive:
+            raise ValueError('no successful TWSA evaluations in ' + self.fileset.optpath)
+        points = self.__paretoPoints__(S)[archive]
+        idx = archive[int(np.argmin(wRes*points[:,0] + wErr*points[:,1]))]
+
+        x = S.xcurrent.copy()
+        x.values = S.TestedSolutions[idx].copy()
+        x.rmsErr = S.RMSErrors[idx].copy()
+        tag = '%g_%g' % (wRes,wErr)
+        taskSetFilenametemplate = os.path.join(self.fileset.trialpath,self.fileset.taskfile)
+        taskSetFilenamenew = os.path.join(self.fileset.optpath,'Tasks','RRA_Final_' + tag + '_Tasks.xml')
+        newtaskSetFilename = self.__writeTrackingWeights__(taskSetFilenametemplate,taskSetFilenamenew,x)
+        log.info('weighting %s: evaluation %d of %d archived solutions', tag, idx, len(archive))
+
+        if run:
+            resultsdir = self.fileset.finalpath + '_' + tag
+            if not(os.path.isdir(resultsdir)):
+                os.mkdir(resultsdir)
+            rraSetupFile = os.path.join(self.fileset.optpath,'RRA_Final_' + tag + '_Setup.xml')
+            self.__writeOptSetup__('RRA',rraSetupFile,newtaskSetFilename,resultsdir = resultsdir,
+                                    outputmodel = os.path.join(self.fileset.trialpath,self.fileset.optname.replace('.osim','_' + tag + '.osim')))
+            status = self.__runRRA__(rraSetupFile,resultsdir)
+            log.info('weighting %s: final RRA %s', tag, status.status())
+        return(idx, x)
 
         
     def __readTrackingWeights__(self,taskSetFilename,rotNormF,transNormF): 
-        print('reading tracking weights')
+        log.debug('reading tracking weights')
         #Default normalization factors
         
         rmsNormFactor_trans = transNormF
         rmsNormFactor_rot = rotNormF*(math.pi/180)
 
         #Grab the xml document that defines the tracking weights
-        RRATask = osim.CMC_TaskSet(taskSetFilename)
-        num = RRATask.getSize()
+        RRATask = self._templates.get(rraxml.tasktemplate,taskSetFilename)
+        names = RRATask.names
+        weights = RRATask.weights()
 
-        #print(num)
-        trackingWeights = self._weightStruct()
         #Parse tracking weights into structure 
-        for i_weight in range(0,num):
+        normFactors = []
+        for i_weight in range(0,len(names)):
 
-            currWeightName = str(RRATask.get(i_weight).getName())
-            print(currWeightName)
+            currWeightName = names[i_weight]
+            log.debug(currWeightName)
 
-            currWeightValue = RRATask.get(i_weight).getWeight(0)
-
-            trackingWeights.names.append(currWeightName) 
-            trackingWeights.values.append(currWeightValue) 
-            trackingWeights.rmsErr.append(10000)
             if currWeightName.lower() in ['pelvis_tx','pelvis_ty','pelvis_tz']:
-                trackingWeights.rmsNormFactor.append(rmsNormFactor_trans)
+                normFactors.append(rmsNormFactor_trans)
             else:
-                trackingWeights.rmsNormFactor.append(rmsNormFactor_rot)
+                normFactors.append(rmsNormFactor_rot)
             
-        
+        trackingWeights = self._weightStruct(names, weights, [10000]*len(names), normFactors)
         return(trackingWeights)
     #readTrackingWeights function
 
@@ -749,23 +1107,12 @@ class rrasetup: # constructor method
     #**************************************************************************
     # Function: Write task Set file with defined list of task weights
     def __writeTrackingWeights__(self,taskSetFilenameOld,taskSetFilenameNew,trackingWeights):
-        print('writing tracking weights')
-        #Grab the xml document that defines the tracking weights
-        RRATask = osim.CMC_TaskSet(taskSetFilenameOld)
-        num = RRATask.getSize()
-
-        #Parse tracking weights into structure 
-        for i_weight in range(0,num-1):
-            # assign task weight for each coordinate in optfunction
-            coorname = str(RRATask.get(i_weight).getName())
-            try:
-                loc = trackingWeights.names.index(coorname)
-                RRATask.get(i_weight).setWeight(trackingWeights.values[loc],1,1)
-            except ValueError:
-                break        
+        log.debug('writing tracking weights')
+        #Grab the xml document that defines the tracking weights (parsed once, then patched)
+        RRATask = self._templates.get(rraxml.tasktemplate,taskSetFilenameOld)
 
-        #write xml file with xmlwrite and remove extra spaces in file
-        RRATask.printToXML(taskSetFilenameNew)
+        # assign task weight for each coordinate in optfunction and write the xml file
+        RRATask.write(taskSetFilenameNew,trackingWeights.names,trackingWeights.values)
 
         return(taskSetFilenameNew)
     #writeTrackingWeights function
@@ -773,177 +1120,278 @@ class rrasetup: # constructor method
 
         #**************************************************************************
         # Function: calculate objective function value for RRA iterations
-    def __calculateObjectiveFunction__(self,S):
+    def __calculateObjectiveFunction__(self,S,status = None,resultsdir = None):
         #The objective function value is returned in the field 'fnew' of the
-        #structure S.
-        #=========================================
-        # Import the actuation forces and moments
-        #=========================================
+        #structure S. status is the rrarunner.runresult of the RRA run; failed
+        #and timed out runs are scored inf.
 
         # JS
         # normalization factors for the residuals, adapted from OpenSim
         # Guidelines. Assume peak force is ~1.3 body weights. Good assumption for walking, but could be improved to find peak grf value instead
-        #import pandas
-        #import re
-        print('calculating objective function: iteration  ' + str(S.itr))
+        log.debug('calculating objective function: iteration %d', S.itr)
 
         # forceNormF = 1.3*9.81*mass*0.05 # 5 percent body_weight * 1.3 (Osim Guidelines are < 5 percent max ext force)
         # momentNormF = forceNormF/5 # 1 percent body_weight * 1.3 (Osim guidelines are < 1 percent COM height*max ext force)
 
         if S.itr == 0:
-            filename = os.path.join(self.fileset.optpath,'Results','optItr_'+str(S.itr)+'_Actuation_force.sto')  
+            toolname = 'optItr_'+str(S.itr)
         else: 
-            filename = os.path.join(self.fileset.optpath,'Results','optItr'+'_Actuation_force.sto')
-        
-        if os.path.isfile(filename): #if RRA runs to completion, calculate objective function value from itration 
-            regexp = re.compile(r"endheader?") # find the header line in the data file
-            with open(filename) as f: 
-                lines = f.readlines()
-                for l in range(0,len(lines)-1):
-                    if regexp.match(lines[l]) != None: 
-                        headerlines = l+1
-
-            print('reading actuation file')
-            residuals = pandas.read_csv(filename, sep = '\t', header = headerlines, skip_blank_lines=False)
-            arrayMX = []; arrayMY = []; arrayMZ = []
-            arrayFX = []; arrayFY = []; arrayFZ = []
-            for idx in range(0,len(residuals)-1):
-                arrayMX.append(residuals.MX[idx])
-                arrayMY.append(residuals.MY[idx])
-                arrayMZ.append(residuals.MZ[idx])
-                arrayFX.append(residuals.FX[idx])
-                arrayFY.append(residuals.FY[idx])
-                arrayFZ.append(residuals.FZ[idx])
-
-            rmsFX = np.sqrt(np.mean(np.array(arrayFX)**2))
-            rmsFY = np.sqrt(np.mean(np.array(arrayFY)**2))
-            rmsFZ = np.sqrt(np.mean(np.array(arrayFZ)**2))
-            rmsMX = np.sqrt(np.mean(np.array(arrayMX)**2))
-            rmsMY = np.sqrt(np.mean(np.array(arrayMY)**2))
-            rmsMZ = np.sqrt(np.mean(np.array(arrayMZ)**2))
-
-            nresiduals = 6
-
-            # Sum of RMS forces, normalized to OpenSim guidelines, raised to the specified power
-            sumRMSForces = (rmsFX/S.forceNormF)**S.pRes+(rmsFY/S.forceNormF)**S.pRes+(rmsFZ/S.forceNormF)**S.pRes
-            # Sum of RMS moments, normalized to OpenSim guidelines, raised to the specified power
-            sumRMSMoments = (rmsMX/S.momentNormF)**S.pRes+(rmsMY/S.momentNormF)**S.pRes+(rmsMZ/S.momentNormF)**S.pRes
+            toolname = 'optItr'
+
+        if resultsdir is None:
+            resultsdir = os.path.join(self.fileset.workpath,'Results')
+        S.fnew, components, rmsErr = self.__scoreResults__(S,S.xnew,toolname,resultsdir,status)
+        if self.cycles:
+            S.fnew, components, rmsErr = self.__scoreCycles__(S,toolname,[S.fnew,components,rmsErr])
+        if status is not None:
+            S.RunStatus.append(status.status())
+            S.RunTimes.append(status.walltime)
+            S.RunCPUTimes.append(status.cputime if status.cputime is not None else math.nan)
+            S.RunMemory.append(status.maxrss if status.maxrss is not None else math.nan)
+            steps, hitLimit = self.__integratorStats__(status,toolname,resultsdir)
+            S.RunSteps.append(steps)
+            S.RunStepLimit.append(hitLimit)
+            if hitLimit:
+                log.warning('RRA run of iteration %d hit the integrator step limit', S.itr)
+
+        # update results data
+        S.sumRMSResiduals.append(components[0])
+        S.sumRMSForces.append(components[1])
+        S.sumRMSMoments.append(components[2])
+        S.sumRMSErrors.append(components[3])
+        #Assign rmserror used to generate next solution of task values
+        S.xnew.rmsErr[:] = rmsErr
+        S.RMSErrors.append(S.xnew.rmsErr)
+
+        # keep the outputs of a new best evaluation before the next run overwrites them
+        objvals = S.ObjFuncValues.array()
+        if math.isfinite(S.fnew) and (len(objvals) == 0 or S.fnew < objvals.min()):
+            for c, cstatus, cresultsdir in self._cycleRuns:
+                c.__retainBest__(S,toolname,cresultsdir)
+            self.__retainBest__(S,toolname,resultsdir)
+        log.debug('iteration %d objective value: %s', S.itr, S.fnew)
             
-            sumMaxForces = (max(abs(np.array(arrayFX)))/S.forceNormF)**S.pRes+(max(abs(np.array(arrayFY)))/S.forceNormF)**S.pRes+(max(abs(np.array(arrayFZ)))/S.forceNormF)**S.pRes
+        return S
+        #calculateObjectiveFunction function
 
-            # Total sum of RMS forces and moments cost terms
-            sumRMSResiduals = sumRMSForces+sumRMSMoments
-            
-            # update results data
-            S.sumRMSResiduals = np.append(S.sumRMSResiduals,sumRMSResiduals)
-            S.sumRMSForces = np.append(S.sumRMSForces,sumRMSForces)
-            S.sumRMSMoments = np.append(S.sumRMSMoments,sumRMSMoments)
-            # sumRMSResiduals = sumMaxForces+sumRMSMoments
-
-            #=========================================
-            # Import the Errors
-            #=========================================
-            if S.itr == 0:            
-                filename = os.path.join(self.fileset.optpath,'Results','optItr_'+str(S.itr)+'_pErr.sto')
-            else:
-                filename = os.path.join(self.fileset.optpath,'Results','optItr'+'_pErr.sto')
 
-            print('reading errors file')
-            regexp = re.compile(r"endheader?") # find the header line in the data file
-            with open(filename) as f: 
-                lines = f.readlines()
-                for l in range(0,len(lines)-1):
-                    if regexp.match(lines[l]) != None: 
-                        headerlines = l+1
+        #**************************************************************************
+        # Function: integrator statistics of one RRA run
+    def __integratorStats__(self,status,toolname,resultsdir):
+        # Returns the number of integrator steps taken and whether the run hit the
+        # step limit. RRA records the states at every integrator step, so the steps
+        # are the rows of the states file. The limit applies to each control interval,
+        # not the whole run, so it is detected from the tool's message or, for a run
+        # that completed, from the states ending before the final time of the trial
+        # setup (TWSA runs keep its time window). The states file of a failed run may
+        # be left over from an earlier run, so it is not used.
+        steps = math.nan
+        output = (status.stdout or '') + (status.stderr or '')
+        hitLimit = bool(_STEPLIMIT.search(output))
+        statesfile = os.path.join(resultsdir,toolname+'_states.sto')
+        if not status.succeeded() or not os.path.isfile(statesfile):
+            return(steps, hitLimit)
+        steps = max(rrastorage.countRows(statesfile)-1,0) # the first row is the initial state
+        if not hitLimit:
+            setup = self._templates.get(rraxml.setuptemplate,os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile))
+            try:
+                t1 = float(setup.get('final_time'))
+                window = float(setup.get('cmc_time_window') or 0.01)
+            except (TypeError, ValueError):
+                t1 = math.nan
+            tend = rrastorage.lastTime(statesfile)
+            hitLimit = bool(math.isfinite(t1) and math.isfinite(tend) and tend < t1 - window)
+        return(steps, hitLimit)
+
+
+        #**************************************************************************
+        # Function: score the results of one RRA run without modifying the optimization structure
+    def __scoreResults__(self,S,x,toolname,resultsdir,status = None,norms = None):
+        # Returns the objective function value, the cost terms 
+        # [sumRMSResiduals, sumRMSForces, sumRMSMoments, sumRMSErrors] and the
+        # RMS tracking error of every coordinate in x. A run that did not 
+        # complete, exited with an error or timed out scores inf. norms are the
+        # residual force and moment normalization factors of another cycle.
+        forceNormF, momentNormF = norms if norms is not None else (S.forceNormF, S.momentNormF)
+        #=========================================
+        # Import the actuation forces and moments
+        #=========================================
+        if status is not None and not status.succeeded(): # results on disk (if any) are stale
+            return(math.inf, [math.inf]*4, [math.inf]*len(x.names))
+        result = self.__readResult__(status,resultsdir,toolname,'Actuation_force')
+        if result is None: #if RRA iteration do not run to completion set new opt funt value to inf
+            return(math.inf, [math.inf]*4, [math.inf]*len(x.names))
+
+        labels, residuals = result
+        arrayMX = rrastorage.column(labels,residuals,'MX')
+        arrayMY = rrastorage.column(labels,residuals,'MY')
+        arrayMZ = rrastorage.column(labels,residuals,'MZ')
+        arrayFX = rrastorage.column(labels,residuals,'FX')
+        arrayFY = rrastorage.column(labels,residuals,'FY')
+        arrayFZ = rrastorage.column(labels,residuals,'FZ')
+
+        rmsFX = np.sqrt(np.mean(np.array(arrayFX)**2))
+        rmsFY = np.sqrt(np.mean(np.array(arrayFY)**2))
+        rmsFZ = np.sqrt(np.mean(np.array(arrayFZ)**2))
+        rmsMX = np.sqrt(np.mean(np.array(arrayMX)**2))
+        rmsMY = np.sqrt(np.mean(np.array(arrayMY)**2))
+        rmsMZ = np.sqrt(np.mean(np.array(arrayMZ)**2))
+
+        nresiduals = 6
+
+        # Sum of RMS forces, normalized to OpenSim guidelines, raised to the specified power
+        sumRMSForces = (rmsFX/forceNormF)**S.pRes+(rmsFY/forceNormF)**S.pRes+(rmsFZ/forceNormF)**S.pRes
+        # Sum of RMS moments, normalized to OpenSim guidelines, raised to the specified power
+        sumRMSMoments = (rmsMX/momentNormF)**S.pRes+(rmsMY/momentNormF)**S.pRes+(rmsMZ/momentNormF)**S.pRes
+
+        # Total sum of RMS forces and moments cost terms
+        sumRMSResiduals = sumRMSForces+sumRMSMoments
+        # sumRMSResiduals = sumMaxForces+sumRMSMoments
+
+        #=========================================
+        # Import the Errors
+        #=========================================
+        result = self.__readResult__(status,resultsdir,toolname,'pErr')
+        if result is None:
+            return(math.inf, [math.inf]*4, [math.inf]*len(x.names))
 
-            trackingErr = pandas.read_csv(filename, sep = '\t', header = headerlines, skip_blank_lines = False)
+        labels, trackingErr = result
 
-            #rmsErr = zeros(size([S.xnew.value]))
-            rmsErr = []
-            for i_coord in range(1,len(S.xnew.names)): 
+        costErr = []
+        rmsErr = []
+        for i_coord in range(0,len(x.names)): 
 
-                my_err = trackingErr.loc[:,S.xnew.names[i_coord]]
-                my_sqerr = my_err.pow(2,axis = 0)
-                rms = np.sqrt(my_sqerr.mean(axis = 0))
-                # calculate objective contribution for each coordinate error
-                rmsErr.append((rms/S.xnew.rmsNormFactor[i_coord])**S.pErr)
-                S.xnew.rmsErr[i_coord] = rms
+            my_err = rrastorage.column(labels,trackingErr,x.names[i_coord])
+            rms = np.sqrt(np.mean(my_err**2))
+            # calculate objective contribution for each coordinate error
+            costErr.append((rms/x.rmsNormFactor[i_coord])**S.pErr)
+            rmsErr.append(rms)
+        
+        # total tracking errors cost
+        sumRMSErrors = sum(costErr)
 
-            
-            # total tracking errors cost
-            sumRMSErrors = sum(rmsErr)
-            S.sumRMSErrors = np.append(S.sumRMSErrors,sumRMSErrors)
-            
+        ncoords = len(x.names)
 
-            
-            ncoords = len(S.xnew.names)
-
-            # CALCULATE THE TOTAL OBJECTIVE FUNCTION
-            S.fnew = S.wRes*(1/nresiduals)*sumRMSResiduals + S.wErr*(1/ncoords)*sumRMSErrors
-            print('new ojective value: ' + str(S.fnew))
-
-        else: #if RRA iteration do not run to completion set new opt funt value to inf
-            S.fnew= math.inf
-            S.sumRMSErrors = np.append(S.sumRMSErrors,math.inf)
-            S.sumRMSForces = np.append(S.sumRMSForces,math.inf)
-            S.sumRMSMoments = np.append(S.sumRMSMoments,math.inf)
-            S.sumRMSResiduals = np.append(S.sumRMSResiduals,math.inf)
-            for i_coord in range(0,len(S.xnew.names)-1):
-                #Assign maximum value for rmserror used to generate next solution of task values
-                S.xnew.rmsErr[i_coord] = math.inf
-            
-        return S
-        #calculateObjectiveFunction function
+        # CALCULATE THE TOTAL OBJECTIVE FUNCTION
+        fnew = S.wRes*(1/nresiduals)*sumRMSResiduals + S.wErr*(1/ncoords)*sumRMSErrors
 
+        return(fnew, [sumRMSResiduals, sumRMSForces, sumRMSMoments, sumRMSErrors], rmsErr)
+        #scoreResults function
 
-        #**************************************************************************
-        # Function: Run RRA iterations with course optimization for task weights
-    def __RHCP_itr__(self,S):
-        print('RHCP_itr')
-        from random import sample
-        #=========================================
-        # Generate New Set of Task values
-        #=========================================
+
+    #**************************************************************************
+    # Function: run a candidate on this trial and (in joint mode) on every other cycle
+    def __runEvaluation__(self,S,setupfile,resultsdir,toolname,adjustCOM = None):
+        # returns the run status of this trial; the runs of the other cycles are kept
+        # in self._cycleRuns for __calculateObjectiveFunction__
+        if not self.cycles:
+            self._cycleRuns = []
+            return(self.__runRRA__(setupfile,resultsdir))
+        jobs = [(setupfile,resultsdir)]
+        for c in self.cycles:
+            taskfile = c.__writeTrackingWeights__(os.path.join(c.fileset.trialpath,c.fileset.taskfile),
+                                                  os.path.join(c.fileset.workpath,'Tasks','optItr_'+str(S.itr)+'_Tasks.xml'),S.xnew)
+            csetupfile = os.path.join(c.fileset.workpath,'optItr_'+str(S.itr)+'_Setup.xml')
+            c.__writeOptSetup__(toolname,csetupfile,taskfile,adjustCOM = adjustCOM)
+            jobs.append((csetupfile,os.path.join(c.fileset.workpath,'Results')))
+        statuses = self.__runJobs__(jobs)
+        self._cycleRuns = [(c,statuses[k+1],jobs[k+1][1]) for k, c in enumerate(self.cycles)]
+        return(statuses[0])
+
+
+    #**************************************************************************
+    # Function: aggregate the scores of this trial and the other cycles
+    def __scoreCycles__(self,S,toolname,score):
+        scores = [score]
+        for k, (c, status, resultsdir) in enumerate(self._cycleRuns):
+            scores.append(c.__scoreResults__(S,S.xnew,toolname,resultsdir,status,S.cycleNorms[k]))
+            if not status.succeeded():
+                log.warning('RRA run of iteration %d failed on %s', S.itr, c.fileset.trialpath)
+        fvals = [f for f, components, rmsErr in scores]
+        S.CycleObjFuncValues.append(fvals)
+        S.CycleResiduals.append([components[0] for f, components, rmsErr in scores])
+        S.CycleErrors.append([components[3] for f, components, rmsErr in scores])
+
+        combine = np.max if S.aggregate == 'max' else np.mean
+        fnew = float(combine(fvals))
+        components = [float(v) for v in combine(np.array([components for f, components, rmsErr in scores]),axis = 0)]
+        rmsErr = [float(v) for v in combine(np.array([rmsErr for f, components, rmsErr in scores]),axis = 0)]
+        return(fnew, components, rmsErr)
+
+
+    #**************************************************************************
+    # Function: one result storage of an RRA run as (labels, data)
+    def __readResult__(self,status,resultsdir,toolname,suffix):
+        # in-process runs hand over their storages in memory; otherwise read the
+        # printed file. None if the run did not produce it.
+        if status is not None and status.storages is not None and suffix in status.storages:
+            return(status.storages[suffix])
+        filename = os.path.join(resultsdir,toolname+'_'+suffix+'.sto')
+        if not os.path.isfile(filename):
+            return(None)
+        log.debug('reading %s', filename)
+        header, labels, data = rrastorage.readStorage(filename)
+        return(labels, data)
+
+
+    #**************************************************************************
+    # Function: draw a new, untested candidate around the current solution
+    def __perturbWeights__(self,S,pending = ()):
+        # random draws come from S.rng, so speculative runs can rewind it
         #Randomly generate a new solution, but it must not be one that has been
         #previously tested
+        # coordinates perturbed on this iteration (all of them unless block-coordinate mode is on)
+        active = self.__activeCoordinates__(S)
+
         xunique = False
+        draws = 0
+        scale = 1 # multiplies the step exponents once redrawing keeps failing
         while xunique==False:
-            print('perturbing weights')
+            draws = draws + 1
+            if draws > MAXDRAWS:
+                # the neighbours of the active coordinates have all been tested (e.g. a
+                # group with a single free coordinate): perturb every coordinate, then widen the step
+                if len(active) < len(S.xcurrent.names):
+                    log.info('no untested candidate in the active group, perturbing all coordinates')
+                    active = list(range(0,len(S.xcurrent.names)))
+                else:
+                    scale = scale + 1
+                    log.info('no untested candidate nearby, widening the step (x%d)', scale)
+                draws = 1
+            log.debug('perturbing weights')
+            xnew = S.xcurrent.copy()
             #TEST FEATURE
             #Bias the shift based on the tracking error
-            print(len(S.xcurrent.names))
-            print(S.xcurrent.names)
-            for i_coord in range(0,len(S.xcurrent.names)-1):
-                print(S.xcurrent.names[i_coord])
-                if S.xcurrent.names[i_coord].lower() in ['pelvis_tx','pelvis_ty','pelvis_tz']:
-                    # bounds adjusted by JS to evaluate how much this
-                    # influences resulting tracking error.
-                    lb = 0.5*S.transNormF
-                    ub = S.transNormF
-                else:
-                    lb = 0.5*S.rotNormF*(math.pi/180)
-                    ub = S.rotNormF*(math.pi/180)
-                
-                print('lower: '+ str(lb) + ' upper: ' + str(ub))
+            log.debug('%d coordinates: %s', len(S.xcurrent.names), S.xcurrent.names)
+            for unit in self.__perturbationUnits__(S,active):
+                zones = []
+                for i_coord in unit:
+                    lb, ub = self.__trackingBounds__(S,S.xcurrent.names[i_coord])
+                    log.debug('%s lower: %s upper: %s', S.xcurrent.names[i_coord], lb, ub)
+                    if S.xcurrent.rmsErr[i_coord] < lb:
+                        zones.append('green')
+                    elif S.xcurrent.rmsErr[i_coord] > ub:
+                        zones.append('red')
+                    else:
+                        zones.append('yellow')
 
-                #Bias the tracking weight change
-                if S.xcurrent.rmsErr[i_coord] < lb:
-                    print('green')
+                #Bias the tracking weight change (a tied pair follows its worse side)
+                if all(z == 'green' for z in zones):
+                    log.debug('green')
                     #If we are in the green, tend to decrease the weight
                     #t = randsample([-1,-1,-1,0,1],1)
-                    t = sample([-2,-1,-1,0,1],1) # JS
-                elif S.xcurrent.rmsErr[i_coord] > ub:
-                    print('red')
+                    t = S.rng.sample([-2,-1,-1,0,1],1) # JS
+                elif 'red' in zones:
+                    log.debug('red')
                     #If we are in the red, tend to increase the weight
                     #t = randsample([-1,0,1,1,1],1)
-                    t = sample([-1,0,1,1,2],1) # JS
+                    t = S.rng.sample([-1,0,1,1,2],1) # JS
                 else:
-                    print('yellow')
+                    log.debug('yellow')
                     #Otherwise, equal chances
                     #t = randsample([-1,0,1],1)
-                    t = sample([-2,0,-1,0,1,0,2],1) # JS
+                    t = S.rng.sample([-2,0,-1,0,1,0,2],1) # JS
                     
-                print('resolution')
                 #Use finer resolution as we get further along
                 if S.itr<=math.floor(S.i_max/2):
                     base = 1.5
@@ -954,57 +1402,91 @@ class rrasetup: # constructor method
                 else:
                     base = 1.5
 
-                print(t)
 
-                tau = base**t[0]
-                print('tau: ' + str(tau))
-                S.xnew.values[i_coord] = tau*S.xcurrent.values[i_coord]
+                tau = base**(scale*t[0])
+                log.debug('t: %s tau: %s', t, tau)
+                for i_coord in unit:
+                    xnew.values[i_coord] = tau*S.xcurrent.values[i_coord]
+                if len(unit) == 2:
+                    self.__tiePair__(S,xnew.values,unit,base)
 
             #Check if this solution has been tested previously
-            for x in range(0,len(S.TestedSolutions)):
-                 if np.array_equal( S.TestedSolutions[x], np.array(S.xnew.values) ):
-                     print('Identical weights already used, reselecting...')
-                     xunique = False
-                     break
-                 else:
-                     xunique = True
-            #all(first == x for x in iterator)
-
-        print('Weights: ' + str(S.xnew.values))
-        print('tested weights: ' + str(S.TestedSolutions))
+            # (speculative candidates still running count as tested)
+            tested = [S.TestedSolutions.array()] if len(S.TestedSolutions) else []
+            tested = tested + [np.atleast_2d(x.values) for x in pending]
+            if tested and np.all(np.vstack(tested) == xnew.values, axis = 1).any():
+                log.debug('Identical weights already used, reselecting...')
+                xunique = False
+            else:
+                xunique = True
+
+        return(xnew)
+
+
+        #**************************************************************************
+        # Function: Run RRA iterations with course optimization for task weights
+    def __RHCP_itr__(self,S):
+        log.debug('RHCP_itr')
+        #=========================================
+        # Generate New Set of Task values
+        #=========================================
+        S.xnew = self.__perturbWeights__(S)
+
+        log.debug('Weights: %s', S.xnew.values)
+        log.debug('tested weights: %s', S.TestedSolutions)
         #xunique = True
             
 
-        print('tracking weights: ' + str(S.xnew))
         #=========================================
         # Assign Task set values to Task List
         #=========================================
         S.trackingWeights = S.xnew
-        taskSetFilenametemplate = os.path.join(self.fileset.trialpath,'RRA_Tasks.xml')
-        taskSetFilename = os.path.join(self.fileset.optpath,'Tasks','optItr_'+str(S.itr)+'_Tasks.xml')
+        self.__pruneScratch__()
+        taskSetFilenametemplate = os.path.join(self.fileset.trialpath,self.fileset.taskfile)
+        taskSetFilename = os.path.join(self.fileset.workpath,'Tasks','optItr_'+str(S.itr)+'_Tasks.xml')
         newtaskSetFilename = self.__writeTrackingWeights__(taskSetFilenametemplate,taskSetFilename,S.trackingWeights)
 
         #=====================================
-        #Run RRA with current iteration values
+        #Screen the candidate on the cheap fidelity level
         #=====================================
+        if S.screening is not None:
+            S.fscreen, screenTime = self.__screenCandidate__(S,S.xnew,newtaskSetFilename)
+            S.ScreenValues.append(S.fscreen)
+            bpromote = S.fscreen < S.screening.promoteRatio*S.fcurrentScreen
+            S.Promoted.append(bpromote)
+            if not bpromote:
+                # rejected at the screening level; the full RRA is never run
+                log.info('candidate not promoted (screening value %s)', S.fscreen)
+                S.fnew = math.inf
+                S.sumRMSErrors.append(math.nan)
+                S.sumRMSForces.append(math.nan)
+                S.sumRMSMoments.append(math.nan)
+                S.sumRMSResiduals.append(math.nan)
+                S.RMSErrors.append([math.nan]*len(S.xnew.names))
+                S.RunStatus.append('skipped')
+                S.RunTimes.append(screenTime)
+                S.RunCPUTimes.append(math.nan)
+                S.RunMemory.append(math.nan)
+                S.RunSteps.append(math.nan)
+                S.RunStepLimit.append(False)
+                if self.cycles:
+                    S.CycleObjFuncValues.append([math.nan]*(len(self.cycles)+1))
+                    S.CycleResiduals.append([math.nan]*(len(self.cycles)+1))
+                    S.CycleErrors.append([math.nan]*(len(self.cycles)+1))
+                S.TestedSolutions.append(S.xnew.values)
+                S.ObjFuncValues.append(S.fnew)
+                return(S)
+        else:
+            S.ScreenValues.append(math.nan)
+            S.Promoted.append(True)
 
-        #load RRATool to assess trial variables and update RRA tool for opt itrs.
-        rratool = osim.RRATool(os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile))
-
-        rratool.setName('optItr') # overwrite existing results to save drive space. Otherwise, append tool name with num2str(itr). JS
-        rratool.setModelFilename(os.path.join(self.fileset.trialpath,self.fileset.adjname))
-        rratool.setOutputModelFileName(os.path.join(self.fileset.optpath,self.fileset.adjname))
-        rratool.setResultsDir(os.path.join(self.fileset.optpath,'Results'))
-        rratool.setTaskSetFileName(newtaskSetFilename)
-        rratool.setMaximumNumberOfSteps(20000)
-        rraSetupFile = os.path.join(self.fileset.optpath,'optItr_'+str(S.itr)+'_Setup.xml')
-        rratool.printToXML(rraSetupFile)
-
-        mydir = os.getcwd()
-        os.chdir(os.path.join(self.fileset.optpath,'Results'))
-        command_rra = 'opensim-cmd run-tool ' + rraSetupFile
-        os.system(command_rra)
-        os.chdir(mydir)
+        #=====================================
+        #Run RRA with current iteration values
+        #=====================================
+        # overwrite existing results to save drive space. Otherwise, append tool name with num2str(itr). JS
+        rraSetupFile = os.path.join(self.fileset.workpath,'optItr_'+str(S.itr)+'_Setup.xml')
+        self.__writeOptSetup__('optItr',rraSetupFile,newtaskSetFilename)
+        status = self.__runEvaluation__(S,rraSetupFile,os.path.join(self.fileset.workpath,'Results'),'optItr')
 
         #------------------------
         #Evaluate RRA results
@@ -1012,28 +1494,375 @@ class rrasetup: # constructor method
         #Calculate new objective function value
 
 
-        S = self.__calculateObjectiveFunction__(S)
+        S = self.__calculateObjectiveFunction__(S,status)
+        if S.screening is not None:
+            S.RunTimes[-1] = S.RunTimes[-1] + screenTime
 
         #Store the solutions we have explored
-        S.TestedSolutions.append(np.array(S.xnew.values))
-        S.ObjFuncValues = np.append(S.ObjFuncValues,S.fnew)
+        S.TestedSolutions.append(S.xnew.values)
+        S.ObjFuncValues.append(S.fnew)
+
+        return(S)
+
+
+    #**************************************************************************
+    # Function: keep the outputs and adjusted model of the best evaluation so far
+    def __retainBest__(self,S,toolname,resultsdir):
+        bestdir = os.path.join(self.fileset.optpath,'Best')
+        if os.path.isdir(bestdir):
+            shutil.rmtree(bestdir)
+        os.mkdir(bestdir)
+
+        # results are overwritten by the next run anyway, so move rather than copy; only
+        # this run's outputs ('optItr_' would also match those of the initial run, optItr_0)
+        for suffix in RRAOUTPUTS:
+            name = toolname + '_' + suffix
+            if os.path.isfile(os.path.join(resultsdir,name)):
+                shutil.move(os.path.join(resultsdir,name),os.path.join(bestdir,name))
+        # adjusted model: written next to the results by a broker worker, else to the output model path
+        for model in [os.path.join(resultsdir,self.fileset.adjname),os.path.join(self.fileset.workpath,self.fileset.adjname)]:
+            if os.path.isfile(model):
+                shutil.copy(model,os.path.join(bestdir,self.fileset.adjname))
+                break
 
+        S.bestRetained = len(S.ObjFuncValues) # index the evaluation is stored under
+        S.bestToolname = toolname
+        log.debug('retained outputs of evaluation %d in %s', S.bestRetained, bestdir)
+        return(S)
+
+
+    #**************************************************************************
+    # Function: promote the retained best outputs to the final RRA results and model
+    def __promoteBest__(self,S,bestdir):
+        for name in os.listdir(bestdir):
+            if name == self.fileset.adjname:
+                shutil.copy(os.path.join(bestdir,name),os.path.join(self.fileset.trialpath,self.fileset.optname))
+            elif name.startswith(S.bestToolname + '_'):
+                # name the files as if the final run had produced them
+                shutil.copy(os.path.join(bestdir,name),os.path.join(self.fileset.finalpath,'RRA_' + name[len(S.bestToolname)+1:]))
+        log.info('promoted outputs of evaluation %d to %s', S.bestRetained, self.fileset.finalpath)
+        return
+
+
+    #**************************************************************************
+    # Function: write an RRA setup file for an optimization run
+    def __writeOptSetup__(self,toolname,setupfile,taskfile,resultsdir = None,outputmodel = None,adjustCOM = None,fidelity = None):
+        if resultsdir is None:
+            resultsdir = os.path.join(self.fileset.workpath,'Results')
+        if outputmodel is None:
+            outputmodel = os.path.join(self.fileset.workpath,self.fileset.adjname)
+
+        # RRA setup template, parsed once and patched for each run
+        rratool = self._templates.get(rraxml.setuptemplate,os.path.join(self.fileset.trialpath,self.fileset.rrasetupfile))
+
+        #set RRA parameters (model files, task list name, results dir)
+        props = {'model_file': os.path.join(self.fileset.trialpath,self.fileset.adjname),
+                 'output_model_file': outputmodel,
+                 'results_directory': resultsdir,
+                 'task_set_file': taskfile,
+                 'maximum_number_of_integrator_steps': MAXSTEPS}
+        if adjustCOM is not None:
+            props['adjust_com_to_reduce_residuals'] = adjustCOM
+
+        if fidelity is not None:
+            # cheap evaluation: shorter window, coarser kinematics, looser integrator
+            t0 = float(rratool.get('initial_time'))
+            t1 = float(rratool.get('final_time'))
+            props['final_time'] = t0 + fidelity.window*(t1-t0)
+            props['maximum_number_of_integrator_steps'] = fidelity.maxSteps
+            props['integrator_error_tolerance'] = fidelity.errorTolerance
+            props['adjust_com_to_reduce_residuals'] = False
+            if fidelity.decimate > 1:
+                kinsrc = rratool.get('desired_kinematics_file') or os.path.join(self.fileset.trialpath,self.fileset.kinfile)
+                kinfile = os.path.join(self.fileset.workpath,os.path.basename(kinsrc).replace('.mot','_screen.mot'))
+                if not os.path.isfile(kinfile):
+                    self.__decimateMotion__(kinsrc,kinfile,fidelity.decimate)
+                props['desired_kinematics_file'] = kinfile
+
+        # print rra setup file 
+        rratool.write(setupfile,name = toolname,**props)
+        return(setupfile)
+
+
+    #**************************************************************************
+    # Function: run the RRA tool from the command line
+    def __runRRA__(self,setupfile,resultsdir):
+        # run from the results folder so err and out files are written there. 
+        # Returns an rrarunner.runresult with the exit status and wall time.
+        if self.broker is None:
+            if self.inprocess:
+                if self._inprocess is None:
+                    self._inprocess = rrainprocess.inprocessrunner()
+                return(self._inprocess.run(setupfile,resultsdir))
+            return(self.__evaluationRunner__().run(setupfile,resultsdir))
+
+        # work-queue mode: a worker runs the job and sends the outputs back
+        return(self.__waitRRA__(self.__startRRA__(setupfile,resultsdir)))
+
+
+    #**************************************************************************
+    # Function: start an RRA run without waiting for it, locally or through the broker
+    def __startRRA__(self,setupfile,resultsdir):
+        # returns a handle for __waitRRA__ or __discardRRA__, so several runs of a
+        # trial can be in flight (speculative candidates, cycles)
+        if self.broker is None:
+            return(self.__evaluationRunner__().submit(setupfile,resultsdir))
+        job = rrabroker.makeJob(self.broker,setupfile)
+        self.broker.submit(job)
+        log.debug('submitted job %s', job.jobid)
+        return((job.jobid,setupfile,resultsdir))
+
+
+    #**************************************************************************
+    # Function: wait for a run started with __startRRA__ and return its status
+    def __waitRRA__(self,handle):
+        if self.broker is None:
+            return(self.__evaluationRunner__().wait(handle))
+        jobid, setupfile, resultsdir = handle
+        result = self.broker.collect(jobid,self.broker.timeout)
+        if result is None:
+            # withdrawn, so no worker runs (or returns) it later
+            log.warning('no result for job %s, cancelling it', jobid)
+            self.broker.cancel(jobid)
+            status = rrarunner.runresult(setupfile,resultsdir)
+            status.timedout = True
+            return(status)
+        rrabroker.collectFiles(result,resultsdir)
+        return(result.runresult(setupfile,resultsdir))
+
+
+    #**************************************************************************
+    # Function: cancel runs started with __startRRA__
+    def __discardRRA__(self,handles):
+        if self.broker is None:
+            self.__evaluationRunner__().discard(handles)
+            return
+        for jobid, setupfile, resultsdir in handles:
+            self.broker.cancel(jobid)
+
+
+    #**************************************************************************
+    # Function: local runner of the TWSA evaluations
+    def __evaluationRunner__(self):
+        # self.runner with the concurrency, thread cap and pinning calibrated for this host
+        # and model (rracalibrate), unless those were set on self.runner or never calibrated.
+        # Serial runs (initialRRA, mass iterations) use self.runner as it is.
+        runner = self.runner
+        if runner.maxConcurrent != 1 or runner.threads is not None or runner.cpusets is not None:
+            return(runner)
+        if self._calibrated is None:
+            settings = rracalibrate.settings(self.modfullpath)
+            self._calibrated = rrarunner.rrarunner(**settings) if settings else False
+        if not self._calibrated:
+            return(runner)
+        for name in ['timeout','command','memoryLimit','sampleInterval']:
+            setattr(self._calibrated,name,getattr(runner,name))
+        return(self._calibrated)
+
+
+    #**************************************************************************
+    # Function: local runner for a batch of n runs that belong together (the cycles of a candidate)
+    def __batchRunner__(self,n):
+        # the runs of a candidate go at once, up to the number of CPUs, even if the
+        # runner is set up for fewer (by default one run at a time); a pinned runner
+        # keeps its CPU sets. The other settings follow the evaluation runner.
+        runner = self.__evaluationRunner__()
+        n = min(n,len(rrarunner.availableCPUs()))
+        if runner.cpusets is not None or runner.maxConcurrent >= n:
+            return(runner)
+        if self._batchRunner is None or self._batchRunner.maxConcurrent != n:
+            self._batchRunner = rrarunner.rrarunner(maxConcurrent = n)
+        for name in ['timeout','command','threads','memoryLimit','sampleInterval']:
+            setattr(self._batchRunner,name,getattr(runner,name))
+        return(self._batchRunner)
+
+
+    #**************************************************************************
+    # Function: run several RRA setup files (e.g. one per gait cycle)
+    def __runJobs__(self,jobs):
+        # local runs go through the runner at once and broker jobs are all submitted
+        # before collecting; in-process runs are serial. Statuses in the order of the jobs.
+        if self.inprocess and self.broker is None:
+            return([self.__runRRA__(setupfile,resultsdir) for (setupfile, resultsdir) in jobs])
+        if self.broker is None:
+            return(self.__batchRunner__(len(jobs)).runAll(jobs))
+        handles = [self.__startRRA__(setupfile,resultsdir) for (setupfile, resultsdir) in jobs]
+        return([self.__waitRRA__(handle) for handle in handles])
+
+
+    #**************************************************************************
+    # Function: run a candidate on the screening fidelity level and return its objective value
+    def __screenCandidate__(self,S,x,taskfile = None):
+        if not(os.path.isdir(os.path.join(self.fileset.workpath,'Screen'))):
+            os.mkdir(os.path.join(self.fileset.workpath,'Screen'))
+        if taskfile is None:
+            taskfile = os.path.join(self.fileset.workpath,'Tasks','optScreen_Tasks.xml')
+            self.__writeTrackingWeights__(os.path.join(self.fileset.trialpath,self.fileset.taskfile),taskfile,x)
+
+        resultsdir = os.path.join(self.fileset.workpath,'Screen')
+        # stale results would be scored if the screening run fails
+        for f in ['optScreen_Actuation_force.sto','optScreen_pErr.sto']:
+            if os.path.isfile(os.path.join(resultsdir,f)):
+                os.remove(os.path.join(resultsdir,f))
+
+        rraSetupFile = os.path.join(self.fileset.workpath,'optScreen_Setup.xml')
+        self.__writeOptSetup__('optScreen',rraSetupFile,taskfile,resultsdir = resultsdir,
+                                outputmodel = os.path.join(resultsdir,self.fileset.adjname),fidelity = S.screening)
+        status = self.__runRRA__(rraSetupFile,resultsdir)
+
+        fscreen, components, rmsErr = self.__scoreResults__(S,x,'optScreen',resultsdir,status)
+        log.info('screening objective value: %s', fscreen)
+        return(fscreen, status.walltime)
+
+
+    #**************************************************************************
+    # Function: copy a motion file keeping every n-th frame
+    def __decimateMotion__(self,srcfile,dstfile,n):
+        header, labels, data = rrastorage.readStorage(srcfile)
+        return(rrastorage.writeStorage(dstfile,header,labels,rrastorage.decimate(data,n)))
+
+
+    #**************************************************************************
+    # Function: lower ("green") and upper ("red") RMS error bounds for a coordinate
+    def __trackingBounds__(self,S,coordname):
+        if coordname.lower() in ['pelvis_tx','pelvis_ty','pelvis_tz']:
+            # bounds adjusted by JS to evaluate how much this
+            # influences resulting tracking error.
+            lb = 0.5*S.transNormF
+            ub = S.transNormF
+        else:
+            lb = 0.5*S.rotNormF*(math.pi/180)
+            ub = S.rotNormF*(math.pi/180)
+        return(lb,ub)
+
+
+    #**************************************************************************
+    # Function: sort tracked coordinates into groups for block-coordinate optimization
+    def __coordinateGroups__(self,names,tied = False):
+        # groups are visited in this order; coordinates that don't match any
+        # naming rule are collected in a trailing "other" group. With tied
+        # left/right pairs both legs form one group.
+        groups = [['pelvis',[]],['lumbar',[]],['right leg',[]],['left leg',[]],['arms',[]],['other',[]]]
+        lumbar_names = ['flex_extension','axial_rotation','lat_bending','l5_s1_fe','l5_s1_lb','l5_s1_ar']
+        arm_keys = ['arm','elbow','pro_sup','wrist','hand','shoulder','humerus','radius','ulna']
+
+        for i_coord in range(0,len(names)):
+            cname = names[i_coord].lower()
+            if "pelvis" in cname:
+                groups[0][1].append(i_coord)
+            elif "lumbar" in cname or "back" in cname or cname in lumbar_names:
+                groups[1][1].append(i_coord)
+            elif any(key in cname for key in arm_keys):
+                groups[4][1].append(i_coord)
+            elif cname.endswith('_r'):
+                groups[2][1].append(i_coord)
+            elif cname.endswith('_l'):
+                groups[3][1].append(i_coord)
+            else:
+                groups[5][1].append(i_coord)
+
+        if tied:
+            groups[2] = ['legs',groups[2][1] + groups[3][1]]
+            groups[3] = ['left leg',[]]
+        return([g for g in groups if g[1]])
+
+
+    #**************************************************************************
+    # Function: indices of the left/right coordinate pairs (name_r, name_l)
+    def __symmetricPairs__(self,names):
+        pairs = []
+        for i_coord in range(0,len(names)):
+            if names[i_coord].endswith('_r') and names[i_coord][:-2] + '_l' in names:
+                pairs.append((i_coord,names.index(names[i_coord][:-2] + '_l')))
+        return(pairs)
+
+
+    #**************************************************************************
+    # Function: coordinates perturbed together; a tied pair is one unit
+    def __perturbationUnits__(self,S,active):
+        if S.symmetry is None:
+            return([[i] for i in active])
+        pairOf = {}
+        for pair in S.pairs:
+            pairOf[pair[0]] = pair
+            pairOf[pair[1]] = pair
+        units = []
+        for i in active:
+            if i not in pairOf:
+                units.append([i])
+            elif list(pairOf[i]) not in units: # perturbed if either side is active
+                units.append(list(pairOf[i]))
+        return(units)
+
+
+    #**************************************************************************
+    # Function: keep the weights of a left/right pair within the allowed asymmetry
+    def __tiePair__(self,S,values,pair,base = None):
+        # the pair is a shared weight (geometric mean) and a right/left ratio; with a
+        # step base the ratio is perturbed as well (symmetry > 1 only)
+        i_r, i_l = pair
+        shared = math.sqrt(values[i_r]*values[i_l])
+        ratio = values[i_r]/values[i_l]
+        if base is not None and S.symmetry > 1:
+            ratio = ratio*base**S.rng.sample([-1,0,0,1],1)[0]
+        ratio = min(max(ratio,1/S.symmetry),S.symmetry)
+        values[i_r] = shared*math.sqrt(ratio)
+        values[i_l] = shared/math.sqrt(ratio)
+        return(values)
+
+
+    #**************************************************************************
+    # Function: coordinates whose weights are perturbed on the current iteration
+    def __activeCoordinates__(self,S):
+        ncoords = len(S.xcurrent.names)
+        if not S.blockCoordinate:
+            return(list(range(0,ncoords)))
+
+        # coordinates that have stayed in the green long enough are frozen
+        frozen = [S.greenCount[i] >= S.freezeItrs for i in range(0,ncoords)]
+        if all(frozen):
+            # nothing left to optimize in any group; release every coordinate and start over
+            log.info('all coordinates frozen, releasing')
+            S.greenCount = [0]*ncoords
+            frozen = [False]*ncoords
+
+        # visit the groups in turn, skipping those with no free coordinates
+        ngroups = len(S.coordGroups)
+        first = ((S.itr-1)//max(S.groupItrs,1)) % ngroups
+        for k in range(0,ngroups):
+            name, members = S.coordGroups[(first+k) % ngroups]
+            active = [i for i in members if not frozen[i]]
+            if active:
+                log.info('active coordinate group: %s', name)
+                return(active)
+
+        return(list(range(0,ncoords)))
+
+
+    #**************************************************************************
+    # Function: count how long each coordinate of the current solution has stayed in the green
+    def __updateGreenCount__(self,S):
+        for i_coord in range(0,len(S.xcurrent.names)):
+            lb, ub = self.__trackingBounds__(S,S.xcurrent.names[i_coord])
+            if S.xcurrent.rmsErr[i_coord] < lb:
+                S.greenCount[i_coord] = S.greenCount[i_coord] + 1
+            else:
+                S.greenCount[i_coord] = 0
         return(S)
 
 
     #****************************************************************************
     # Function: Framework for initalizing optimization loop using parallel or std
     def __executeRRAOptLoop__(self,S):
-        print('entering opt loop')
+        log.debug('entering opt loop')
 
         #Display current iteration
 
 
         if S.itr>0:
-            print('Current OF value: ',str(S.ObjFuncValues[S.itr]))
-            print('Initial OF value: ',str(S.ObjFuncValues[0]))
+            log.debug('Current OF value: %s', S.ObjFuncValues[S.itr])
+            log.debug('Initial OF value: %s', S.ObjFuncValues[0])
 
-        print(' ')
 
         #Generate new RRA solution
         S.itr = S.itr+1
@@ -1050,24 +1879,341 @@ class rrasetup: # constructor method
         #S.sumRMSForces = np.append(S.sumRMSForces,S_itr.sumRMSForces)
         #S.sumRMSMoments = np.append(S.sumRMSMoments,S_itr.sumRMSMoments)
 
+        S = self.__acceptCandidate__(S)
+        
+        return(S)
+
+
+    #****************************************************************************
+    # Function: accept or reject the latest evaluation (as serial RHCP) and save the progress
+    def __acceptCandidate__(self,S):
         #check for improved objective function measures 
         #If we found a better solution, store it
-        if S.fnew < S.fcurrent: #S_itr.fnew < S.fcurrent:
-            S.xcurrent = S.xnew #S_itr.xnew
-            S.fcurrent = S.fnew #S_itr.fnew
+        if S.pareto:
+            # accepted if non-dominated; otherwise continue from a sparse part of the front
+            inew = len(S.ObjFuncValues)-1
+            accepted = self.__updateArchive__(S,inew)
+            icurrent = inew if accepted else self.__selectFromArchive__(S)
+            self.__setCurrent__(S,icurrent)
+            log.debug('archive: %d non-dominated solutions, current %d', len(S.Archive), icurrent)
+        else:
+            inew = len(S.ObjFuncValues)-1
+            icurrent = int(S.CurrentIndex[-1])
+            accepted = bool(S.fnew + self.__integrationPenalty__(S,inew) < S.fcurrent + self.__integrationPenalty__(S,icurrent))
+            icurrent = inew if accepted else icurrent
+            if accepted: #S_itr.fnew < S.fcurrent:
+                S.xcurrent = S.xnew.copy() #S_itr.xnew
+                S.fcurrent = S.fnew #S_itr.fnew
+                if S.screening is not None:
+                    S.fcurrentScreen = S.fscreen
+        S.Accepted.append(accepted)
+        S.CurrentIndex.append(icurrent)
+
+        if S.blockCoordinate:
+            S = self.__updateGreenCount__(S)
+
+        self.__saveProgress__(S)
+        
+        return(S)
 
-        S_file = os.path.join(self.fileset.optpath,'opt_results.optStruct')
 
-        #import pickle
+    #****************************************************************************
+    # Function: acceptance penalty of an evaluation for slow integration (integrationCost)
+    def __integrationPenalty__(self,S,i):
+        if not S.integrationCost:
+            return(0)
+        steps = S.RunSteps.array()
+        if not math.isfinite(steps[i]) or not np.any(np.isfinite(steps)):
+            return(0)
+        typical = np.nanmedian(steps)
+        if typical <= 0:
+            return(0)
+        return(S.integrationCost*max(steps[i]/typical - 1,0))
+
+
+    #****************************************************************************
+    # Function: place the per-evaluation files of the TWSA in scratch space (if configured)
+    def __openScratch__(self):
+        if self.scratch is not None and self._scratch is None:
+            root = self.scratch
+            if root == 'auto':
+                root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            self._scratch = os.path.join(root,'rra_' + os.path.basename(os.path.normpath(self.fileset.trialpath)) + '_' + uuid.uuid4().hex[:8])
+            os.makedirs(self._scratch)
+            _SCRATCH.add(self._scratch)
+            self.fileset.workpath = self._scratch
+            log.info('TWSA scratch space: %s', self._scratch)
+        for folder in ['Tasks','Results']:
+            if not(os.path.isdir(os.path.join(self.fileset.workpath,folder))):
+                os.mkdir(os.path.join(self.fileset.workpath,folder))
+        return
+
+
+    #****************************************************************************
+    # Function: remove the scratch space and write per-evaluation files to the trial folder again
+    def __closeScratch__(self):
+        if self._scratch is not None:
+            shutil.rmtree(self._scratch,ignore_errors = True)
+            _SCRATCH.discard(self._scratch)
+            self._scratch = None
+        self.fileset.workpath = self.fileset.optpath
+        return
+
 
-        print('saving results file to: ' + S_file)
+    #****************************************************************************
+    # Function: keep the scratch space below scratchLimit
+    def __pruneScratch__(self,keep = ()):
+        # results are overwritten by every run; what accumulates are the task sets and
+        # setups of past iterations. keep lists iterations whose runs still need theirs.
+        if self._scratch is None:
+            return
+        if self.__folderSize__(self._scratch) <= self.scratchLimit:
+            return
+        for folder in [self._scratch,os.path.join(self._scratch,'Tasks')]:
+            for name in os.listdir(folder):
+                match = re.match(r'optItr_(\d+)_(Tasks|Setup)\.xml$',name)
+                if match and int(match.group(1)) not in keep:
+                    os.remove(os.path.join(folder,name))
+        if self.__folderSize__(self._scratch) > self.scratchLimit and not self._pending:
+            # the outputs of a single evaluation do not fit
+            log.warning('TWSA scratch space exceeds %d bytes; writing to %s instead', self.scratchLimit, self.fileset.optpath)
+            self.__closeScratch__()
+            for folder in ['Tasks','Results']:
+                if not(os.path.isdir(os.path.join(self.fileset.workpath,folder))):
+                    os.mkdir(os.path.join(self.fileset.workpath,folder))
+        return
+
+
+    #****************************************************************************
+    # Function: total size of the files below a folder
+    def __folderSize__(self,folder):
+        size = 0
+        for path, dirs, files in os.walk(folder):
+            size = size + sum(os.path.getsize(os.path.join(path,f)) for f in files if os.path.isfile(os.path.join(path,f)))
+        return(size)
+
+
+    #****************************************************************************
+    # Function: start candidates ahead of the current iteration, assuming the ones before are rejected
+    def __speculate__(self,S):
+        itr, greenCount = S.itr, S.greenCount
+        while len(self._pending) <= S.speculate and S.itr + len(self._pending) <= S.i_max + 1:
+            # state of the iteration this candidate belongs to if every pending one is rejected
+            S.itr = itr + len(self._pending)
+            if S.blockCoordinate and self._pending:
+                S.greenCount = list(self._pending[-1].greenCount)
+                self.__updateGreenCount__(S) # the current solution is unchanged by a rejection
+            else:
+                S.greenCount = list(greenCount)
+            if self._pending:
+                S.rng.setstate(self._pending[-1].rngState)
+
+            c = self._candidate()
+            c.itr = S.itr
+            c.x = self.__perturbWeights__(S,[p.x for p in self._pending])
+            c.rngState = S.rng.getstate()
+            c.greenCount = list(S.greenCount)
+            # each slot has its own results folder and output model, so concurrent runs do not collide
+            self.__pruneScratch__([p.itr for p in self._pending])
+            c.resultsdir = os.path.join(self.fileset.workpath,'Results','slot' + str(c.itr % (S.speculate+1)))
+            if not(os.path.isdir(c.resultsdir)):
+                os.mkdir(c.resultsdir)
+            taskfile = self.__writeTrackingWeights__(os.path.join(self.fileset.trialpath,self.fileset.taskfile),
+                                                     os.path.join(self.fileset.workpath,'Tasks','optItr_'+str(c.itr)+'_Tasks.xml'),c.x)
+            setupfile = os.path.join(self.fileset.workpath,'optItr_'+str(c.itr)+'_Setup.xml')
+            self.__writeOptSetup__('optItr',setupfile,taskfile,resultsdir = c.resultsdir,
+                                    outputmodel = os.path.join(c.resultsdir,self.fileset.adjname))
+            c.handle = self.__startRRA__(setupfile,c.resultsdir)
+            self._pending.append(c)
+            log.debug('started candidate of iteration %d', c.itr)
+        S.itr, S.greenCount = itr, greenCount
+        return(S)
+
+
+    #****************************************************************************
+    # Function: one TWSA iteration with speculative candidates in flight
+    def __speculativeStep__(self,S):
+        S.itr = S.itr+1
+        self.__speculate__(S)
+        c = self._pending.pop(0)
+        status = self.__waitRRA__(c.handle)
+
+        # the candidate of this iteration, exactly as serial RHCP would have drawn it
+        S.greenCount = c.greenCount
+        S.xnew = c.x
+        S.trackingWeights = S.xnew
+        S.ScreenValues.append(math.nan)
+        S.Promoted.append(True)
+        S = self.__calculateObjectiveFunction__(S,status,c.resultsdir)
+        S.TestedSolutions.append(S.xnew.values)
+        S.ObjFuncValues.append(S.fnew)
+
+        S = self.__acceptCandidate__(S)
+        if S.Accepted[-1] and self._pending:
+            # drawn around the old solution: cancel, and rewind the random state to
+            # where serial RHCP would draw the next candidate
+            log.debug('accepted; cancelling %d speculative candidates', len(self._pending))
+            self.__discardRRA__([p.handle for p in self._pending])
+            S.cancelledRuns = S.cancelledRuns + len(self._pending)
+            self._pending = []
+        S.rng.setstate(c.rngState if not self._pending else self._pending[-1].rngState)
+        return(S)
+
+
+    #****************************************************************************
+    # Function: residual and tracking error terms of every evaluation, as weighted by wRes and wErr
+    def __paretoPoints__(self,S):
+        # fnew = wRes*points[:,0] + wErr*points[:,1]
+        points = np.column_stack([S.sumRMSResiduals.array()/6,S.sumRMSErrors.array()/len(S.xcurrent.names)])
+        return(points)
+
+
+    #****************************************************************************
+    # Function: add an evaluation to the non-dominated archive if no archived solution dominates it
+    def __updateArchive__(self,S,i):
+        points = self.__paretoPoints__(S)
+        p = points[i]
+        if not np.all(np.isfinite(p)):
+            return(False)
+        if S.Archive and np.any(np.all(points[S.Archive] <= p,axis = 1)):
+            return(False)
+        # drop the solutions the new one dominates
+        S.Archive = [j for j in S.Archive if not np.all(p <= points[j])] + [i]
+        return(True)
+
+
+    #****************************************************************************
+    # Function: rebuild the archive from the evaluation history
+    def __paretoArchive__(self,S):
+        S.Archive = []
+        for i in range(0,min(len(S.sumRMSResiduals),len(S.sumRMSErrors))):
+            self.__updateArchive__(S,i)
+        return(S.Archive)
+
+
+    #****************************************************************************
+    # Function: crowding distance of the archived solutions along the front
+    def __crowding__(self,S):
+        points = self.__paretoPoints__(S)[S.Archive]
+        distance = np.zeros(len(S.Archive))
+        order = np.argsort(points[:,0])
+        distance[order[0]] = math.inf
+        distance[order[-1]] = math.inf
+        for k in range(0,2):
+            span = points[:,k].max() - points[:,k].min()
+            if span > 0:
+                distance[order[1:-1]] += np.abs(points[order[2:],k] - points[order[:-2],k])/span
+        return(distance)
+
+
+    #****************************************************************************
+    # Function: pick the archived solution to perturb next (binary tournament on crowding distance)
+    def __selectFromArchive__(self,S):
+        if not S.Archive:
+            return(int(S.CurrentIndex[-1]))
+        distance = self.__crowding__(S)
+        pair = S.rng.sample(range(0,len(S.Archive)),min(2,len(S.Archive)))
+        return(S.Archive[max(pair,key = lambda k: distance[k])])
+
+
+    #****************************************************************************
+    # Function: make an evaluated solution the current one
+    def __setCurrent__(self,S,i):
+        S.xcurrent = self._weightStruct(S.xcurrent.names,S.TestedSolutions[i],S.RMSErrors[i],S.xcurrent.rmsNormFactor)
+        S.fcurrent = S.ObjFuncValues[i]
+        if S.screening is not None and math.isfinite(S.ScreenValues[i]):
+            S.fcurrentScreen = S.ScreenValues[i]
+        return(S)
+
+
+    #****************************************************************************
+    # Function: convergence diagnostics over the last window evaluations
+    def __convergence__(self,S,window):
+        # improvement -- relative decrease of the best objective value over the window
+        # acceptance -- fraction of candidates in the window that became the current solution
+        # step -- largest relative change of any tracking weight of the current solution over the window
+        objvals = S.ObjFuncValues.array()
+        if len(objvals) <= window:
+            return(None)
+
+        bestBefore = objvals[:-window].min()
+        bestNow = objvals.min()
+        if math.isfinite(bestBefore) and bestBefore != 0:
+            improvement = float((bestBefore - bestNow)/abs(bestBefore))
+        else:
+            improvement = math.inf
+        acceptance = sum(S.Accepted[-window:])/window
+        xbefore = S.TestedSolutions[int(S.CurrentIndex[-window-1])]
+        xnow = S.TestedSolutions[int(S.CurrentIndex[-1])]
+        step = float(np.max(np.abs(xnow/xbefore - 1)))
+        return({'window': window, 'improvement': improvement, 'acceptance': acceptance, 'step': step})
+
+
+    #****************************************************************************
+    # Function: stagnation rule used to end the TWSA early
+    def __stagnated__(self,S):
+        opts = S.stopping
+        S.convergence = self.__convergence__(S,opts.window)
+        if S.convergence is None:
+            return(False)
+
+        met = []
+        if opts.minImprovement is not None:
+            met.append(S.convergence['improvement'] < opts.minImprovement)
+        if opts.maxAcceptance is not None:
+            met.append(S.convergence['acceptance'] <= opts.maxAcceptance)
+        if opts.minStep is not None:
+            met.append(S.convergence['step'] < opts.minStep)
+        if not met:
+            return(False)
+
+        stagnated = all(met) if opts.mode == 'all' else any(met)
+        if stagnated:
+            log.info('stagnation after %d iterations: %s', S.itr, S.convergence)
+        return(stagnated)
+
+
+    #****************************************************************************
+    # Function: save the optimization structure so the TWSA can be resumed
+    def __saveProgress__(self,S,state = 'running'):
+        S_file = os.path.join(self.fileset.optpath,'opt_results.optStruct')
+
+        log.debug('saving results file to: %s', S_file)
         with open(S_file,'wb') as struct_file:
             pickle.dump(S,struct_file)
-        
-        return(S)
+        self.__reportProgress__(S,state)
+        return
+
+
+    #****************************************************************************
+    # Function: update the trial status file read by rratelemetry.statusserver
+    def __reportProgress__(self,S,state = 'running'):
+        if self._session is None:
+            self._session = [time.time(),len(S.ObjFuncValues)]
+        status = rratelemetry.trialStatus(S,self.fileset.trialpath,self._session[0],self._session[1],state)
+        rratelemetry.writeStatus(os.path.join(self.fileset.optpath,rratelemetry.STATUSFILE),status)
+        log.info('iteration %d/%d, best %s, current %s, %s evals/h, failures %d',
+                 S.itr, S.i_max, status['best'], status['current'], status['evalsPerHour'], status['failures'])
+        return(status)
 
     # define data class to store optimization configuration and results
     class _optStruct:
+        __slots__ = ('itr','wRes','wErr','pRes','pErr','trackingWeights','xnew','fnew','thresh','i_min','i_max',
+                     'xcurrent','xbest','TestedSolutions','RMSErrors','ObjFuncValues','fcurrent',
+                     'sumRMSResiduals','sumRMSErrors','sumRMSForces','sumRMSMoments',
+                     'forceNormF','momentNormF','rotNormF','transNormF',
+                     'blockCoordinate','groupItrs','freezeItrs','coordGroups','greenCount',
+                     'screening','fscreen','fcurrentScreen','ScreenValues','Promoted','RunStatus','RunTimes','finalStatus',
+                     'stopping','stopReason','convergence','Accepted','CurrentIndex','finalTime','massChange','massItrs',
+                     'bestRetained','bestToolname','pareto','Archive','RunCPUTimes','RunMemory','rng','speculate','cancelledRuns','deadline',
+                     'RunSteps','RunStepLimit','integrationCost',
+                     'cyclePaths','cycleNorms','aggregate','CycleObjFuncValues','CycleResiduals','CycleErrors',
+                     'symmetry','pairs')
+        # per-evaluation histories (one entry or row per RRA evaluation)
+        _histories = ('TestedSolutions','RMSErrors','ObjFuncValues','sumRMSResiduals','sumRMSErrors',
+                      'sumRMSForces','sumRMSMoments','ScreenValues','RunTimes','CurrentIndex','RunCPUTimes','RunMemory',
+                      'RunSteps','CycleObjFuncValues','CycleResiduals','CycleErrors')
+
         def __init__(self):
             self.itr = 0
             self.wRes = 1
@@ -1081,25 +2227,166 @@ class rrasetup: # constructor method
             self.i_min = 25
             self.i_max = 75
             self.xcurrent = rrasetup._weightStruct()
-            self.TestedSolutions = [[]] 
-            self.ObjFuncValues = []
+            self.xbest = None
+            self.TestedSolutions = rrasetup._history() # iterations x coordinates tracking weights
+            self.RMSErrors = rrasetup._history() # iterations x coordinates RMS tracking errors
+            self.ObjFuncValues = rrasetup._history()
             self.fcurrent = 0
-            self.sumRMSResiduals = []
-            self.sumRMSErrors = []
-            self.sumRMSForces = []
-            self.sumRMSMoments = []
+            self.sumRMSResiduals = rrasetup._history()
+            self.sumRMSErrors = rrasetup._history()
+            self.sumRMSForces = rrasetup._history()
+            self.sumRMSMoments = rrasetup._history()
             self.forceNormF = 0
             self.momentNormF = 0
             self.rotNormF = 0
             self.transNormF = 0
+            self.blockCoordinate = False
+            self.groupItrs = 3
+            self.freezeItrs = 3
+            self.coordGroups = []
+            self.greenCount = []
+            self.screening = None
+            self.fscreen = 0
+            self.fcurrentScreen = None
+            self.ScreenValues = rrasetup._history()
+            self.Promoted = []
+            self.RunStatus = []
+            self.RunTimes = rrasetup._history()
+            self.RunCPUTimes = rrasetup._history() # CPU seconds and peak resident memory (bytes) of each run, nan if not measured
+            self.RunMemory = rrasetup._history()
+            self.RunSteps = rrasetup._history() # integrator steps taken per run (nan if the run failed)
+            self.RunStepLimit = []
+            self.finalStatus = None
+            self.stopping = None
+            self.stopReason = None # 'threshold', 'stagnation', 'max_itrs', 'deadline', or 'budget' or 'failed' (rrastudy)
+            self.convergence = None # latest convergence diagnostics (stopping only)
+            self.Accepted = [] # candidate became the current solution
+            self.CurrentIndex = rrasetup._history() # index of the current solution after each evaluation
+            self.finalTime = None # wall time of the final RRA run
+            self.massChange = None # total mass change and number of mass iterations before the TWSA (if run by the same rrasetup)
+            self.massItrs = None
+            self.bestRetained = None # evaluation whose outputs are kept in RRA_optWeights/Best
+            self.bestToolname = None
+            self.pareto = False # multi-objective (non-dominated archive) search
+            self.Archive = [] # indices of the non-dominated evaluations over (residual term, tracking error term)
+            self.rng = random.Random() # source of the random perturbations
+            self.speculate = 0 # candidates run ahead of the current iteration
+            self.cancelledRuns = 0 # speculative runs cancelled because an earlier candidate was accepted
+            self.deadline = None # time.time() by which the TWSA should be done
+            self.integrationCost = 0 # acceptance penalty per multiple of the median number of integrator steps
+            self.cyclePaths = [] # trial folders of the other cycles of a joint optimization
+            self.cycleNorms = [] # [force, moment] residual normalization factors of each of those cycles
+            self.aggregate = 'mean' # 'mean' or 'max' of the per-cycle objective values
+            self.CycleObjFuncValues = rrasetup._history() # evaluations x cycles (this trial first) objective values,
+            self.CycleResiduals = rrasetup._history() # residual and tracking error cost terms (joint mode only)
+            self.CycleErrors = rrasetup._history()
+            self.symmetry = None # largest right/left weight ratio of tied coordinate pairs (None: not tied)
+            self.pairs = [] # (right, left) coordinate indices of the tied pairs
+
+        def __getstate__(self):
+            return({key: getattr(self,key) for key in self.__slots__})
+
+        def __setstate__(self, state):
+            # progress saved by an older version is a plain attribute dict with
+            # list/np.append histories and may lack the newer fields
+            self.__init__()
+            if isinstance(state, tuple): # (dict, slots) form
+                state = {**(state[0] or {}), **state[1]}
+            for key, value in state.items():
+                if key not in self.__slots__:
+                    continue
+                if key in self._histories and not isinstance(value, rrasetup._history):
+                    h = rrasetup._history()
+                    h.extend([v for v in value if np.size(v) > 0]) # old TestedSolutions started as [[]]
+                    value = h
+                setattr(self, key, value)
+
+    # define data class for a speculative candidate in flight
+    class _candidate:
+        __slots__ = ('itr','x','rngState','greenCount','resultsdir','handle')
 
     # define data class to store traking weights info
     class _weightStruct:
+        __slots__ = ('names','values','rmsErr','rmsNormFactor')
+
+        def __init__(self, names = (), values = (), rmsErr = (), rmsNormFactor = ()):
+            self.names = list(names)
+            self.values = np.array(values, dtype = float)
+            self.rmsErr = np.array(rmsErr, dtype = float)
+            self.rmsNormFactor = np.array(rmsNormFactor, dtype = float)
+
+        def copy(self):
+            # independent copy so perturbing a candidate never alters the accepted solution
+            return(rrasetup._weightStruct(self.names, self.values, self.rmsErr, self.rmsNormFactor))
+
+        def __getstate__(self):
+            return({key: getattr(self,key) for key in self.__slots__})
+
+        def __setstate__(self, state):
+            # older progress files store the fields as parallel lists
+            if isinstance(state, tuple):
+                state = {**(state[0] or {}), **state[1]}
+            self.__init__(state.get('names',()), state.get('values',()), state.get('rmsErr',()), state.get('rmsNormFactor',()))
+
+    # define data class for a per-evaluation history: a preallocated array that grows by doubling
+    class _history:
+        __slots__ = ('data','n')
+
         def __init__(self):
-            self.names = []
-            self.values = []
-            self.rmsErr = []
-            self.rmsNormFactor = []
+            self.data = None # allocated on the first append, once the row shape is known
+            self.n = 0
+
+        def append(self, value):
+            value = np.asarray(value, dtype = float)
+            if self.data is None:
+                self.data = np.empty((64,) + value.shape)
+            elif self.n == self.data.shape[0]:
+                # amortized O(1) appends instead of copying the whole history each iteration
+                grown = np.empty((2*self.n,) + self.data.shape[1:])
+                grown[:self.n] = self.data[:self.n]
+                self.data = grown
+            self.data[self.n] = value
+            self.n = self.n + 1
+
+        def extend(self, values):
+            for value in values:
+                self.append(value)
+
+        def array(self):
+            """
+            Returns a view of the filled part of the history (n x ...).
+            """
+            if self.data is None:
+                return(np.zeros(0))
+            return(self.data[:self.n])
+
+        def __len__(self):
+            return(self.n)
+
+        def __getitem__(self, i):
+            return(self.array()[i])
+
+        def __setitem__(self, i, value):
+            self.array()[i] = value
+
+        def __iter__(self):
+            return(iter(self.array()))
+
+        def __array__(self, dtype = None, copy = None):
+            return(self.array() if dtype is None else self.array().astype(dtype))
+
+        def __repr__(self):
+            return(repr(self.array()))
+
+        def __getstate__(self):
+            # only the filled rows are checkpointed
+            return({'data': self.array().copy()})
+
+        def __setstate__(self, state):
+            self.__init__()
+            if len(state['data']):
+                self.data = state['data']
+                self.n = len(self.data)
 
 # define data class for file paths and names used in RRA scheme. Is used as a property in the main class
 class rrafiles:
@@ -1108,6 +2395,8 @@ class rrafiles:
         self.resultspath = os.path.join(self.trialpath,"RRA_inital")
         self.adjresultspath = os.path.join(self.trialpath,"RRA_adjMass")
         self.optpath = os.path.join(self.trialpath,"RRA_optWeights")
+        self.inputpath = os.path.join(self.trialpath,"RRA_inputs")
+        self.workpath = self.optpath # per-evaluation TWSA files (task sets, setups, results); moved to scratch space by rrasetup.scratch
         self.finalpath = os.path.join(self.trialpath,"RRA_Final")
         
         if condition:
@@ -1149,6 +2438,26 @@ class rraoptions:
         self.rrasetupfile = rrasetupfile
     
 
+# define data class used to configure the cheap (screening) level of a two-level TWSA evaluation
+class fidelityoptions:
+    def __init__(self):
+        self.window = 0.5 # fraction of the trial window simulated, starting at the initial time
+        self.decimate = 1 # keep every n-th frame of the kinematics (1 = no decimation)
+        self.maxSteps = 5000 # maximum number of integrator steps
+        self.errorTolerance = 1e-4 # integrator error tolerance
+        self.promoteRatio = 1.0 # promote if screening value < promoteRatio * screening value of the current solution
+
+
+# define data class used to configure the stagnation rule that ends a TWSA early
+class stoppingoptions:
+    def __init__(self):
+        self.window = 10 # number of recent iterations the diagnostics are computed over
+        self.minImprovement = 0.01 # stagnated if the best objective improved by less than this fraction over the window
+        self.maxAcceptance = 0.2 # stagnated if at most this fraction of the window's candidates was accepted
+        self.minStep = None # stagnated if no tracking weight of the current solution changed by more than this fraction
+        self.mode = 'all' # 'all': every criterion that is not None must be met, 'any': one is enough
+
+
 # %%
 
 class extloadoptions:
@@ -0,0 +1,440 @@
+# includes
+import os
+import json
+import time
+import uuid
+import socket
+import shutil
+import hashlib
+import argparse
+import tempfile
+import logging
+import xml.etree.ElementTree as ET
+import rrarunner
+#
+
+log = logging.getLogger(__name__)
+
+# RRATool setup elements that reference input files staged for the workers
+_inputFields = ['model_file','force_set_files','external_loads_file','desired_kinematics_file']
+_SMALLFILE = 65536 # staged files below this size are re-hashed for every job instead of cached
+
+# define data class for one RRA evaluation handed out by the coordinator
+class rrajob:
+    def __init__(self, setupxml = '', tasksxml = '', stage = '', toolname = '', weights = None):
+        self.jobid = uuid.uuid4().hex
+        self.setupxml = setupxml # RRA setup file with all paths relative to the worker folder
+        self.tasksxml = tasksxml # task set file with the candidate tracking weights
+        self.stage = stage # id of the staged inputs (model, reserves, external loads, kinematics, grf)
+        self.toolname = toolname
+        self.taskfile = 'Tasks.xml' # file name the setup refers to for the task set
+        self.weights = weights if weights is not None else {} # coordinate name: tracking weight (informational)
+
+    def todict(self):
+        return(dict(vars(self)))
+
+    @classmethod
+    def fromdict(cls, d):
+        job = cls()
+        job.__dict__.update(d)
+        return(job)
+
+
+# define data class for the outcome of an RRA evaluation returned to the coordinator
+class rrajobresult:
+    def __init__(self, jobid = '', worker = ''):
+        self.jobid = jobid
+        self.worker = worker
+        self.returncode = None
+        self.timedout = False
+        self.walltime = 0
+        self.cpus = None # resources the worker's run used (see rrarunner.runresult)
+        self.maxrss = None
+        self.cputime = None
+        self.stdout = ''
+        self.stderr = ''
+        self.files = {} # output file name: file contents
+
+    def todict(self):
+        return(dict(vars(self)))
+
+    @classmethod
+    def fromdict(cls, d):
+        result = cls()
+        result.__dict__.update(d)
+        return(result)
+
+    def runresult(self, setupfile = '', cwd = ''):
+        """
+        Converts the job result to an rrarunner.runresult so the coordinator can score it like a local run.
+        """
+        result = rrarunner.runresult(setupfile, cwd)
+        result.returncode = self.returncode
+        result.timedout = self.timedout
+        result.walltime = self.walltime
+        result.cpus = self.cpus
+        result.maxrss = self.maxrss
+        result.cputime = self.cputime
+        result.stdout = self.stdout
+        result.stderr = self.stderr
+        return(result)
+
+
+# begin class def
+class broker:
+    """
+    Base class for RRA work distribution. A coordinator stages trial inputs,
+    submits jobs and collects results; workers claim jobs and complete them.
+    Subclasses implement the transport.
+    """
+    timeout = None # seconds the coordinator waits for a result. None waits forever
+
+    def stage(self, files):
+        """
+        Makes input files available to workers. files is a dict of file name: local path.
+        Returns the stage id referenced by jobs.
+        """
+        raise NotImplementedError
+
+    def stagepath(self, stage):
+        """
+        Worker side: local folder holding the files of a stage.
+        """
+        raise NotImplementedError
+
+    def submit(self, job):
+        raise NotImplementedError
+
+    def claim(self, worker, timeout = None):
+        """
+        Worker side: returns the next pending rrajob, or None if none arrived within timeout seconds.
+        """
+        raise NotImplementedError
+
+    def complete(self, result):
+        raise NotImplementedError
+
+    def collect(self, jobid, timeout = None):
+        """
+        Coordinator side: returns the rrajobresult of a job, or None if it did not arrive within timeout seconds.
+        """
+        raise NotImplementedError
+
+    def cancel(self, jobid):
+        """
+        Coordinator side: withdraws a job that is no longer wanted (timed out or
+        speculative); its result, if a worker already runs it, is discarded.
+        """
+        raise NotImplementedError
+
+
+class spoolbroker(broker):
+    def __init__(self, root, poll = 0.5):
+        """
+        Constructor method for class spoolbroker:
+            Filesystem spool implementation of the broker. Jobs, results and staged
+            inputs are plain files under root, so coordinator and workers only need
+            to share that folder (a local folder on a single machine, or a network
+            filesystem across nodes). Jobs are claimed with an atomic rename.
+            Optional keyword arguments:
+                poll -- seconds between checks for new jobs or results (default = 0.5)
+        """
+        self.root = root
+        self.poll = poll
+        self._digests = {} # staged file: ((mtime, size), content hash)
+        for folder in ['pending','claimed','done','staged','cancelled']:
+            if not(os.path.isdir(os.path.join(self.root,folder))):
+                os.makedirs(os.path.join(self.root,folder),exist_ok = True)
+
+    def __write__(self, filename, d):
+        # write then rename so readers never see a partial file
+        tmpfile = filename + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmpfile,'w') as f:
+            json.dump(d,f)
+        os.replace(tmpfile,filename)
+
+    def __digest__(self, filename):
+        # content hash, cached by modification time and size so the trial inputs are
+        # not re-read for every job (small files, e.g. temporary copies, are just hashed)
+        stamp = (os.path.getmtime(filename),os.path.getsize(filename))
+        cached = self._digests.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return(cached[1])
+        h = hashlib.sha1()
+        with open(filename,'rb') as f:
+            for block in iter(lambda: f.read(1 << 20),b''):
+                h.update(block)
+        if stamp[1] >= _SMALLFILE:
+            self._digests[filename] = (stamp, h.hexdigest())
+        return(h.hexdigest())
+
+    def stage(self, files):
+        h = hashlib.sha1()
+        for name in sorted(files.keys()):
+            h.update(name.encode())
+            h.update(self.__digest__(os.path.abspath(files[name])).encode())
+        stage = h.hexdigest()[:16]
+
+        folder = os.path.join(self.root,'staged',stage)
+        if not os.path.isdir(folder): # staged inputs are reused by every job with the same content
+            tmpfolder = folder + '.' + uuid.uuid4().hex + '.tmp'
+            os.makedirs(tmpfolder)
+            for name in files.keys():
+                shutil.copyfile(files[name],os.path.join(tmpfolder,name))
+            try:
+                os.rename(tmpfolder,folder)
+            except OSError: # staged concurrently by another coordinator
+                shutil.rmtree(tmpfolder,ignore_errors = True)
+        return(stage)
+
+    def stagepath(self, stage):
+        return(os.path.join(self.root,'staged',stage))
+
+    def submit(self, job):
+        self.__write__(os.path.join(self.root,'pending',job.jobid + '.json'),job.todict())
+        return(job.jobid)
+
+    def claim(self, worker, timeout = None):
+        tic = time.time()
+        while True:
+            pending = sorted(os.listdir(os.path.join(self.root,'pending')))
+            for name in pending:
+                if not name.endswith('.json'):
+                    continue
+                src = os.path.join(self.root,'pending',name)
+                dst = os.path.join(self.root,'claimed',name)
+                try:
+                    os.rename(src,dst)
+                except OSError: # another worker got there first
+                    continue
+                if self.__dropCancelled__(name[:-len('.json')]):
+                    os.remove(dst)
+                    continue
+                with open(dst) as f:
+                    return(rrajob.fromdict(json.load(f)))
+            if timeout is not None and time.time()-tic > timeout:
+                return(None)
+            time.sleep(self.poll)
+
+    def complete(self, result):
+        self.__write__(os.path.join(self.root,'done',result.jobid + '.json'),result.todict())
+        claimed = os.path.join(self.root,'claimed',result.jobid + '.json')
+        if os.path.isfile(claimed):
+            os.remove(claimed)
+        # checked after writing, so either this or cancel() sees the other's file
+        if self.__dropCancelled__(result.jobid):
+            self.__remove__(os.path.join(self.root,'done',result.jobid + '.json'))
+
+    def cancel(self, jobid):
+        try:
+            os.remove(os.path.join(self.root,'pending',jobid + '.json'))
+            return
+        except FileNotFoundError: # claimed, or already done
+            pass
+        open(os.path.join(self.root,'cancelled',jobid),'w').close()
+        done = os.path.join(self.root,'done',jobid + '.json')
+        if os.path.isfile(done) and self.__dropCancelled__(jobid):
+            self.__remove__(done)
+
+    def __dropCancelled__(self, jobid):
+        # True (and the mark removed) if the job was cancelled
+        return(self.__remove__(os.path.join(self.root,'cancelled',jobid)))
+
+    def __remove__(self, filename):
+        # False if the file was not there (or removed concurrently)
+        try:
+            os.remove(filename)
+            return(True)
+        except FileNotFoundError:
+            return(False)
+
+    def collect(self, jobid, timeout = None):
+        filename = os.path.join(self.root,'done',jobid + '.json')
+        tic = time.time()
+        while not os.path.isfile(filename):
+            if timeout is not None and time.time()-tic > timeout:
+                return(None)
+            time.sleep(self.poll)
+        with open(filename) as f:
+            result = rrajobresult.fromdict(json.load(f))
+        os.remove(filename)
+        return(result)
+
+
+def makeJob(brokerobj, setupfile):
+    """
+    Coordinator side: turns a locally written RRA setup file into an rrajob.
+    The input files it references are staged through the broker (the data file
+    of the external loads is staged with them), the task set is embedded in the
+    job, and every path is rewritten relative to the worker's folder.
+    """
+    tree = ET.parse(setupfile)
+    tool = tree.getroot().find('RRATool')
+    setupdir = os.path.dirname(os.path.abspath(setupfile))
+
+    def localpath(path):
+        # OpenSim resolves relative paths against the setup file's folder
+        return(path if os.path.isabs(path) else os.path.join(setupdir,path))
+
+    files = {}
+    tmpfiles = []
+    for field in _inputFields:
+        element = tool.find(field)
+        if element is None or not (element.text or '').strip():
+            continue
+        names = []
+        for path in element.text.split():
+            path = localpath(path)
+            name = os.path.basename(path)
+            if field == 'external_loads_file':
+                path = _stageExtLoads(path,files)
+                tmpfiles.append(path)
+            files[name] = path
+            names.append(name)
+        element.text = ' '.join(names)
+
+    taskfile = localpath(tool.find('task_set_file').text.strip())
+    with open(taskfile) as f:
+        tasksxml = f.read()
+    tool.find('task_set_file').text = os.path.basename(taskfile)
+
+    tool.find('results_directory').text = '.'
+    if tool.find('output_model_file') is not None and (tool.find('output_model_file').text or '').strip():
+        tool.find('output_model_file').text = os.path.basename(tool.find('output_model_file').text.strip())
+
+    stage = brokerobj.stage(files)
+    for path in tmpfiles:
+        os.remove(path)
+    job = rrajob(ET.tostring(tree.getroot(),encoding = 'unicode'),tasksxml,stage,tool.get('name'))
+    job.taskfile = os.path.basename(taskfile)
+
+    # tracking weights, for bookkeeping on the worker side
+    for task in ET.fromstring(tasksxml).iter('CMC_Joint'):
+        if task.find('weight') is not None:
+            job.weights[task.get('name')] = float(task.find('weight').text.split()[0])
+    return(job)
+
+
+def _stageExtLoads(path, files):
+    # temporary copy of the external loads file pointing at a staged copy of its data file
+    tree = ET.parse(path)
+    loads = tree.getroot().find('ExternalLoads')
+    datafile = loads.find('datafile')
+    if datafile is not None and (datafile.text or '').strip():
+        datapath = datafile.text.strip()
+        if not os.path.isabs(datapath):
+            datapath = os.path.join(os.path.dirname(os.path.abspath(path)),datapath)
+        files[os.path.basename(datapath)] = datapath
+        datafile.text = os.path.basename(datapath)
+        for source in loads.iter('data_source_name'):
+            source.text = datafile.text
+
+    fd, staged = tempfile.mkstemp(suffix = '.xml')
+    os.close(fd)
+    tree.write(staged)
+    return(staged)
+
+
+def collectFiles(result, resultsdir):
+    """
+    Coordinator side: writes the output files returned with a job result into resultsdir.
+    """
+    if not(os.path.isdir(resultsdir)):
+        os.makedirs(resultsdir)
+    for name in result.files.keys():
+        with open(os.path.join(resultsdir,name),'w') as f:
+            f.write(result.files[name])
+
+
+# begin class def
+class rraworker:
+    def __init__(self, brokerobj, workdir, runner = None, keep = False):
+        """
+        Constructor method for class rraworker:
+            Claims RRA jobs from a broker, runs them in a private folder under
+            workdir and returns every output file of the run to the coordinator.
+            Optional keyword arguments:
+                runner -- rrarunner used to launch opensim-cmd (timeouts, concurrency)
+                keep -- keep the job folders after completion (default = False)
+        """
+        self.broker = brokerobj
+        self.workdir = workdir
+        self.runner = runner if runner is not None else rrarunner.rrarunner()
+        self.keep = keep
+        self.name = socket.gethostname() + ':' + str(os.getpid())
+
+    def runJob(self, job):
+        """
+        Runs a single job and returns its rrajobresult.
+        """
+        folder = os.path.join(self.workdir,job.jobid)
+        os.makedirs(folder,exist_ok = True)
+        stagepath = self.broker.stagepath(job.stage)
+        for name in os.listdir(stagepath):
+            shutil.copyfile(os.path.join(stagepath,name),os.path.join(folder,name))
+        with open(os.path.join(folder,job.taskfile),'w') as f:
+            f.write(job.tasksxml)
+        setupfile = os.path.join(folder,job.toolname + '_Setup.xml')
+        with open(setupfile,'w') as f:
+            f.write(job.setupxml)
+
+        status = self.runner.run(setupfile,folder)
+
+        result = rrajobresult(job.jobid,self.name)
+        result.returncode = status.returncode
+        result.timedout = status.timedout
+        result.walltime = status.walltime
+        result.cpus = status.cpus
+        result.maxrss = status.maxrss
+        result.cputime = status.cputime
+        result.stdout = status.stdout[-10000:]
+        result.stderr = status.stderr[-10000:]
+        if status.succeeded():
+            outputs = [n for n in os.listdir(folder) if n.startswith(job.toolname + '_') and n != os.path.basename(setupfile)]
+            outputs = outputs + [n for n in ['out.log','opensim.log'] if os.path.isfile(os.path.join(folder,n))]
+            outmodel = ET.fromstring(job.setupxml).find('RRATool/output_model_file')
+            if outmodel is not None and outmodel.text and os.path.isfile(os.path.join(folder,outmodel.text.strip())):
+                outputs.append(outmodel.text.strip()) # adjusted model
+            for name in outputs:
+                with open(os.path.join(folder,name),errors = 'replace') as f:
+                    result.files[name] = f.read()
+
+        if not self.keep:
+            shutil.rmtree(folder,ignore_errors = True)
+        return(result)
+
+    def serve(self, idle_timeout = None, maxjobs = None):
+        """
+        Claims and runs jobs until no job arrived for idle_timeout seconds
+        (None serves forever) or maxjobs jobs were run. Returns the number of jobs run.
+        """
+        njobs = 0
+        while maxjobs is None or njobs < maxjobs:
+            job = self.broker.claim(self.name,idle_timeout)
+            if job is None:
+                break
+            log.info('running job %s (%s)', job.jobid, job.toolname)
+            self.broker.complete(self.runJob(job))
+            njobs = njobs + 1
+        return(njobs)
+
+
+# run a worker from the command line: python rrabroker.py <spool folder> [--workdir DIR] [--timeout SEC]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'RRA evaluation worker for a filesystem spool broker')
+    parser.add_argument('spool',help = 'spool folder shared with the coordinator')
+    parser.add_argument('--workdir',default = None,help = 'local folder for job files (default: <spool>/work)')
+    parser.add_argument('--timeout',type = float,default = None,help = 'wall-clock limit in seconds for each RRA run')
+    parser.add_argument('--idle',type = float,default = None,help = 'exit after this many seconds without jobs')
+    parser.add_argument('--cpus',default = None,help = 'CPU list the runs are pinned to, e.g. 0-3 (one list per worker on a shared node)')
+    parser.add_argument('--threads',type = int,default = None,help = 'OpenMP/BLAS thread cap for each run')
+    parser.add_argument('--memory',type = float,default = None,help = 'memory limit of each run in GB')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+
+    workdir = args.workdir if args.workdir is not None else os.path.join(args.spool,'work')
+    runner = rrarunner.rrarunner(timeout = args.timeout,threads = args.threads,
+                                 cpusets = [rrarunner.parseCPUs(args.cpus)] if args.cpus else None,
+                                 memoryLimit = args.memory*2**30 if args.memory else None)
+    worker = rraworker(spoolbroker(args.spool),workdir,runner)
+    print('served ' + str(worker.serve(args.idle)) + ' jobs')
@@ -0,0 +1,175 @@
+# includes
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import rrarunner
+import rraxml
+#
+
+log = logging.getLogger(__name__)
+
+CALFILE = os.path.join(os.path.expanduser('~'),'.rra_calibration.json') # best worker counts per host and model
+_modelkeys = {} # model file: (mtime, key), so each model is parsed once
+
+def modelkey(modelfile):
+    """
+    Calibration key of a model: its number of coordinates and forces, so scaled
+    models of the same generic model (e.g. every Hamner subject) share one entry.
+    """
+    stamp = os.path.getmtime(modelfile)
+    filename = os.path.abspath(modelfile)
+    cached = _modelkeys.get(filename)
+    if cached is None or cached[0] != stamp:
+        info = rraxml.modelinfo(modelfile)
+        cached = (stamp, str(len(info.coordinates)) + 'dof_' + str(len(info.forces)) + 'forces')
+        _modelkeys[filename] = cached
+    return(cached[1])
+
+
+def readCalibration(calfile = None):
+    """
+    Returns the stored calibrations as {host: {model key: entry}}, empty if there are none.
+    """
+    calfile = calfile if calfile is not None else CALFILE
+    try:
+        with open(calfile) as f:
+            return(json.load(f))
+    except (OSError, ValueError):
+        return({})
+
+
+def settings(modelfile, host = None, calfile = None):
+    """
+    rrarunner keyword arguments of the configuration calibrated for this host and
+    model: maxConcurrent (the best worker count) with the thread cap and CPU
+    pinning the throughput was measured with. Empty if it was never calibrated
+    (or the model cannot be read).
+    """
+    host = host if host is not None else socket.gethostname()
+    entries = readCalibration(calfile).get(host,{})
+    if not entries:
+        return({})
+    try:
+        key = modelkey(modelfile)
+    except (OSError, SyntaxError):
+        return({})
+    if key not in entries:
+        return({})
+    entry = entries[key]
+    # entries of older versions were measured with the calibrate() defaults
+    return({'maxConcurrent': entry['workers'],
+            'threads': entry.get('threads',1),
+            'cpusets': 'auto' if entry.get('pin',True) else None})
+
+
+def workers(modelfile, default = 1, host = None, calfile = None):
+    """
+    Best number of concurrent RRA runs measured for this host and model, or
+    default if it was never calibrated (or the model cannot be read).
+    """
+    return(settings(modelfile,host,calfile).get('maxConcurrent',default))
+
+
+def calibrate(setupfile, levels = None, window = 0.2, rounds = 2, command = 'opensim-cmd', threads = 1, pin = True, timeout = None, workdir = None, calfile = None):
+    """
+    Runs short RRA windows of a real trial at increasing concurrency levels,
+    measures the throughput (evaluations per hour) of each level and stores the
+    level with the highest throughput for this host and model in calfile.
+    Returns the stored entry.
+        Optional keyword arguments:
+            levels -- concurrency levels to test (default = 1, 2, 4, ... up to the number of available CPUs)
+            window -- seconds of the trial simulated by each run, from its initial time (default = 0.2)
+            rounds -- runs per worker at each level (default = 2)
+            command -- opensim command line executable (default = 'opensim-cmd')
+            threads -- OpenMP/BLAS thread cap per run (default = 1)
+            pin -- pin each worker to its own CPU set (default = True)
+            timeout -- wall-clock limit in seconds for a single run
+            workdir -- folder for the calibration runs (default = a temporary folder, removed afterwards)
+    """
+    template = rraxml.setuptemplate(setupfile)
+    modelfile = template.get('model_file')
+    if not os.path.isabs(modelfile):
+        modelfile = os.path.join(os.path.dirname(os.path.abspath(setupfile)),modelfile)
+    t0 = float(template.get('initial_time'))
+    t1 = min(float(template.get('final_time')),t0 + window)
+
+    ncpus = len(rrarunner.availableCPUs())
+    if levels is None:
+        levels = [1]
+        while 2*levels[-1] <= ncpus:
+            levels.append(2*levels[-1])
+        if levels[-1] != ncpus:
+            levels.append(ncpus)
+
+    cleanup = workdir is None
+    workdir = workdir if workdir is not None else tempfile.mkdtemp(prefix = 'rracalibrate_')
+    throughput = {}
+    try:
+        for level in levels:
+            jobs = []
+            for k in range(0,level*rounds):
+                folder = os.path.join(workdir,'level' + str(level),'run' + str(k))
+                os.makedirs(folder,exist_ok = True)
+                jobfile = template.write(os.path.join(folder,'calib_Setup.xml'),name = 'calib',
+                                         results_directory = folder,output_model_file = os.path.join(folder,'calib.osim'),
+                                         final_time = t1)
+                jobs.append((jobfile,folder))
+
+            runner = rrarunner.rrarunner(maxConcurrent = level,timeout = timeout,command = command,
+                                         cpusets = 'auto' if pin else None,threads = threads)
+            tic = time.time()
+            results = runner.runAll(jobs)
+            elapsed = time.time() - tic
+            nok = len([r for r in results if r.succeeded()])
+            if nok < len(results):
+                log.warning('%d of %d calibration runs failed at %d workers', len(results) - nok, len(results), level)
+            throughput[level] = 3600*nok/elapsed if elapsed > 0 else 0
+            log.info('%d workers: %.0f evaluations/h', level, throughput[level])
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir,ignore_errors = True)
+
+    best = max(throughput.keys(),key = lambda level: throughput[level])
+    if throughput[best] == 0:
+        raise RuntimeError('no calibration run succeeded; check ' + setupfile)
+    entry = {'workers': best,
+             'evalsPerHour': {str(level): throughput[level] for level in throughput.keys()},
+             'window': t1 - t0,
+             'threads': threads,
+             'pin': pin,
+             'model': modelfile,
+             'updated': time.time()}
+
+    # merge into the stored calibrations (write then rename)
+    calfile = calfile if calfile is not None else CALFILE
+    stored = readCalibration(calfile)
+    stored.setdefault(socket.gethostname(),{})[modelkey(modelfile)] = entry
+    tmpfile = calfile + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tmpfile,'w') as f:
+        json.dump(stored,f,indent = 1)
+    os.replace(tmpfile,calfile)
+    return(entry)
+
+
+# calibrate from the command line: python rracalibrate.py <trial>/RRA_Setup.xml [--levels 1 2 4 8]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measure RRA throughput at increasing concurrency and store the best worker count for this host and model')
+    parser.add_argument('setup',help = 'RRA setup file of a real trial (e.g. <trial>/RRA_Setup.xml)')
+    parser.add_argument('--levels',type = int,nargs = '+',default = None,help = 'concurrency levels to test')
+    parser.add_argument('--window',type = float,default = 0.2,help = 'seconds simulated by each run')
+    parser.add_argument('--rounds',type = int,default = 2,help = 'runs per worker at each level')
+    parser.add_argument('--command',default = 'opensim-cmd',help = 'opensim command line executable')
+    parser.add_argument('--threads',type = int,default = 1,help = 'OpenMP/BLAS thread cap per run')
+    parser.add_argument('--no-pin',action = 'store_true',help = 'do not pin workers to CPU sets')
+    parser.add_argument('--calfile',default = None,help = 'calibration file (default: ~/.rra_calibration.json)')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+
+    entry = calibrate(args.setup,args.levels,args.window,args.rounds,args.command,args.threads,not args.no_pin,calfile = args.calfile)
+    print('best: ' + str(entry['workers']) + ' concurrent RRA runs (' + str(round(entry['evalsPerHour'][str(entry['workers'])])) + ' evaluations/h)')
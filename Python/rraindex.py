@@ -0,0 +1,303 @@
+# includes
+import os
+import math
+import time
+import uuid
+import contextlib
+import pickle
+import argparse
+import numpy as np
+import rrastorage
+#
+
+RESIDUALS = ['FX','FY','FZ','MX','MY','MZ']
+STALELOCK = 600 # seconds after which the lock of a crashed writer is broken
+
+# scalar columns of the index, in order; strings are stored as unicode arrays
+_textColumns = ['trial','participant','condition','stopReason','finalStatus']
+_numberColumns = ['updated','iterations','evaluations','bestIndex','fbest','sumRMSResiduals','sumRMSForces',
+                  'sumRMSMoments','sumRMSErrors','failures','wallTime','finalTime','massChange','massItrs',
+                  'forceNormF','momentNormF'] + ['rms' + r for r in RESIDUALS] + ['max' + r for r in RESIDUALS]
+# per-coordinate matrices (trials x coordinates, nan where a trial does not track a coordinate)
+_matrixColumns = ['weights','rmsErrors']
+
+
+def _float(value):
+    try:
+        return(float(value))
+    except (TypeError, ValueError):
+        return(math.nan)
+
+
+def trialsummary(trialpath, optfile = None, finalpath = None, participant = '', condition = ''):
+    """
+    Summarizes one finished (or running) TWSA trial for the index: best weights
+    and objective components from the optimization structure, iteration counts,
+    wall time and mass change, and the RMS/peak residuals and RMS tracking errors
+    of the final RRA outputs (nan residuals and the errors of the best iteration
+    if the final run is missing).
+    Returns a dictionary with one entry per index column.
+        Optional keyword arguments:
+            optfile -- optimization structure (default = <trialpath>/RRA_optWeights/opt_results.optStruct)
+            finalpath -- final RRA results folder (default = <trialpath>/RRA_Final)
+    """
+    if optfile is None:
+        optfile = os.path.join(trialpath,'RRA_optWeights','opt_results.optStruct')
+    if finalpath is None:
+        finalpath = os.path.join(trialpath,'RRA_Final')
+
+    with open(optfile,'rb') as f:
+        S = pickle.load(f)
+
+    objvals = S.ObjFuncValues.array()
+    best = int(np.argmin(objvals)) if len(objvals) else -1
+    runtimes = S.RunTimes.array()
+
+    summary = {'trial': os.path.abspath(trialpath),
+               'participant': participant,
+               'condition': condition,
+               'stopReason': S.stopReason or '',
+               'finalStatus': S.finalStatus or '',
+               'updated': os.path.getmtime(optfile),
+               'iterations': S.itr,
+               'evaluations': len(objvals),
+               'bestIndex': best,
+               'fbest': objvals[best] if best >= 0 else math.nan,
+               'failures': len([s for s in S.RunStatus if s in ['failed','timeout']]),
+               'finalTime': _float(S.finalTime),
+               'massChange': _float(S.massChange),
+               'massItrs': _float(S.massItrs),
+               'forceNormF': S.forceNormF,
+               'momentNormF': S.momentNormF}
+    summary['wallTime'] = float(np.nansum(runtimes)) + (summary['finalTime'] if math.isfinite(summary['finalTime']) else 0)
+    for name in ['sumRMSResiduals','sumRMSForces','sumRMSMoments','sumRMSErrors']:
+        history = getattr(S,name)
+        summary[name] = history[best] if 0 <= best < len(history) else math.nan
+
+    names = list(S.xcurrent.names)
+    weights = S.TestedSolutions[best] if best >= 0 else np.full(len(names),math.nan)
+    rmsErrors = S.RMSErrors[best] if 0 <= best < len(S.RMSErrors) else np.full(len(names),math.nan)
+
+    # residuals and errors of the final run
+    forces = os.path.join(finalpath,'RRA_Actuation_force.sto')
+    errors = os.path.join(finalpath,'RRA_pErr.sto')
+    for r in RESIDUALS:
+        summary['rms' + r] = math.nan
+        summary['max' + r] = math.nan
+    if os.path.isfile(forces):
+        header, labels, data = rrastorage.readStorage(forces)
+        for r in RESIDUALS:
+            if r in labels:
+                column = rrastorage.column(labels,data,r)
+                summary['rms' + r] = float(np.sqrt(np.mean(column**2)))
+                summary['max' + r] = float(np.max(np.abs(column)))
+    if os.path.isfile(errors):
+        header, labels, data = rrastorage.readStorage(errors)
+        rmsErrors = np.array([np.sqrt(np.mean(rrastorage.column(labels,data,n)**2)) if n in labels else math.nan for n in names])
+
+    summary['coordinates'] = names
+    summary['weights'] = np.asarray(weights,dtype = float)
+    summary['rmsErrors'] = np.asarray(rmsErrors,dtype = float)
+    return(summary)
+
+
+@contextlib.contextmanager
+def locked(filename, timeout = 120):
+    """
+    Holds <filename>.lock while the block runs, so trials finishing at the same
+    time do not load the index, add their row and overwrite each other's rows.
+    Raises TimeoutError if the lock is not acquired within timeout seconds.
+    """
+    lockfile = filename + '.lock'
+    folder = os.path.dirname(os.path.abspath(filename))
+    if not(os.path.isdir(folder)):
+        os.makedirs(folder,exist_ok = True)
+    tic = time.time()
+    while True:
+        try:
+            fd = os.open(lockfile,os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lockfile) > STALELOCK:
+                    os.remove(lockfile)
+                    continue
+            except OSError: # released in the meantime
+                continue
+            if time.time() - tic > timeout:
+                raise TimeoutError('could not lock ' + filename)
+            time.sleep(0.05)
+    try:
+        os.write(fd,str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        os.remove(lockfile)
+
+
+def add(filename, summaries):
+    """
+    Adds trial summaries (see trialsummary) to the index file, or replaces their
+    rows, under the index lock: the file is re-read, updated and saved as one step.
+    Returns the rows of the summaries.
+    """
+    if isinstance(summaries, dict):
+        summaries = [summaries]
+    with locked(filename):
+        index = resultsindex(filename)
+        rows = [index.upsert(summary) for summary in summaries]
+        index.save()
+    return(rows)
+
+
+# begin class def
+class resultsindex:
+    def __init__(self, filename):
+        """
+        Constructor method for class resultsindex:
+            Columnar study-level index of TWSA trial summaries stored in one numpy
+            .npz file: one row per trial, one array per column. Trials are added
+            or replaced with upsert() and the file is rewritten with save(); use
+            add() to update a shared index from several processes.
+            Columns are numpy arrays, so study queries are vectorized, e.g.
+                idx = rraindex.resultsindex('study_index.npz')
+                idx['trial'][idx['rmsFX'] > idx['forceNormF']]
+                np.median(idx['iterations'])
+            Per-coordinate columns ('weights', 'rmsErrors') are trials x coordinates
+            matrices over idx.coordinates; use idx.coordinate('rmsErrors','knee_angle_r').
+        """
+        self.filename = filename
+        self.coordinates = []
+        self.columns = {}
+        for name in _textColumns:
+            self.columns[name] = np.zeros(0,dtype = str)
+        for name in _numberColumns:
+            self.columns[name] = np.zeros(0)
+        for name in _matrixColumns:
+            self.columns[name] = np.zeros((0,0))
+
+        if os.path.isfile(filename):
+            with np.load(filename) as data:
+                self.coordinates = list(data['coordinates'])
+                for name in self.columns.keys():
+                    if name in data.files:
+                        self.columns[name] = data[name]
+                n = len(self.columns['trial'])
+                for name in _numberColumns: # columns added by a newer version
+                    if len(self.columns[name]) != n:
+                        self.columns[name] = np.full(n,math.nan)
+
+    def __len__(self):
+        return(len(self.columns['trial']))
+
+    def __getitem__(self, name):
+        return(self.columns[name])
+
+    def coordinate(self, column, name):
+        """
+        Returns the column of a per-coordinate matrix ('weights' or 'rmsErrors') for one coordinate.
+        """
+        return(self.columns[column][:,self.coordinates.index(name)])
+
+    def row(self, trialpath):
+        """
+        Returns the row of a trial, or None if it is not indexed.
+        """
+        rows = np.flatnonzero(self.columns['trial'] == os.path.abspath(trialpath))
+        return(int(rows[0]) if len(rows) else None)
+
+    def isCurrent(self, trialpath, optfile = None):
+        """
+        True if the trial is indexed and its optimization structure has not changed since.
+        """
+        if optfile is None:
+            optfile = os.path.join(trialpath,'RRA_optWeights','opt_results.optStruct')
+        r = self.row(trialpath)
+        return(r is not None and os.path.isfile(optfile) and self.columns['updated'][r] == os.path.getmtime(optfile))
+
+    def upsert(self, summary):
+        """
+        Adds a trial summary (see trialsummary) or replaces the row of the same trial.
+        """
+        # grow the coordinate axis of the matrices if the trial tracks new coordinates
+        newnames = [n for n in summary['coordinates'] if n not in self.coordinates]
+        if newnames:
+            self.coordinates = self.coordinates + newnames
+            for name in _matrixColumns:
+                old = self.columns[name]
+                grown = np.full((old.shape[0],len(self.coordinates)),math.nan)
+                grown[:,:old.shape[1]] = old
+                self.columns[name] = grown
+
+        r = self.row(summary['trial'])
+        if r is None:
+            r = len(self)
+            for name in _textColumns:
+                self.columns[name] = np.append(self.columns[name],'')
+            for name in _numberColumns:
+                self.columns[name] = np.append(self.columns[name],math.nan)
+            for name in _matrixColumns:
+                self.columns[name] = np.vstack([self.columns[name],np.full((1,len(self.coordinates)),math.nan)])
+
+        for name in _textColumns:
+            column = self.columns[name]
+            value = str(summary.get(name,''))
+            if len(value) > column.dtype.itemsize//4: # unicode arrays have a fixed width
+                column = column.astype('<U' + str(len(value)))
+            column[r] = value
+            self.columns[name] = column
+        for name in _numberColumns:
+            self.columns[name][r] = _float(summary.get(name))
+        cols = [self.coordinates.index(n) for n in summary['coordinates']]
+        for name in _matrixColumns:
+            self.columns[name][r,:] = math.nan
+            self.columns[name][r,cols] = summary[name]
+        return(r)
+
+    def save(self):
+        """
+        Writes the index (write then rename, so readers never see a partial file).
+        """
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        if not(os.path.isdir(folder)):
+            os.makedirs(folder)
+        tmpfile = self.filename + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmpfile,'wb') as f:
+            np.savez(f,coordinates = np.array(self.coordinates,dtype = str),**self.columns)
+        os.replace(tmpfile,self.filename)
+        return(self.filename)
+
+
+def update(filename, roots, force = False):
+    """
+    Adds every trial with an optimization structure below the root folders to
+    the index, skipping trials that are already current. Returns the number of
+    trials (re)indexed.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    index = resultsindex(filename)
+    summaries = []
+    for root in roots:
+        for folder, dirs, files in os.walk(root):
+            if os.path.basename(folder) != 'RRA_optWeights' or 'opt_results.optStruct' not in files:
+                continue
+            trialpath = os.path.dirname(folder)
+            if not force and index.isCurrent(trialpath):
+                continue
+            summaries.append(trialsummary(trialpath))
+    if summaries:
+        # the summaries are read without the lock; only the update of the file holds it
+        add(filename,summaries)
+    return(len(summaries))
+
+
+# build or refresh an index from the command line: python rraindex.py <index.npz> <study folder> [...]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Columnar index of TWSA trial results')
+    parser.add_argument('index',help = 'index file (.npz)')
+    parser.add_argument('roots',nargs = '+',help = 'folders searched for trials')
+    parser.add_argument('--force',action = 'store_true',help = 're-index trials that did not change')
+    args = parser.parse_args()
+
+    print('indexed ' + str(update(args.index,args.roots,args.force)) + ' trials')
@@ -0,0 +1,155 @@
+# includes
+import os
+import time
+import logging
+import importlib
+import numpy as np
+import rrarunner
+import rrastorage
+#
+
+log = logging.getLogger(__name__)
+
+# OpenSim API limits of the in-process path (OpenSim 4.x bindings):
+#  - CMCTool/RRATool only read the desired kinematics from desired_kinematics_file, so
+#    the kinematics are still parsed by OpenSim (in C++) at the start of every run.
+#  - the tool always prints its results; they are taken from the in-memory storages
+#    instead of being read back, but the files are still written to results_directory.
+#  - runs share this process: there is no timeout and a crash ends the TWSA.
+
+def toStorage(osim, labels, data, inDegrees = False):
+    """
+    Builds an osim.Storage from column labels (time first) and a 2D array with
+    one row per frame, e.g. as returned by rrastorage.readStorage.
+    """
+    sto = osim.Storage(max(data.shape[0],1))
+    columns = osim.ArrayStr()
+    for label in labels:
+        columns.append(label)
+    sto.setColumnLabels(columns)
+    for row in data:
+        values = osim.Vector(len(row)-1,0.0)
+        for j in range(1,len(row)):
+            values.set(j-1,float(row[j]))
+        sto.append(float(row[0]),values)
+    sto.setInDegrees(inDegrees)
+    return(sto)
+
+
+def fromStorage(sto):
+    """
+    Returns (labels, data) of an osim.Storage, as rrastorage.readStorage does for a file.
+    """
+    columns = sto.getColumnLabels()
+    labels = [columns.get(i) for i in range(0,columns.getSize())]
+    data = np.zeros((sto.getSize(),len(labels)))
+    for i in range(0,sto.getSize()):
+        row = sto.getStateVector(i)
+        values = row.getData()
+        data[i,0] = row.getTime()
+        for j in range(0,min(values.getSize(),len(labels)-1)):
+            data[i,j+1] = values.get(j)
+    return(labels, data)
+
+
+# begin class def
+class inprocessrunner:
+    def __init__(self):
+        """
+        Constructor method for class inprocessrunner:
+            Runs RRA setup files with the OpenSim bindings in this process instead of
+            opensim-cmd, with the same run(setupfile, cwd) interface as rrarunner. The
+            models and the external loads (ground reaction force storages built from
+            numpy arrays) are loaded once and reused by every run; the actuation forces
+            and position errors are returned as arrays in runresult.storages, taken from
+            the tool's storages after RRATool.run(), so the TWSA does not parse .sto text
+            per evaluation. Runs are serial.
+        """
+        self._osim = None
+        self._models = {} # model file: [mtime, model]
+        self._loads = {} # external loads file: [mtime, [(external force, storage it reads)]]
+
+    def __opensim__(self):
+        if self._osim is None:
+            self._osim = importlib.import_module('opensim')
+        return(self._osim)
+
+    def __model__(self, modelfile):
+        # parsed once per file (and modification), copied for every run
+        stamp = os.path.getmtime(modelfile)
+        cached = self._models.get(modelfile)
+        if cached is None or cached[0] != stamp:
+            cached = [stamp,self.__opensim__().Model(modelfile)]
+            self._models[modelfile] = cached
+        return(cached[1].clone())
+
+    def __externalForces__(self, loadsfile):
+        # ground reaction forces read once into numpy and handed to OpenSim as storages.
+        # Returns (force, storage) pairs; the data source is not kept by clone(), so it is
+        # set on the copy added to each run's model.
+        osim = self.__opensim__()
+        stamp = os.path.getmtime(loadsfile)
+        cached = self._loads.get(loadsfile)
+        if cached is None or cached[0] != stamp:
+            loads = osim.ExternalLoads(loadsfile,True)
+            storages = {}
+            forces = []
+            for i in range(0,loads.getSize()):
+                force = loads.get(i).clone()
+                datafile = force.get_data_source_name() or loads.getDataFileName()
+                if not os.path.isabs(datafile):
+                    datafile = os.path.join(os.path.dirname(os.path.abspath(loadsfile)),datafile)
+                if datafile not in storages:
+                    header, labels, data = rrastorage.readStorage(datafile)
+                    storages[datafile] = toStorage(osim,labels,data)
+                forces.append((force,storages[datafile]))
+            cached = [stamp,forces]
+            self._loads[loadsfile] = cached
+        return(cached[1])
+
+    def run(self, setupfile, cwd, timeout = None):
+        """
+        Runs one RRA setup file and returns an rrarunner.runresult; storages holds the
+        'Actuation_force' and 'pErr' results as (labels, data), or None if they could
+        not be taken from the tool (the results are then read from the printed files).
+        """
+        osim = self.__opensim__()
+        result = rrarunner.runresult(setupfile,cwd)
+        tic = time.time()
+        try:
+            tool = osim.RRATool(setupfile,False)
+            model = self.__model__(tool.getModelFilename())
+            tool.updateModelForces(model,setupfile) # reserve actuators (force_set_files)
+            loadsfile = tool.getExternalLoadsFileName()
+            if loadsfile:
+                for force, storage in self.__externalForces__(loadsfile):
+                    force = force.clone()
+                    force.setDataSource(storage)
+                    model.addForce(force)
+                tool.setExternalLoadsFileName('')
+            tool.setModel(model)
+            result.returncode = 0 if tool.run() else 1
+            result.storages = self.__results__(osim,model)
+        except Exception as e: # OpenSim reports failed runs as exceptions
+            result.returncode = 1
+            result.stderr = str(e)
+            log.debug('in-process RRA of %s failed: %s', setupfile, e)
+        result.walltime = time.time() - tic
+        return(result)
+
+    def __results__(self, osim, model):
+        # the Actuation analysis and the CMC controller added by the tool stay in the model
+        storages = {}
+        analyses = model.getAnalysisSet()
+        for i in range(0,analyses.getSize()):
+            actuation = osim.Actuation.safeDownCast(analyses.get(i))
+            if actuation is not None:
+                storages['Actuation_force'] = fromStorage(actuation.getForceStorage())
+        controllers = model.getControllerSet()
+        for i in range(0,controllers.getSize()):
+            cmc = osim.CMC.safeDownCast(controllers.get(i))
+            if cmc is not None:
+                storages['pErr'] = fromStorage(cmc.getPositionErrorStorage())
+        if len(storages) < 2:
+            return(None)
+        return(storages)
@@ -0,0 +1,308 @@
+# includes
+import os
+import json
+import uuid
+import hashlib
+import logging
+#
+
+log = logging.getLogger(__name__)
+
+STATEFILE = 'RRA_pipeline.json' # written to the trial folder
+
+_SCALARS = (str, int, float, bool, type(None))
+
+def _isScalar(value):
+    return(isinstance(value, _SCALARS) or (isinstance(value, (list, tuple)) and all(isinstance(v, _SCALARS) for v in value)))
+
+
+def _trialStamp(rra):
+    # an rrasetup (e.g. a TWSA cycle) is keyed by its trial and the stamps of its input files
+    fs = rra.fileset
+    stamps = {}
+    for name in [fs.modelname,fs.adjname,fs.kinfile,fs.grffile,fs.extloadsetup,fs.actuatorfile,fs.taskfile,fs.rrasetupfile]:
+        filename = os.path.join(fs.trialpath,name)
+        stamps[name] = [os.path.getmtime(filename),os.path.getsize(filename)] if os.path.isfile(filename) else None
+    return({'trial': os.path.abspath(fs.trialpath),'inputs': stamps})
+
+
+def _jsonable(obj):
+    # only explicit, stable values go into a key: never memory addresses or caches
+    if hasattr(obj,'fileset') and hasattr(obj,'trialpath'):
+        return(_trialStamp(obj))
+    if isinstance(obj, (set, frozenset)):
+        return(sorted(obj))
+    if hasattr(obj,'tolist'): # numpy arrays and scalars
+        return(obj.tolist())
+    if hasattr(obj,'__dict__') and not callable(obj):
+        # option objects (fidelityoptions, stoppingoptions, ...): their public scalar settings
+        return({k: v for k, v in vars(obj).items() if not k.startswith('_') and _isScalar(v)})
+    raise TypeError('stage parameter of type ' + type(obj).__name__ + ' cannot be part of a key')
+
+
+def _hashParams(params):
+    return(hashlib.sha1(json.dumps(params,sort_keys = True,default = _jsonable).encode()).hexdigest())
+
+
+def _resolve(value):
+    # file lists may be given as callables so they are evaluated when the stage runs
+    value = value() if callable(value) else value
+    return([v for v in value if v])
+
+
+# define data class for one step of a trial workflow
+class stage:
+    def __init__(self, name, run, inputs = (), outputs = (), params = None, after = ()):
+        """
+        Constructor method for class stage:
+            name -- unique stage name
+            run -- function called to perform the stage. It is given the record of the
+                   last completed run of this stage (None if there is none).
+            inputs -- source files the stage reads (not produced by another stage), or a
+                      function returning them
+            outputs -- files the stage produces, or a function returning them after the run
+            params -- settings that change the stage result (anything json serializable;
+                      option objects are keyed by their public scalar attributes and
+                      rrasetup objects, e.g. TWSA cycles, by their trial folder and the
+                      stamps of its input files; other objects raise TypeError)
+            after -- names of the stages whose outputs this stage uses
+        """
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params if params is not None else {}
+        self.after = list(after)
+
+
+# begin class def
+class pipeline:
+    def __init__(self, statefile, save = None, restore = None):
+        """
+        Constructor method for class pipeline:
+            A dependency graph of stages that are run in order and skipped when up to
+            date, like make. A stage is up to date if its key, a hash of its parameters,
+            the contents of its input files and the recorded output hashes of the stages
+            it runs after, matches the key of its last completed run and its outputs
+            were not changed since. Keys and file hashes are kept in the json statefile.
+            Optional keyword arguments:
+                save -- function returning json serializable state to remember after a
+                        stage runs (e.g. attributes set on an rrasetup)
+                restore -- function re-applying that state when the stage is skipped
+        """
+        self.statefile = statefile
+        self.stages = {}
+        self.order = []
+        self.save = save
+        self.restore = restore
+        self.state = {'stages': {}, 'files': {}, 'started': {}}
+        if os.path.isfile(statefile):
+            with open(statefile) as f:
+                self.state = json.load(f)
+        self.state.setdefault('started',{}) # key of the last started run of each stage
+        self._previous = {} # started keys replaced by the runs of this session
+
+    def add(self, s):
+        for name in s.after:
+            if name not in self.stages:
+                raise ValueError('stage ' + s.name + ' runs after unknown stage ' + name)
+        self.stages[s.name] = s
+        self.order.append(s.name) # stages are added after their dependencies, so this is a topological order
+        return(s)
+
+    def __hashFile__(self, filename):
+        # content hash, cached by modification time and size so unchanged files are not re-read
+        if not os.path.isfile(filename):
+            return(None)
+        stamp = [os.path.getmtime(filename),os.path.getsize(filename)]
+        cached = self.state['files'].get(filename)
+        if cached is not None and cached[:2] == stamp:
+            return(cached[2])
+        h = hashlib.sha1()
+        with open(filename,'rb') as f:
+            for block in iter(lambda: f.read(1 << 20),b''):
+                h.update(block)
+        self.state['files'][filename] = stamp + [h.hexdigest()]
+        return(h.hexdigest())
+
+    def key(self, name):
+        """
+        Current key of a stage.
+        """
+        s = self.stages[name]
+        upstream = {}
+        for dep in s.after:
+            record = self.state['stages'].get(dep)
+            upstream[dep] = record['outputs'] if record is not None else None
+        content = {'params': _hashParams(s.params),
+                   'inputs': {f: self.__hashFile__(f) for f in _resolve(s.inputs)},
+                   'after': upstream}
+        return(_hashParams(content))
+
+    def uptodate(self, name):
+        """
+        True if the stage's last run used the current parameters and inputs and its outputs are unchanged.
+        """
+        record = self.state['stages'].get(name)
+        if record is None or record['key'] != self.key(name):
+            return(False)
+        # outputs must be unchanged, except by later stages that write the same file (e.g. the mass iterations
+        # editing the adjusted model of the initial RRA); the hash recorded by the last writer is expected
+        for f in record['outputs'].keys():
+            expected = [self.state['stages'][n]['outputs'][f] for n in self.order
+                        if n in self.state['stages'] and f in self.state['stages'][n]['outputs']]
+            if self.__hashFile__(f) is None or self.__hashFile__(f) != expected[-1]:
+                return(False)
+        return(True)
+
+    def interrupted(self, name):
+        """
+        Key of an interrupted run of a stage (started, but no completed run with that
+        key was recorded after it), or None. While the stage runs, this refers to
+        the run before the current one.
+        """
+        started = self._previous[name] if name in self._previous else self.state['started'].get(name)
+        record = self.state['stages'].get(name)
+        if started is None or (record is not None and record['key'] == started):
+            return(None)
+        return(started)
+
+    def outdated(self):
+        """
+        Names of the stages a run() would execute, in order. Stages after an
+        outdated stage are reported too, since their inputs will change.
+        """
+        stale = []
+        for name in self.order:
+            if name in stale:
+                continue
+            if not self.uptodate(name) or any(dep in stale for dep in self.stages[name].after):
+                stale.append(name)
+        return(stale)
+
+    def run(self, force = ()):
+        """
+        Runs every stage that is not up to date, in order. Stage names in force
+        are run regardless. Returns the names of the stages that ran.
+        """
+        ran = []
+        for name in self.order:
+            s = self.stages[name]
+            record = self.state['stages'].get(name)
+            if name not in force and self.uptodate(name):
+                log.info('stage %s is up to date', name)
+                if self.restore is not None and record.get('saved') is not None:
+                    self.restore(record['saved'])
+                continue
+
+            log.info('running stage %s', name)
+            key = self.key(name)
+            # mark the run as started, so a stage interrupted now can tell that it may resume
+            self._previous[name] = self.state['started'].get(name)
+            self.state['started'][name] = key
+            self.__write__()
+            try:
+                s.run(record)
+            finally:
+                del self._previous[name]
+            outputs = {f: self.__hashFile__(f) for f in _resolve(s.outputs)}
+            self.state['stages'][name] = {'key': key,
+                                          'outputs': outputs,
+                                          'saved': self.save() if self.save is not None else None}
+            self.__write__()
+            ran.append(name)
+        return(ran)
+
+    def __write__(self):
+        # write then rename, so an interrupted run leaves the previous state
+        tmpfile = self.statefile + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmpfile,'w') as f:
+            json.dump(self.state,f,indent = 1)
+        os.replace(tmpfile,self.statefile)
+
+
+def trialpipeline(rra, taskOptions = None, reserveOptions = None, cropOptions = None, twsaOptions = None, massItrs = True):
+    """
+    Builds the standard workflow of one trial for an rrasetup object:
+        tasks -> createTasksFile(**taskOptions)
+        reserves -> createReservesFile(**reserveOptions)
+        extloads -> createExtLoads()
+        crop -> cropInputs(**cropOptions) (only if cropOptions is given)
+        initial -> initialRRA()
+        mass -> runMassItrsRRA() (only if massItrs)
+        twsa -> optimizeTrackingWeights(**twsaOptions)
+    Calling run() on the returned pipeline only recomputes the stages whose
+    settings or input files changed and everything downstream of them, e.g.
+    changing twsaOptions reruns only the TWSA. The TWSA starts from scratch
+    when it re-runs after a completed run, and resumes after an interrupted one.
+    """
+    taskOptions = taskOptions if taskOptions is not None else {}
+    reserveOptions = reserveOptions if reserveOptions is not None else {}
+    twsaOptions = twsaOptions if twsaOptions is not None else {}
+    fs = rra.fileset
+    trialfile = lambda name: os.path.join(fs.trialpath,name)
+
+    def save():
+        return({'toolsettings': dict(vars(rra.toolsettings)),
+                'window': list(rra.window) if rra.window is not None else None,
+                'initMassChange': rra.initMassChange,
+                'totalMassChange': rra.totalMassChange,
+                'numMassItrs': rra.numMassItrs})
+
+    def restore(saved):
+        rra.toolsettings.__dict__.update(saved['toolsettings'])
+        rra.window = tuple(saved['window']) if saved['window'] is not None else None
+        rra.initMassChange = saved['initMassChange']
+        rra.totalMassChange = saved['totalMassChange']
+        rra.numMassItrs = saved['numMassItrs']
+
+    pipe = pipeline(trialfile(STATEFILE),save,restore)
+    settings = {k: getattr(rra.toolsettings,k) for k in ['bForceset','bAdjustCOM','comBody','LPhz']}
+
+    pipe.add(stage('tasks',lambda record: rra.createTasksFile(**taskOptions),
+                   inputs = [rra.modfullpath],outputs = [trialfile(fs.taskfile)],params = taskOptions))
+    pipe.add(stage('reserves',lambda record: rra.createReservesFile(**reserveOptions),
+                   inputs = [rra.modfullpath],outputs = [trialfile(fs.actuatorfile)],params = reserveOptions))
+    pipe.add(stage('extloads',lambda record: rra.createExtLoads(),
+                   inputs = [],outputs = [trialfile(fs.extloadsetup)],
+                   params = {'grffile': fs.grffile,'settings': vars(rra.extloadsettings)}))
+    last = ['tasks','reserves','extloads']
+    if cropOptions is not None:
+        pipe.add(stage('crop',lambda record: rra.cropInputs(**cropOptions),
+                       inputs = [trialfile(fs.kinfile),trialfile(fs.grffile)],after = ['extloads'],
+                       outputs = lambda: [trialfile(rra.toolsettings.kinfile),trialfile(rra.toolsettings.extloadsetup)],
+                       params = cropOptions))
+        last = ['tasks','reserves','crop']
+
+    def initial(record):
+        # the mass iterations change these; start again from the constructor values
+        rra.toolsettings.modelname = fs.modelname
+        rra.toolsettings.rrasetupfile = fs.rrasetupfile
+        rra.toolsettings.resultspath = fs.resultspath
+        rra.totalMassChange = 0
+        rra.numMassItrs = 0
+        rra.initialRRA()
+
+    pipe.add(stage('initial',initial,
+                   inputs = [rra.modfullpath,trialfile(fs.kinfile),trialfile(fs.grffile)],after = last,
+                   outputs = [trialfile(fs.rrasetupfile),trialfile(fs.outname),trialfile(fs.adjname)],
+                   params = settings))
+    last = ['initial']
+    if massItrs:
+        pipe.add(stage('mass',lambda record: rra.runMassItrsRRA(),after = last,
+                       outputs = [trialfile(fs.masssetupfile),trialfile(fs.adjname)],params = settings))
+        last = ['mass']
+
+    def twsa(record):
+        options = dict(twsaOptions)
+        interrupted = pipe.interrupted('twsa')
+        if interrupted != pipe.key('twsa') and (record is not None or interrupted is not None):
+            # the saved progress is of a completed TWSA or of a run with other settings or
+            # inputs; a run interrupted with the current ones is resumed
+            options['overwrite'] = True
+        rra.optimizeTrackingWeights(**options)
+
+    pipe.add(stage('twsa',twsa,after = last,
+                   outputs = [trialfile(fs.optname),os.path.join(fs.optpath,'opt_results.optStruct')],
+                   params = twsaOptions))
+    return(pipe)
@@ -0,0 +1,361 @@
+# includes
+import asyncio
+import os
+import signal
+import threading
+import time
+import logging
+try:
+    import resource # POSIX only; memory limits are not enforced elsewhere
+except ImportError:
+    resource = None
+#
+
+log = logging.getLogger(__name__)
+
+# thread pools of the numerical libraries a tool may load; each is capped at runner.threads
+THREADVARS = ['OMP_NUM_THREADS','OPENBLAS_NUM_THREADS','MKL_NUM_THREADS','VECLIB_MAXIMUM_THREADS','NUMEXPR_NUM_THREADS']
+
+def parseCPUs(text):
+    """
+    Parses a CPU list such as '0-3,8,10-11' into a list of CPU numbers.
+    """
+    cpus = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first),int(last)+1))
+        elif part:
+            cpus.append(int(part))
+    return(cpus)
+
+
+def availableCPUs():
+    """
+    CPUs this process may run on (its affinity mask where supported, else all of them).
+    """
+    if hasattr(os,'sched_getaffinity'):
+        return(sorted(os.sched_getaffinity(0)))
+    return(list(range(0,os.cpu_count() or 1)))
+
+
+def _procUsage(pid):
+    # peak resident memory (bytes) and user+system CPU seconds of a running process, from /proc (Linux)
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            hwm = [l for l in f if l.startswith('VmHWM:')]
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')',1)[1].split()
+    except (OSError, IndexError):
+        return(None)
+    maxrss = int(hwm[0].split()[1])*1024 if hwm else None
+    cputime = (int(fields[11]) + int(fields[12]))/os.sysconf('SC_CLK_TCK') # utime, stime
+    return(maxrss, cputime)
+
+# define data class to store the outcome of a single opensim-cmd run
+class runresult:
+    def __init__(self, setupfile, cwd):
+        self.setupfile = setupfile
+        self.cwd = cwd
+        self.returncode = None
+        self.stdout = ''
+        self.stderr = ''
+        self.timedout = False
+        self.cancelled = False
+        self.walltime = 0
+        self.cpus = None # CPUs the run was pinned to (None: not pinned)
+        self.maxrss = None # peak resident memory in bytes, sampled while the run was alive (Linux)
+        self.cputime = None # user + system CPU seconds (Linux)
+        self.storages = None # results handed over in memory by in-process runs (rrainprocess)
+
+    def succeeded(self):
+        """
+        True if the tool ran to completion with a zero exit status.
+        """
+        return(self.returncode == 0 and not self.timedout and not self.cancelled)
+
+    def status(self):
+        """
+        Short status label stored in the optimization history: 'ok', 'failed', 'timeout' or 'cancelled'.
+        """
+        if self.timedout:
+            return('timeout')
+        elif self.cancelled:
+            return('cancelled')
+        elif self.returncode == 0:
+            return('ok')
+        else:
+            return('failed')
+
+
+# begin class def
+class rrarunner:
+    def __init__(self, maxConcurrent = 1, timeout = None, command = 'opensim-cmd', cpusets = None, threads = None, memoryLimit = None):
+        """
+        Constructor method for class rrarunner:
+            Launches opensim-cmd tools as asyncio subprocesses. Each run gets an
+            optional wall-clock timeout and its stdout/stderr are captured. At most
+            maxConcurrent runs execute at once, so a single process can drive many
+            concurrent RRA runs.
+            Optional keyword arguments:
+                maxConcurrent -- maximum number of simultaneous runs (default = 1)
+                timeout -- wall-clock limit in seconds for a single run. None disables the limit.
+                command -- opensim command line executable (default = 'opensim-cmd')
+                cpusets -- CPU sets the concurrent runs are pinned to: a list with one
+                 list of CPU numbers per run slot (e.g. [[0,1],[2,3]]), at least
+                 maxConcurrent of them, or 'auto' to split the CPUs available to this
+                 process evenly over maxConcurrent slots (with fewer CPUs than
+                 maxConcurrent, one run per CPU). None leaves placement to the OS
+                 (default). Linux only.
+                threads -- thread cap exported to every run through the OpenMP/BLAS
+                 environment variables (THREADVARS). None keeps the inherited environment.
+                memoryLimit -- address space limit in bytes per run (RLIMIT_AS); a run
+                 exceeding it fails instead of pushing the node into swap. POSIX only.
+        """
+        if cpusets is not None and cpusets != 'auto' and len(cpusets) < maxConcurrent:
+            raise ValueError('{} CPU sets for {} concurrent runs; every run slot needs its own set'.format(len(cpusets),maxConcurrent))
+        self.maxConcurrent = maxConcurrent
+        self.timeout = timeout
+        self.command = command
+        self.cpusets = cpusets
+        self.threads = threads
+        self.memoryLimit = memoryLimit
+        self.sampleInterval = 1.0 # seconds between samples of the resources a run uses
+        self._semaphore = None
+        self._loop = None
+        self._tasks = set()
+        self._busy = set() # run slots in use
+        self._background = None # event loop thread for runs started with submit()
+        self._lock = threading.Lock() # the runner may be shared by threads (e.g. the trials of a study)
+
+    def slotCPUs(self):
+        """
+        Returns the CPU set of every run slot, or None if runs are not pinned.
+        """
+        if self.cpusets is None or not hasattr(os,'sched_setaffinity'):
+            return(None)
+        if self.cpusets != 'auto':
+            return([list(c) for c in self.cpusets])
+        cpus = availableCPUs()
+        n = max(min(int(self.maxConcurrent),len(cpus)),1)
+        return([cpus[k*len(cpus)//n:(k+1)*len(cpus)//n] for k in range(0,n)])
+
+    def __environment__(self):
+        # environment of a run applying the thread cap
+        if self.threads is None:
+            return(None)
+        env = dict(os.environ)
+        for name in THREADVARS:
+            env[name] = str(int(self.threads))
+        return(env)
+
+    def __applyLimits__(self, pid, cpus):
+        # CPU set and memory limit of a started run. Applied from this process after the
+        # spawn rather than in a pre-exec hook, which is not safe while other threads run
+        # (the runner is driven from a background loop thread and shared by study trials).
+        # The tool has only just started, but pin every thread it already has.
+        if cpus is not None:
+            try:
+                tids = [int(t) for t in os.listdir('/proc/{}/task'.format(pid))]
+            except OSError:
+                tids = [pid]
+            for tid in tids:
+                try:
+                    os.sched_setaffinity(tid,cpus)
+                except ProcessLookupError:
+                    pass
+        limit = self.memoryLimit
+        if limit is not None and hasattr(resource,'prlimit'):
+            try:
+                resource.prlimit(pid,resource.RLIMIT_AS,(int(limit),int(limit)))
+            except ProcessLookupError:
+                pass
+
+    async def __sample__(self, pid, result):
+        # the peak memory and CPU time are gone once the process is reaped, so keep the latest sample
+        while True:
+            usage = _procUsage(pid)
+            if usage is not None:
+                result.maxrss, result.cputime = usage
+            await asyncio.sleep(self.sampleInterval)
+
+    def __getSemaphore__(self):
+        # semaphores are bound to an event loop; make a new one for each loop
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            slots = self.slotCPUs()
+            n = int(self.maxConcurrent) if slots is None else min(int(self.maxConcurrent),len(slots))
+            self._semaphore = asyncio.Semaphore(max(n,1))
+            self._loop = loop
+        return(self._semaphore)
+
+    async def runAsync(self, setupfile, cwd, timeout = None):
+        """
+        Coroutine that runs a single tool setup file with cwd as working directory.
+        Returns a runresult. A run exceeding the timeout (seconds, defaults to
+        self.timeout) is killed and reported as timed out. Cancelling the
+        coroutine kills the subprocess.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        result = runresult(setupfile, cwd)
+        async with self.__getSemaphore__():
+            # lowest free slot; the semaphore admits no more runs than there are CPU
+            # sets, so a slot's CPU set is never shared by two concurrent runs
+            slots = self.slotCPUs()
+            slot = 0
+            while slot in self._busy:
+                slot = slot + 1
+            self._busy.add(slot)
+            result.cpus = slots[slot] if slots else None
+
+            tic = time.time()
+            # own process group (POSIX) so a kill also reaches anything the tool spawned
+            proc = None
+            try:
+                proc = await asyncio.create_subprocess_exec(self.command, 'run-tool', setupfile, cwd = cwd,
+                                                            stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE,
+                                                            start_new_session = (os.name == 'posix'), env = self.__environment__())
+                self.__applyLimits__(proc.pid, result.cpus)
+            except BaseException:
+                if proc is not None:
+                    await self.__kill__(proc)
+                self._busy.discard(slot)
+                raise
+            sampler = asyncio.ensure_future(self.__sample__(proc.pid, result))
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(), timeout)
+                result.stdout = out.decode(errors = 'replace')
+                result.stderr = err.decode(errors = 'replace')
+            except asyncio.TimeoutError:
+                result.timedout = True
+                await self.__kill__(proc)
+            except asyncio.CancelledError:
+                result.cancelled = True
+                await self.__kill__(proc)
+                raise
+            finally:
+                sampler.cancel()
+                self._busy.discard(slot)
+                result.returncode = proc.returncode
+                result.walltime = time.time() - tic
+
+        if not result.succeeded():
+            log.warning('RRA run %s: %s', result.status(), setupfile)
+        log.debug('RRA run %.1f s wall, %s s CPU, %s bytes peak memory, CPUs %s: %s',
+                  result.walltime, result.cputime, result.maxrss, result.cpus, setupfile)
+        return(result)
+
+    async def __kill__(self, proc):
+        if proc.returncode is None:
+            try:
+                if os.name == 'posix':
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def runAllAsync(self, jobs, timeout = None):
+        """
+        Coroutine that runs a list of (setupfile, cwd) jobs concurrently, limited
+        by maxConcurrent. Results are returned in the order of the jobs. Jobs that
+        are still running when cancel() is called are reported as cancelled.
+        """
+        tasks = [asyncio.ensure_future(self.runAsync(setupfile, cwd, timeout)) for (setupfile, cwd) in jobs]
+        self._tasks.update(tasks)
+        try:
+            outcomes = await asyncio.gather(*tasks, return_exceptions = True)
+        finally:
+            self._tasks.difference_update(tasks)
+
+        results = []
+        for (setupfile, cwd), outcome in zip(jobs, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                result = runresult(setupfile, cwd)
+                result.cancelled = True
+                results.append(result)
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results.append(outcome)
+        return(results)
+
+    def cancel(self):
+        """
+        Cancels every run started through runAllAsync that has not finished yet (stragglers).
+        """
+        for task in list(self._tasks):
+            # the runs may be on the background loop thread
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def __backgroundLoop__(self):
+        with self._lock:
+            if self._background is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target = loop.run_forever,daemon = True)
+                thread.start()
+                self._background = loop
+        return(self._background)
+
+    async def __startTask__(self, setupfile, cwd, timeout):
+        return(asyncio.ensure_future(self.runAsync(setupfile, cwd, timeout)))
+
+    async def __waitTask__(self, task):
+        return(await asyncio.shield(task))
+
+    async def __cancelTasks__(self, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+    def submit(self, setupfile, cwd, timeout = None):
+        """
+        Starts a run in the background (on an event loop thread owned by the runner)
+        and returns a handle for wait() or discard(). Used to keep several runs in
+        flight from blocking code, e.g. speculative TWSA candidates.
+        """
+        loop = self.__backgroundLoop__()
+        return(asyncio.run_coroutine_threadsafe(self.__startTask__(setupfile, cwd, timeout), loop).result())
+
+    def wait(self, handle):
+        """
+        Blocks until a run started with submit() has finished and returns its runresult.
+        """
+        return(asyncio.run_coroutine_threadsafe(self.__waitTask__(handle), self._background).result())
+
+    def discard(self, handles):
+        """
+        Cancels runs started with submit() and returns once their processes are killed.
+        """
+        if handles:
+            asyncio.run_coroutine_threadsafe(self.__cancelTasks__(list(handles)), self._background).result()
+
+    def __blocking__(self, coro):
+        # run on the runner's own loop thread rather than asyncio.run, which fails when
+        # the caller already has a running loop (Jupyter, Spyder, ...); the runs also
+        # share one semaphore with those started through submit()
+        future = asyncio.run_coroutine_threadsafe(coro, self.__backgroundLoop__())
+        try:
+            return(future.result())
+        except BaseException:
+            # e.g. KeyboardInterrupt: do not leave the processes running
+            future.cancel()
+            raise
+
+    def run(self, setupfile, cwd, timeout = None):
+        """
+        Blocking wrapper around runAsync; can be called from code that is itself
+        running in an event loop.
+        """
+        return(self.__blocking__(self.runAsync(setupfile, cwd, timeout)))
+
+    def runAll(self, jobs, timeout = None):
+        """
+        Blocking wrapper around runAllAsync; can be called from code that is itself
+        running in an event loop.
+        """
+        return(self.__blocking__(self.runAllAsync(jobs, timeout)))
@@ -0,0 +1,132 @@
+# includes
+import math
+import numpy as np
+#
+
+def readStorage(filename):
+    """
+    Reads an OpenSim storage (.sto) or motion (.mot) text file without the
+    OpenSim bindings or pandas.
+    Returns (header, labels, data): the header lines up to and including
+    'endheader', the list of column labels (time first) and a 2D numpy array
+    with one row per frame.
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+
+    for l in range(0,len(lines)):
+        if lines[l].strip().lower() == 'endheader':
+            break
+    else:
+        raise ValueError('no endheader line found in ' + filename)
+
+    header = lines[:l+1]
+    labels = [c.strip() for c in lines[l+1].split('\t') if c.strip()] # files often end each line with a tab
+    rows = [r for r in lines[l+2:] if r.strip()]
+    data = np.loadtxt(rows, ndmin = 2, usecols = range(0,len(labels))) if rows else np.zeros((0,len(labels)))
+    return(header, labels, data)
+
+
+def countRows(filename):
+    """
+    Number of data rows of a storage/motion file, without parsing them.
+    """
+    rows = 0
+    inheader = True
+    with open(filename) as f:
+        for line in f:
+            if inheader:
+                inheader = line.strip().lower() != 'endheader'
+            elif line.strip():
+                rows = rows + 1
+    return(max(rows-1,0)) # the first line after the header holds the column labels
+
+
+def lastTime(filename):
+    """
+    Time of the last data row of a storage/motion file, read from the end of the
+    file (nan if the file has no data rows).
+    """
+    with open(filename,'rb') as f:
+        f.seek(0,2)
+        size = f.tell()
+        f.seek(max(size-65536,0))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        if line.strip():
+            try:
+                return(float(line.split()[0]))
+            except ValueError: # column labels or header
+                return(math.nan)
+    return(math.nan)
+
+
+def column(labels, data, name):
+    """
+    Returns the column of data labelled name.
+    """
+    return(data[:,labels.index(name)])
+
+
+def writeStorage(filename, header, labels, data):
+    """
+    Writes a storage/motion file with the given header lines (as returned by
+    readStorage), column labels and data. The row, column and range entries of
+    the header are updated to match data.
+    """
+    header = list(header)
+    for l in range(0,len(header)):
+        key = header[l].strip().lower()
+        if key.startswith('datarows'):
+            header[l] = 'datarows ' + str(data.shape[0]) + '\n'
+        elif key.startswith('nrows='):
+            header[l] = 'nRows=' + str(data.shape[0]) + '\n'
+        elif key.startswith('datacolumns'):
+            header[l] = 'datacolumns ' + str(data.shape[1]) + '\n'
+        elif key.startswith('ncolumns='):
+            header[l] = 'nColumns=' + str(data.shape[1]) + '\n'
+        elif key.startswith('range') and data.shape[0]:
+            header[l] = 'range ' + ('%e' % data[0,0]) + ' ' + ('%e' % data[-1,0]) + '\n'
+
+    with open(filename,'w') as f:
+        f.writelines(header)
+        f.write('\t'.join(labels) + '\n')
+        np.savetxt(f,data,fmt = '%.10g',delimiter = '\t')
+    return(filename)
+
+
+def crop(data, t0, t1, pad = 0):
+    """
+    Returns the rows of data (time in the first column) covering t0 - pad to
+    t1 + pad, including the samples just outside that interval so the whole
+    window can be interpolated.
+    """
+    time = data[:,0]
+    i0 = max(np.searchsorted(time,t0-pad,'right')-1,0)
+    i1 = min(np.searchsorted(time,t1+pad,'left'),len(time)-1)
+    return(data[i0:i1+1])
+
+
+def decimate(data, n):
+    """
+    Returns every n-th row of data, always keeping the last row so the time range is unchanged.
+    """
+    keep = np.arange(0,data.shape[0],max(int(n),1))
+    if data.shape[0] and keep[-1] != data.shape[0]-1:
+        keep = np.append(keep,data.shape[0]-1)
+    return(data[keep])
+
+
+def resample(data, rate):
+    """
+    Linearly resamples every column of data to a uniform time grid at rate (Hz)
+    spanning the time range of data.
+    """
+    time = data[:,0]
+    n = int(math.floor((time[-1]-time[0])*rate + 1e-9)) + 1
+    newtime = time[0] + np.arange(0,n)/rate
+    out = np.empty((n,data.shape[1]))
+    out[:,0] = newtime
+    for c in range(1,data.shape[1]):
+        out[:,c] = np.interp(newtime,time,data[:,c])
+    return(out)
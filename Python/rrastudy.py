@@ -0,0 +1,196 @@
+# includes
+import math
+import logging
+import concurrent.futures
+import numpy as np
+import reduceresiduals
+#
+
+log = logging.getLogger(__name__)
+
+def improvementRate(objvals, window = 10):
+    """
+    Mean decrease of the best objective value per evaluation over the last
+    window evaluations of a TWSA history. inf if the history is too short to
+    tell (or the best value only just became finite), 0 if nothing succeeded.
+    """
+    objvals = np.asarray(objvals,dtype = float)
+    if len(objvals) < 2:
+        return(math.inf)
+    best = np.minimum.accumulate(np.where(np.isnan(objvals),math.inf,objvals))
+    w = min(window,len(objvals)-1)
+    before, now = best[-w-1], best[-1]
+    if not math.isfinite(now):
+        return(0.0)
+    if not math.isfinite(before):
+        return(math.inf)
+    return(float((before - now)/w))
+
+
+def runCount(rra, S, start = 0):
+    """
+    RRA runs made for evaluations start, start+1, ... of a TWSA history: the
+    screening run of every screened candidate and the full run of every promoted
+    one, on the trial and on each of its other cycles. Speculative runs cancelled
+    along the way are counted in S.cancelledRuns.
+    """
+    screened = int(np.sum(~np.isnan(S.ScreenValues.array()[start:])))
+    promoted = int(np.sum(S.Promoted[start:]))
+    return(screened + promoted*(1 + len(rra.cycles)))
+
+
+# begin class def
+class studyscheduler:
+    def __init__(self, trials, budget, workers = None, window = 10, explore = 0.5, deadline = None, **twsaOptions):
+        """
+        Constructor method for class studyscheduler:
+            Shares a global budget of RRA evaluations between the TWSAs of several
+            trials instead of giving every trial the same number of iterations. Each
+            free evaluation slot goes to the active trial with the highest priority:
+            the fraction of its remaining gap to fcn_threshold that it closed per
+            evaluation over a recent window, plus an exploration bonus for trials
+            with few evaluations. Trials are retired (and finished) when they reach
+            the threshold, stagnate or hit max_itrs; trials still active when the
+            budget is spent are finished with stopReason 'budget'.
+            trials -- list of rrasetup objects (inputs prepared, mass iterations done)
+            budget -- RRA runs of all trials together, including their initial evaluations.
+             Screening runs, the runs of the other cycles and cancelled speculative
+             runs count as well (see runCount)
+            Optional keyword arguments:
+                workers -- evaluations (of different trials) run at once. Defaults to the
+                 runner maxConcurrent of the first trial, i.e. its rracalibrate worker count.
+                 If that runner pins runs to CPU sets, every trial uses it.
+                window -- evaluations the improvement rate is estimated over (default = 10)
+                explore -- weight of the exploration bonus (default = 0.5)
+                deadline -- optional wall-clock time (time.time() seconds) for the whole
+                 study. A trial is retired with stopReason 'deadline' once another of its
+                 evaluations would not be done by then (see optimizeTrackingWeights)
+                twsaOptions -- keyword arguments of optimizeTrackingWeights (min_itrs,
+                 max_itrs, fcn_threshold, rerun_final, ...). max_itrs remains a per-trial
+                 ceiling; stopping defaults to stoppingoptions() so stagnated trials are retired.
+            A trial whose TWSA raises an exception is retired with stopReason 'failed'
+            (the exception is logged and kept in errors; the saved progress of the trial
+            can be resumed) and the other trials go on.
+        """
+        self.trials = list(trials)
+        runner = self.trials[0].__evaluationRunner__()
+        if runner.cpusets is not None:
+            # pinned runners hand out the same CPU sets, so the trials share one runner
+            for rra in self.trials[1:]:
+                rra.runner = runner
+        self.budget = budget
+        self.workers = workers if workers is not None else max(int(runner.maxConcurrent),1)
+        self.window = window
+        self.explore = explore
+        self.deadline = deadline
+        self.twsaOptions = twsaOptions
+        self.used = 0 # RRA runs made so far
+        self.states = {} # trial path: optimization structure
+        self.errors = {} # trial path: exception of a failed trial
+
+    def priority(self, S, total):
+        """
+        Expected fraction of the remaining gap to the threshold closed by the next
+        evaluation of a trial, plus an upper-confidence exploration bonus.
+        """
+        n = len(S.ObjFuncValues)
+        rate = improvementRate(S.ObjFuncValues.array(),self.window)
+        if math.isinf(rate):
+            return(math.inf)
+        objvals = S.ObjFuncValues.array()
+        best = np.nanmin(objvals) if np.any(np.isfinite(objvals)) else math.inf
+        gap = max(best - S.thresh,1e-9)
+        bonus = self.explore*math.sqrt(math.log(max(total,2))/n)
+        return(rate/gap + bonus)
+
+    def __fail__(self, rra, error):
+        # retire a trial whose TWSA raised; its scratch space is not needed anymore
+        log.error('trial %s failed, retiring it: %s', rra.fileset.trialpath, error, exc_info = error)
+        self.errors[rra.fileset.trialpath] = error
+        S = self.states.get(rra.fileset.trialpath)
+        if S is not None:
+            S.stopReason = 'failed'
+        for trial in [rra] + list(rra.cycles):
+            trial.__closeScratch__()
+
+    def run(self):
+        """
+        Runs the study until every trial is retired or the budget is spent (or the
+        deadline passed).
+        Returns {trial path: stopReason}.
+        """
+        options = dict(self.twsaOptions)
+        rerun_final = options.pop('rerun_final',False)
+        options.setdefault('stopping',reduceresiduals.stoppingoptions())
+        if self.deadline is not None:
+            options['deadline'] = self.deadline
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.workers) as pool:
+            # start (or resume) every trial; fresh trials run their initial evaluation
+            futures = {pool.submit(rra.beginOptimization,**options): rra for rra in self.trials}
+            active = list(self.trials)
+            for future in concurrent.futures.as_completed(futures):
+                rra = futures[future]
+                try:
+                    S = future.result()
+                except Exception as e:
+                    self.__fail__(rra,e)
+                    active.remove(rra)
+                    continue
+                S.stopReason = None
+                self.states[rra.fileset.trialpath] = S
+                self.used = self.used + runCount(rra,S,rra._session[1])
+
+            running = {} # future: (trial, evaluations and cancelled runs before the step)
+            while True:
+                # retire trials that converged, stagnated or reached max_itrs
+                busy = [t for t, before in running.values()]
+                for rra in [t for t in active if t not in busy]:
+                    S = self.states[rra.fileset.trialpath]
+                    S.stopReason = rra.stopCondition(S)
+                    if S.stopReason is not None:
+                        log.info('retiring %s after %d evaluations (%s)', rra.fileset.trialpath, len(S.ObjFuncValues), S.stopReason)
+                        active.remove(rra)
+
+                # hand the free slots to the most promising idle trials
+                total = sum(len(self.states[t.fileset.trialpath].ObjFuncValues) for t in active)
+                while len(running) < self.workers and self.used + len(running) < self.budget:
+                    busy = [t for t, before in running.values()]
+                    idle = [t for t in active if t not in busy]
+                    if not idle:
+                        break
+                    rra = max(idle,key = lambda t: self.priority(self.states[t.fileset.trialpath],total))
+                    S = self.states[rra.fileset.trialpath]
+                    running[pool.submit(rra.stepOptimization,S)] = (rra,(len(S.ObjFuncValues),S.cancelledRuns))
+                if not running:
+                    break
+
+                done, pending = concurrent.futures.wait(running.keys(),return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    rra, (evaluations, cancelled) = running.pop(future)
+                    try:
+                        S = future.result()
+                    except Exception as e:
+                        self.__fail__(rra,e)
+                        active.remove(rra)
+                        continue
+                    self.states[rra.fileset.trialpath] = S
+                    self.used = self.used + runCount(rra,S,evaluations) + S.cancelledRuns - cancelled
+                log.info('study: %d/%d RRA runs, %d trials active', self.used, self.budget, len(active))
+
+        # budget spent: finish the remaining trials with their best weights so far
+        for rra in active:
+            self.states[rra.fileset.trialpath].stopReason = 'budget'
+        results = {}
+        for rra in self.trials:
+            if rra.fileset.trialpath in self.errors:
+                results[rra.fileset.trialpath] = 'failed'
+                continue
+            try:
+                S = rra.finishOptimization(self.states[rra.fileset.trialpath],rerun_final)
+            except Exception as e:
+                self.__fail__(rra,e)
+                results[rra.fileset.trialpath] = 'failed'
+                continue
+            results[rra.fileset.trialpath] = S.stopReason
+        return(results)
@@ -0,0 +1,229 @@
+# includes
+import os
+import json
+import math
+import time
+import uuid
+import socket
+import argparse
+import threading
+import http.server
+#
+
+STATUSFILE = 'status.json' # written to the RRA_optWeights folder of every trial
+
+def writeStatus(filename, status):
+    """
+    Writes a status dictionary as json. The file is written under a temporary
+    name and renamed, so readers never see a partial file.
+    """
+    tmpfile = filename + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tmpfile,'w') as f:
+        json.dump(status,f,indent = 1)
+    os.replace(tmpfile,filename)
+    return(filename)
+
+
+def readStatus(filename):
+    """
+    Returns the status dictionary stored in filename, or None if it is missing or unreadable.
+    """
+    try:
+        with open(filename) as f:
+            return(json.load(f))
+    except (OSError, ValueError):
+        return(None)
+
+
+def _number(value):
+    # json has no inf/nan
+    value = float(value)
+    return(value if math.isfinite(value) else None)
+
+
+def trialStatus(S, trialpath, started, evals0 = 0, state = 'running'):
+    """
+    Summarizes an optimization structure (rrasetup._optStruct) for the status file.
+    started is the time.time() the current session began and evals0 the number
+    of evaluations already in S at that point; together they give the throughput
+    of this session, which is used for the ETA to i_max.
+    """
+    now = time.time()
+    nevals = len(S.ObjFuncValues)
+    objvals = S.ObjFuncValues.array() if nevals else []
+    runtimes = [t for t in S.RunTimes if math.isfinite(t)]
+    memory = [m for m in S.RunMemory if math.isfinite(m)]
+    failures = [s for s in S.RunStatus if s in ['failed','timeout']]
+
+    # consecutive failed runs at the end of the history point at a stuck trial
+    consecutive = 0
+    for s in reversed(S.RunStatus):
+        if s not in ['failed','timeout']:
+            break
+        consecutive = consecutive + 1
+
+    elapsed = now - started
+    if nevals > evals0 and elapsed > 0:
+        evalsPerHour = 3600*(nevals - evals0)/elapsed
+    elif runtimes:
+        evalsPerHour = 3600/(sum(runtimes)/len(runtimes))
+    else:
+        evalsPerHour = None
+
+    remaining = max(S.i_max - S.itr, 0) + 1 # iterations plus the final RRA
+    if state != 'running':
+        eta = 0
+    elif evalsPerHour:
+        eta = 3600*remaining/evalsPerHour
+    else:
+        eta = None
+    if state == 'running' and S.deadline is not None:
+        # the TWSA stops by its deadline at the latest
+        eta = max(S.deadline - now,0) if eta is None else min(eta,max(S.deadline - now,0))
+
+    status = {'trial': trialpath,
+              'host': socket.gethostname(),
+              'pid': os.getpid(),
+              'state': state,
+              'iteration': S.itr,
+              'i_min': S.i_min,
+              'i_max': S.i_max,
+              'evaluations': nevals,
+              'best': _number(min(objvals)) if nevals else None,
+              'current': _number(S.fcurrent) if nevals else None,
+              'latest': _number(objvals[-1]) if nevals else None,
+              'evalsPerHour': evalsPerHour,
+              'meanRunTime': sum(runtimes)/len(runtimes) if runtimes else None,
+              'peakMemory': max(memory) if memory else None,
+              'eta': eta,
+              'deadline': S.deadline,
+              'failures': len(failures),
+              'consecutiveFailures': consecutive,
+              'stepLimitHits': len([h for h in S.RunStepLimit if h]),
+              'lastRunStatus': S.RunStatus[-1] if S.RunStatus else None,
+              'finalStatus': S.finalStatus,
+              'stopReason': S.stopReason,
+              'convergence': {k: _number(v) for k, v in S.convergence.items()} if S.convergence else None,
+              'started': started,
+              'updated': now}
+    return(status)
+
+
+def collectStatus(roots, staleAfter = 900):
+    """
+    Finds and reads the status file of every trial below the given root folders.
+    Running trials whose status was not updated for staleAfter seconds (or five
+    mean run times, if longer) are flagged as stale.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+
+    trials = []
+    now = time.time()
+    for root in roots:
+        for folder, dirs, files in os.walk(root):
+            if STATUSFILE not in files:
+                continue
+            status = readStatus(os.path.join(folder,STATUSFILE))
+            if status is None:
+                continue
+            limit = max(staleAfter, 5*(status.get('meanRunTime') or 0))
+            status['age'] = now - status.get('updated',now)
+            status['stale'] = status.get('state') == 'running' and status['age'] > limit
+            trials.append(status)
+
+    trials.sort(key = lambda s: s.get('trial',''))
+    return(trials)
+
+
+def summarize(trials):
+    """
+    Batch totals for a list of trial status dictionaries.
+    """
+    running = [s for s in trials if s.get('state') == 'running']
+    return({'trials': len(trials),
+            'running': len(running),
+            'finished': len([s for s in trials if s.get('state') == 'finished']),
+            'stale': len([s for s in trials if s.get('stale')]),
+            'failures': sum(s.get('failures',0) for s in trials),
+            'evalsPerHour': sum(s.get('evalsPerHour') or 0 for s in running if not s.get('stale')),
+            'eta': max([s.get('eta') or 0 for s in running] + [0])})
+
+
+# begin class def
+class statusserver:
+    def __init__(self, roots, host = '127.0.0.1', port = 8765, staleAfter = 900):
+        """
+        Constructor method for class statusserver:
+            Local HTTP endpoint aggregating the status files of all trials below
+            the root folders. GET / (or /status) returns json with a batch summary
+            and one entry per trial; GET /trials returns only the trial list.
+            Optional keyword arguments:
+                host -- interface to bind (default = '127.0.0.1', local only)
+                port -- TCP port (default = 8765, 0 picks a free port)
+                staleAfter -- seconds without an update before a running trial is flagged stale (default = 900)
+        """
+        self.roots = [roots] if isinstance(roots, str) else list(roots)
+        self.staleAfter = staleAfter
+        server = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0].rstrip('/')
+                trials = collectStatus(server.roots,server.staleAfter)
+                if path in ['','/status']:
+                    body = {'summary': summarize(trials), 'trials': trials}
+                elif path == '/trials':
+                    body = trials
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type','application/json')
+                self.send_header('Content-Length',str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass # keep the console for the optimization output
+
+        self.httpd = http.server.ThreadingHTTPServer((host,port),handler)
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        """
+        Serves in a background thread, e.g. next to a batch running in the same process.
+        """
+        self._thread = threading.Thread(target = self.httpd.serve_forever,daemon = True)
+        self._thread.start()
+        return(self)
+
+    def serve(self):
+        """
+        Serves until interrupted.
+        """
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.httpd.server_close()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# serve the aggregated status from the command line: python rratelemetry.py <study folder> [...] [--port PORT]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'JSON endpoint aggregating the status of running TWSA trials')
+    parser.add_argument('roots',nargs = '+',help = 'folders searched for trial status files')
+    parser.add_argument('--host',default = '127.0.0.1',help = 'interface to bind (default: local only)')
+    parser.add_argument('--port',type = int,default = 8765,help = 'TCP port (default: 8765)')
+    parser.add_argument('--stale',type = float,default = 900,help = 'seconds without an update before a running trial is flagged stale')
+    args = parser.parse_args()
+
+    server = statusserver(args.roots,args.host,args.port,args.stale)
+    print('serving trial status on http://' + args.host + ':' + str(server.port))
+    server.serve()
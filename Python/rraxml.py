@@ -0,0 +1,255 @@
+# includes
+import os
+import xml.etree.ElementTree as ET
+#
+
+def _parse(filename):
+    # keep the comments OpenSim writes next to every property
+    parser = ET.XMLParser(target = ET.TreeBuilder(insert_comments = True))
+    return(ET.parse(filename, parser))
+
+
+def _text(value):
+    # format a python value the way OpenSim writes properties
+    if isinstance(value, bool):
+        return('true' if value else 'false')
+    elif isinstance(value, (list, tuple)):
+        return(' '.join(_text(v) for v in value))
+    elif isinstance(value, float):
+        return(repr(value))
+    else:
+        return(str(value))
+
+
+# begin class def
+class tasktemplate:
+    def __init__(self, filename):
+        """
+        Constructor method for class tasktemplate:
+            Parses a CMC task set xml file once. write() then emits copies of it
+            with new tracking weights without loading the OpenSim bindings.
+        """
+        self.filename = filename
+        self.tree = _parse(filename)
+        self.tasks = [t for t in self.tree.getroot().iter() if t.find('weight') is not None and t.get('name') is not None]
+        self.names = [t.get('name') for t in self.tasks]
+        self._weights = [t.find('weight').text for t in self.tasks]
+
+    def weights(self):
+        """
+        Returns the first (tracking) weight of every task in file order.
+        """
+        return([float(w.split()[0]) for w in self._weights])
+
+    def write(self, filename, names, values):
+        """
+        Writes the task set to filename with the weight of each task in names set
+        to the matching entry of values (remaining weight components are 1).
+        Tasks not listed keep the weight from the template.
+        """
+        lookup = dict(zip(names, values))
+        for task, weight in zip(self.tasks, self._weights):
+            name = task.get('name')
+            if name in lookup:
+                task.find('weight').text = ' ' + _text([float(lookup[name]), 1, 1])
+            else:
+                task.find('weight').text = weight
+        self.tree.write(filename, encoding = 'UTF-8', xml_declaration = True)
+        return(filename)
+
+
+class setuptemplate:
+    def __init__(self, filename):
+        """
+        Constructor method for class setuptemplate:
+            Parses an OpenSim tool setup xml file (e.g. RRA_Setup.xml) once. write()
+            emits copies with a few properties changed, without loading the OpenSim bindings.
+        """
+        self.filename = filename
+        self.tree = _parse(filename)
+        root = self.tree.getroot()
+        if root.tag == 'OpenSimDocument':
+            # first element child; the tool may be preceded by comments
+            self.tool = [child for child in root if isinstance(child.tag, str)][0]
+        else:
+            self.tool = root
+
+    def get(self, prop):
+        """
+        Returns the text of a tool property, or None if the template does not define it.
+        """
+        element = self.tool.find(prop)
+        if element is None or element.text is None:
+            return(None)
+        return(element.text.strip())
+
+    def write(self, filename, name = None, **props):
+        """
+        Writes the setup to filename with the tool name and the given properties
+        replaced, e.g. write(file, name = 'optItr', results_directory = path,
+        maximum_number_of_integrator_steps = 20000). The template is left unchanged.
+        """
+        # patch the parsed tree in place, write it, then restore the template values
+        oldname = self.tool.get('name')
+        restore = []
+        added = []
+        if name is not None:
+            self.tool.set('name', name)
+        for prop in props.keys():
+            element = self.tool.find(prop)
+            if element is None:
+                element = ET.SubElement(self.tool, prop)
+                added.append(element)
+            else:
+                restore.append((element, element.text))
+            element.text = _text(props[prop])
+        try:
+            self.tree.write(filename, encoding = 'UTF-8', xml_declaration = True)
+        finally:
+            if oldname is not None:
+                self.tool.set('name', oldname)
+            for element, text in restore:
+                element.text = text
+            for element in added:
+                self.tool.remove(element)
+        return(filename)
+
+
+# define data class to cache templates by file so each is parsed once per modification
+class templatecache:
+    def __init__(self):
+        self._cache = {}
+
+    def get(self, cls, filename):
+        """
+        Returns a cls (tasktemplate or setuptemplate) for filename, re-parsing only if the file changed.
+        """
+        stamp = os.path.getmtime(filename)
+        key = (cls.__name__, os.path.abspath(filename))
+        if key not in self._cache or self._cache[key][0] != stamp:
+            self._cache[key] = (stamp, cls(filename))
+        return(self._cache[key][1])
+
+
+def _isActuator(tag):
+    # force classes deriving from OpenSim::Actuator
+    return('Muscle' in tag or tag.endswith('Actuator'))
+
+
+# define data class for the model information needed to write reserves and tasks
+class modelinfo:
+    def __init__(self, filename):
+        """
+        Constructor method for class modelinfo:
+            Reads coordinates (with their joint, locked and coupler-constrained
+            state), bodies (mass and mass center) and the force set straight from
+            an .osim file with a streaming parser, without building the model or
+            initializing the SimTK system. Works for 3.x and 4.x model files.
+        """
+        self.filename = filename
+        self.version = ''
+        self.coordinates = [] # coordinate names in model order
+        self.joint = {} # coordinate name: joint name
+        self.locked = {} # coordinate name: default locked flag
+        self.dependent = set() # dependent coordinates of enforced coordinate coupler constraints
+        self.bodies = {} # body name: (mass, [x, y, z] mass center)
+        self.forces = [] # (class name, force name) of every force in the force set
+        self.passiveForces = [] # xml elements of the forces that are not actuators
+
+        stack = []
+        for event, elem in ET.iterparse(filename, events = ('start','end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag == 'OpenSimDocument':
+                    self.version = elem.get('Version','')
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+            grandparent = stack[-2] if len(stack) > 1 else None
+
+            if elem.tag == 'Coordinate' and elem.get('name') is not None and parent is not None and \
+                (parent.tag == 'coordinates' or (parent.tag == 'objects' and grandparent is not None and grandparent.tag == 'CoordinateSet')):
+                name = elem.get('name')
+                self.coordinates.append(name)
+                self.locked[name] = (elem.findtext('locked','false').strip().lower() == 'true')
+                joints = [e for e in stack if e.tag.endswith('Joint') and e.get('name') is not None]
+                self.joint[name] = joints[-1].get('name') if joints else ''
+                elem.clear()
+
+            elif elem.tag == 'Body' and elem.get('name') is not None:
+                mass = float(elem.findtext('mass','0'))
+                center = [float(v) for v in elem.findtext('mass_center','0 0 0').split()]
+                self.bodies[elem.get('name')] = (mass, center)
+
+            elif elem.tag == 'CoordinateCouplerConstraint':
+                # 4.x files use isEnforced, 3.x files isDisabled
+                enforced = elem.findtext('isEnforced','true').strip().lower() == 'true' and \
+                    elem.findtext('isDisabled','false').strip().lower() == 'false'
+                if enforced:
+                    self.dependent.add(elem.findtext('dependent_coordinate_name','').strip())
+
+            elif parent is not None and parent.tag == 'objects' and grandparent is not None and grandparent.tag == 'ForceSet' and len(stack) <= 4:
+                # direct members of the model's force set
+                self.forces.append((elem.tag, elem.get('name')))
+                if _isActuator(elem.tag):
+                    elem.clear() # muscle paths are large and not needed
+                else:
+                    self.passiveForces.append(elem)
+
+    def isConstrained(self, name):
+        """
+        Same as Coordinate.isConstrained() for the default state: locked or dependent on other coordinates.
+        """
+        return(self.locked[name] or name in self.dependent)
+
+    def totalMass(self):
+        return(sum(b[0] for b in self.bodies.values()))
+
+
+def element(tag, name = None, **props):
+    """
+    Builds an OpenSim object xml element with one child per property,
+    e.g. element('CoordinateActuator', 'MX', coordinate = 'pelvis_list', optimal_force = 100).
+    """
+    elem = ET.Element(tag)
+    if name is not None:
+        elem.set('name', name)
+    for prop in props.keys():
+        ET.SubElement(elem, prop).text = _text(props[prop])
+    return(elem)
+
+
+def writeSet(filename, settag, objects, name = '', version = '40000'):
+    """
+    Writes an OpenSim set file (ForceSet, CMC_TaskSet, ...) holding the given object elements.
+    """
+    root = ET.Element('OpenSimDocument', {'Version': version})
+    objset = ET.SubElement(root, settag, {'name': name})
+    container = ET.SubElement(objset, 'objects')
+    for obj in objects:
+        container.append(obj)
+    ET.SubElement(objset, 'groups')
+    tree = ET.ElementTree(root)
+    ET.indent(tree, space = '\t')
+    tree.write(filename, encoding = 'UTF-8', xml_declaration = True)
+    return(True)
+
+
+def writeExternalLoads(srcfile, dstfile, datafile):
+    """
+    Writes a copy of an external loads file with its data file and the data
+    source of every external force pointing at datafile.
+    """
+    tree = _parse(srcfile)
+    loads = tree.getroot().find('ExternalLoads')
+    if loads is None:
+        loads = tree.getroot()
+    element = loads.find('datafile')
+    if element is None:
+        element = ET.SubElement(loads, 'datafile')
+    element.text = datafile
+    for source in loads.iter('data_source_name'):
+        source.text = datafile
+    tree.write(dstfile, encoding = 'UTF-8', xml_declaration = True)
+    return(dstfile)
@@ -0,0 +1,11 @@
+# the modules import each other as top-level modules (import rrastorage, ...)
+import os
+import sys
+
+PYTHONDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PYTHONDIR not in sys.path:
+    sys.path.insert(0,PYTHONDIR)
+
+# trial bundled with the repository (Hamner & Delp 2013, subject 1)
+HAMNERTRIAL = os.path.join(os.path.dirname(PYTHONDIR),'HamnerOpt','subject01','Run_40002','Trial_1')
+HAMNERMODEL = os.path.join(HAMNERTRIAL,'Hamner2010_v4_subject01.osim')
@@ -0,0 +1,46 @@
+import os
+import shutil
+import numpy as np
+import rrarunner
+import rrastorage
+import reduceresiduals
+from conftest import HAMNERMODEL
+
+SETUP = '''<?xml version="1.0" encoding="UTF-8" ?>
+<OpenSimDocument Version="40000">
+	<RRATool name="RRA">
+		<initial_time>0.5</initial_time>
+		<final_time>0.9</final_time>
+		<cmc_time_window>0.01</cmc_time_window>
+	</RRATool>
+</OpenSimDocument>
+'''
+
+
+def _run(tmp_path, tend, returncode = 0, stderr = ''):
+    # an RRA run whose states file ends at tend
+    trialpath = str(tmp_path/'Trial_1')
+    if not os.path.isdir(trialpath):
+        os.makedirs(os.path.join(trialpath,'Results'))
+        shutil.copy(HAMNERMODEL,os.path.join(trialpath,'p.osim'))
+    rra = reduceresiduals.rrasetup(trialpath,'p','')
+    with open(os.path.join(trialpath,rra.fileset.rrasetupfile),'w') as f:
+        f.write(SETUP)
+    resultsdir = os.path.join(trialpath,'Results')
+    states = np.column_stack([np.linspace(0.5,tend,11),np.zeros(11)])
+    rrastorage.writeStorage(os.path.join(resultsdir,'optItr_states.sto'),['name states\n','endheader\n'],['time','q'],states)
+    status = rrarunner.runresult(os.path.join(trialpath,'optItr_1_Setup.xml'),resultsdir)
+    status.returncode = returncode
+    status.stderr = stderr
+    return(rra.__integratorStats__(status,'optItr',resultsdir))
+
+
+def test_steps_and_step_limit(tmp_path):
+    assert _run(tmp_path,0.9) == (10,False)
+    assert _run(tmp_path,0.7) == (10,True) # states end before the final time
+
+    # a failed run: states on disk are not its own, only the tool's message counts
+    steps, hitLimit = _run(tmp_path,0.7,returncode = 1)
+    assert np.isnan(steps) and not hitLimit
+    steps, hitLimit = _run(tmp_path,0.9,returncode = 1,stderr = 'Integrator reached the maximum number of steps')
+    assert np.isnan(steps) and hitLimit
@@ -0,0 +1,38 @@
+import math
+import random
+import numpy as np
+import reduceresiduals
+
+
+def _opt(points):
+    # evaluations with the given (residual, tracking error) terms; 6 residuals and 2 coordinates
+    rra = object.__new__(reduceresiduals.rrasetup) # the archive only uses the optimization structure
+    S = reduceresiduals.rrasetup._optStruct()
+    S.xcurrent = reduceresiduals.rrasetup._weightStruct(['pelvis_tilt','knee_angle_r'],[1.0,1.0],[0.0,0.0],[1.0,1.0])
+    S.rng = random.Random(0)
+    for residuals, errors in points:
+        S.sumRMSResiduals.append(6*residuals)
+        S.sumRMSErrors.append(2*errors)
+    return(rra, S)
+
+
+def test_archive_keeps_non_dominated():
+    points = [(3,3),(1,4),(4,1),(3.5,3.5),(2,2),(math.inf,0),(2,2),(0.5,5)]
+    rra, S = _opt(points)
+    accepted = [rra.__updateArchive__(S,i) for i in range(0,len(points))]
+    # dominated, failed (inf) and repeated solutions are not added; (2,2) replaces (3,3)
+    assert accepted == [True,True,True,False,True,False,False,True]
+    assert sorted(S.Archive) == [1,2,4,7]
+
+    # rebuilt from the history (resumed TWSA)
+    archive = list(S.Archive)
+    assert sorted(rra.__paretoArchive__(S)) == sorted(archive)
+
+
+def test_selection_from_archive():
+    rra, S = _opt([(1,4),(2,2),(2.2,1.9),(4,1)])
+    rra.__paretoArchive__(S)
+    distance = rra.__crowding__(S)
+    assert list(np.isinf(distance)) == [True,False,False,True] # the ends of the front are kept
+    for k in range(0,20):
+        assert rra.__selectFromArchive__(S) in S.Archive
@@ -0,0 +1,51 @@
+import random
+import numpy as np
+import reduceresiduals
+
+STEPS = [1/2.25,1/1.5,1.0,1.5] # every weight change a green coordinate can draw in the first iterations
+
+
+def _opt(names, blockCoordinate = False):
+    rra = object.__new__(reduceresiduals.rrasetup) # the perturbation only uses the optimization structure
+    S = reduceresiduals.rrasetup._optStruct()
+    S.xcurrent = reduceresiduals.rrasetup._weightStruct(names,[1.0]*len(names),[0.0]*len(names),[1.0]*len(names))
+    S.rng = random.Random(0)
+    S.itr = 1
+    S.i_max = 100
+    S.rotNormF = 2
+    S.transNormF = 2
+    S.blockCoordinate = blockCoordinate
+    S.greenCount = [0]*len(names)
+    S.freezeItrs = 5
+    S.groupItrs = 1
+    S.coordGroups = [('pelvis',[0]),('right leg',[1])]
+    return(rra, S)
+
+
+def _tested(S, x):
+    return(any(np.array_equal(x.values,t) for t in S.TestedSolutions))
+
+
+def test_candidates_are_untested():
+    rra, S = _opt(['pelvis_tilt','knee_angle_r'])
+    for k in range(0,20):
+        x = rra.__perturbWeights__(S)
+        assert not _tested(S,x)
+        S.TestedSolutions.append(x.values)
+    assert np.array_equal(S.xcurrent.values,[1.0,1.0]) # the current solution is not modified
+
+
+def test_exhausted_group_terminates():
+    # block-coordinate mode with a single-coordinate group whose every neighbour was tested
+    rra, S = _opt(['pelvis_tilt','knee_angle_r'],blockCoordinate = True)
+    for step in STEPS:
+        S.TestedSolutions.append([step,1.0])
+    x = rra.__perturbWeights__(S)
+    assert not _tested(S,x)
+
+    # every neighbour of both coordinates tested: the step is widened
+    for a in STEPS:
+        for b in STEPS:
+            S.TestedSolutions.append([a,b])
+    x = rra.__perturbWeights__(S)
+    assert not _tested(S,x)
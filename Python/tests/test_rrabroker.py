@@ -0,0 +1,71 @@
+import os
+import rrabroker
+
+
+def _spool(tmp_path):
+    return(rrabroker.spoolbroker(str(tmp_path/'spool'),poll = 0.01))
+
+
+def _left(broker):
+    # files still in the spool folders
+    return({folder: sorted(os.listdir(os.path.join(broker.root,folder))) for folder in ['pending','claimed','done','cancelled']})
+
+
+def test_submit_claim_complete_collect(tmp_path):
+    broker = _spool(tmp_path)
+    job = rrabroker.rrajob(setupxml = '<RRATool/>',toolname = 'optItr',weights = {'knee_angle_r': 2.0})
+    broker.submit(job)
+
+    claimed = broker.claim('w1',timeout = 0)
+    assert claimed.jobid == job.jobid and claimed.weights == {'knee_angle_r': 2.0}
+    assert broker.claim('w2',timeout = 0) is None # claimed once only
+
+    result = rrabroker.rrajobresult(job.jobid,'w1')
+    result.returncode = 0
+    result.files = {'optItr_pErr.sto': 'x'}
+    broker.complete(result)
+    collected = broker.collect(job.jobid,timeout = 1)
+    assert collected.worker == 'w1' and collected.files == {'optItr_pErr.sto': 'x'}
+    assert collected.runresult('setup.xml','.').succeeded()
+    assert broker.collect(job.jobid,timeout = 0) is None
+    assert _left(broker) == {'pending': [],'claimed': [],'done': [],'cancelled': []}
+
+
+def test_cancelled_jobs_leave_nothing_behind(tmp_path):
+    broker = _spool(tmp_path)
+
+    # withdrawn before a worker claims it
+    pending = rrabroker.rrajob()
+    broker.submit(pending)
+    broker.cancel(pending.jobid)
+    assert broker.claim('w1',timeout = 0) is None
+
+    # withdrawn while a worker runs it: the result is dropped
+    running = rrabroker.rrajob()
+    broker.submit(running)
+    assert broker.claim('w1',timeout = 0).jobid == running.jobid
+    broker.cancel(running.jobid)
+    broker.complete(rrabroker.rrajobresult(running.jobid,'w1'))
+    assert broker.collect(running.jobid,timeout = 0) is None
+
+    # withdrawn after the result arrived
+    done = rrabroker.rrajob()
+    broker.submit(done)
+    broker.claim('w1',timeout = 0)
+    broker.complete(rrabroker.rrajobresult(done.jobid,'w1'))
+    broker.cancel(done.jobid)
+    assert _left(broker) == {'pending': [],'claimed': [],'done': [],'cancelled': []}
+
+
+def test_stage_by_content(tmp_path):
+    broker = _spool(tmp_path)
+    model = str(tmp_path/'model.osim')
+    with open(model,'w') as f:
+        f.write('a')
+    stage = broker.stage({'model.osim': model})
+    assert broker.stage({'model.osim': model}) == stage
+    assert os.listdir(broker.stagepath(stage)) == ['model.osim']
+
+    with open(model,'w') as f:
+        f.write('b')
+    assert broker.stage({'model.osim': model}) != stage
@@ -0,0 +1,55 @@
+import os
+import math
+import threading
+import numpy as np
+import rraindex
+
+
+def _summary(trial, names, weights, **values):
+    summary = {'trial': os.path.abspath(trial),'coordinates': names,
+               'weights': np.asarray(weights,dtype = float),'rmsErrors': 0.01*np.asarray(weights,dtype = float)}
+    summary.update(values)
+    return(summary)
+
+
+def test_upsert_adds_and_replaces(tmp_path):
+    index = rraindex.resultsindex(str(tmp_path/'index.npz'))
+    assert index.upsert(_summary('/study/T1',['a','b'],[1,2],iterations = 10,stopReason = 'max_itrs')) == 0
+    assert index.upsert(_summary('/study/T2',['b','c'],[3,4],iterations = 20)) == 1
+    # same trial again: its row is replaced
+    assert index.upsert(_summary('/study/T1',['a','b'],[5,6],iterations = 30,stopReason = 'threshold reached')) == 0
+
+    assert len(index) == 2
+    assert index.coordinates == ['a','b','c']
+    assert list(index['iterations']) == [30,20]
+    assert list(index['stopReason']) == ['threshold reached','']
+    assert np.allclose(index.coordinate('weights','b'),[6,3])
+    assert math.isnan(index.coordinate('weights','c')[0])
+    assert math.isnan(index['fbest'][1])
+
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path/'index.npz')
+    index = rraindex.resultsindex(filename)
+    index.upsert(_summary('/study/T1',['a'],[1],fbest = 0.5))
+    index.save()
+    loaded = rraindex.resultsindex(filename)
+    assert loaded.row('/study/T1') == 0 and loaded.row('/study/T2') is None
+    assert loaded['fbest'][0] == 0.5
+    assert loaded.coordinates == ['a']
+
+
+def test_add_keeps_concurrent_rows(tmp_path):
+    filename = str(tmp_path/'index.npz')
+
+    def finish(k):
+        for j in range(0,5):
+            rraindex.add(filename,_summary('/study/T' + str(k) + '_' + str(j),['a'],[k]))
+
+    threads = [threading.Thread(target = finish,args = (k,)) for k in range(0,4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(rraindex.resultsindex(filename)) == 20
+    assert not os.path.exists(filename + '.lock')
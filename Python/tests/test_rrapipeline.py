@@ -0,0 +1,174 @@
+import os
+import shutil
+import pytest
+import rraxml
+import rrapipeline
+import reduceresiduals
+from conftest import HAMNERTRIAL, HAMNERMODEL
+
+
+def _touch(filename, text = 'x'):
+    with open(filename,'w') as f:
+        f.write(text)
+
+
+def _twostage(tmp_path, calls, params = None):
+    # source -> a -> b, with a's output read by b
+    source = str(tmp_path/'source.txt')
+    a = str(tmp_path/'a.txt')
+    b = str(tmp_path/'b.txt')
+    pipe = rrapipeline.pipeline(str(tmp_path/'state.json'))
+
+    def runA(record):
+        calls.append('a')
+        with open(source) as f:
+            _touch(a,f.read())
+
+    def runB(record):
+        calls.append('b')
+        _touch(b,'b')
+
+    pipe.add(rrapipeline.stage('a',runA,inputs = [source],outputs = [a],params = params or {}))
+    pipe.add(rrapipeline.stage('b',runB,outputs = [b],after = ['a']))
+    return(pipe)
+
+
+def test_stages_rerun_only_when_stale(tmp_path):
+    _touch(str(tmp_path/'source.txt'),'1')
+    calls = []
+    assert _twostage(tmp_path,calls).run() == ['a','b']
+    assert _twostage(tmp_path,calls).run() == []
+    assert _twostage(tmp_path,calls).outdated() == []
+
+    # other parameters: the stage is rerun, and the ones after it only if its outputs changed
+    assert _twostage(tmp_path,calls,{'k': 2}).outdated() == ['a','b']
+    assert _twostage(tmp_path,calls,{'k': 2}).run() == ['a']
+
+    # same content written again: up to date; other content: stale
+    _touch(str(tmp_path/'source.txt'),'1')
+    assert _twostage(tmp_path,calls,{'k': 2}).run() == []
+    _touch(str(tmp_path/'source.txt'),'2')
+    assert _twostage(tmp_path,calls,{'k': 2}).run() == ['a','b']
+
+    # an output edited by hand
+    _touch(str(tmp_path/'b.txt'),'edited')
+    assert _twostage(tmp_path,calls,{'k': 2}).run() == ['b']
+    assert _twostage(tmp_path,calls,{'k': 2}).run(force = ['a']) == ['a']
+
+
+def test_interrupted_marks_started_key(tmp_path):
+    _touch(str(tmp_path/'source.txt'),'1')
+    calls = []
+    def interrupt(record):
+        raise KeyboardInterrupt()
+
+    pipe = _twostage(tmp_path,calls)
+    pipe.stages['b'].run = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        pipe.run()
+
+    pipe = _twostage(tmp_path,calls)
+    assert pipe.interrupted('a') is None
+    assert pipe.interrupted('b') == pipe.key('b')
+    pipe.run()
+    assert pipe.interrupted('b') is None
+
+
+def _trialFolder(trialpath):
+    if not os.path.isdir(trialpath):
+        os.makedirs(trialpath)
+        shutil.copy(HAMNERMODEL,os.path.join(trialpath,'p.osim'))
+        shutil.copy(os.path.join(HAMNERTRIAL,'Run_40002_IK.mot'),os.path.join(trialpath,'Visual3d_SIMM_input.mot'))
+        shutil.copy(os.path.join(HAMNERTRIAL,'Run_40002_GRF.mot'),os.path.join(trialpath,'Visual3d_SIMM_grf.mot'))
+    return(trialpath)
+
+
+@pytest.fixture
+def trial(tmp_path):
+    # a trial whose stages only write their outputs; optimizeTrackingWeights records its options
+    trialpath = _trialFolder(str(tmp_path/'Trial_1'))
+    rra = reduceresiduals.rrasetup(trialpath,'p','')
+    fs = rra.fileset
+    trialfile = lambda name: os.path.join(trialpath,name)
+    rra.createTasksFile = lambda **options: _touch(trialfile(fs.taskfile))
+    rra.createReservesFile = lambda **options: _touch(trialfile(fs.actuatorfile))
+    rra.createExtLoads = lambda: _touch(trialfile(fs.extloadsetup))
+
+    def initialRRA():
+        for name in [fs.rrasetupfile,fs.outname,fs.adjname]:
+            _touch(trialfile(name))
+    rra.initialRRA = initialRRA
+    rra.runMassItrsRRA = lambda: _touch(trialfile(fs.masssetupfile))
+
+    rra.twsaCalls = []
+    rra.interrupt = False
+    def optimizeTrackingWeights(**options):
+        rra.twsaCalls.append(options.get('overwrite',False))
+        os.makedirs(fs.optpath,exist_ok = True)
+        _touch(os.path.join(fs.optpath,'opt_results.optStruct'),str(options))
+        if rra.interrupt:
+            raise KeyboardInterrupt()
+        _touch(trialfile(fs.optname))
+    rra.optimizeTrackingWeights = optimizeTrackingWeights
+    return(rra)
+
+
+def _twsa(rra, max_itrs, interrupt = False, **twsaOptions):
+    rra.interrupt = interrupt
+    pipe = rrapipeline.trialpipeline(rra,twsaOptions = dict(twsaOptions,max_itrs = max_itrs))
+    if interrupt:
+        with pytest.raises(KeyboardInterrupt):
+            pipe.run()
+        return(None)
+    return(pipe.run())
+
+
+def test_twsa_resumes_interrupted_run(trial):
+    # interrupted first run, then resumed with the same settings
+    _twsa(trial,10,interrupt = True)
+    assert _twsa(trial,10) == ['twsa']
+    assert trial.twsaCalls == [False,False]
+
+    # after a completed run, other settings start again; an interrupted run of those is resumed
+    assert _twsa(trial,10) == []
+    _twsa(trial,20,interrupt = True)
+    assert trial.twsaCalls[-1] is True
+    assert _twsa(trial,20) == ['twsa']
+    assert trial.twsaCalls[-1] is False
+
+    # the progress of an interrupted run with other settings is not resumed
+    _twsa(trial,30,interrupt = True)
+    assert _twsa(trial,40) == ['twsa']
+    assert trial.twsaCalls[-2:] == [True,True]
+
+
+def _cycle(tmp_path):
+    # a new rrasetup object of the same other cycle, with its template cache in use
+    cycle = reduceresiduals.rrasetup(_trialFolder(str(tmp_path/'Trial_2')),'p','')
+    setupfile = os.path.join(cycle.fileset.trialpath,cycle.fileset.rrasetupfile)
+    if not os.path.isfile(setupfile):
+        _touch(setupfile,'<OpenSimDocument><RRATool name="RRA"/></OpenSimDocument>')
+    cycle._templates.get(rraxml.setuptemplate,setupfile)
+    return(cycle)
+
+
+def test_twsa_with_cycles_is_keyed_by_trial(trial, tmp_path):
+    # two objects of the same cycle give the same key
+    stages = rrapipeline.pipeline(str(tmp_path/'state.json'))
+    stages.add(rrapipeline.stage('twsa',None,params = {'cycles': [_cycle(tmp_path)]}))
+    key = stages.key('twsa')
+    stages.stages['twsa'].params = {'cycles': [_cycle(tmp_path)]}
+    assert stages.key('twsa') == key
+
+    # interrupted, then resumed by a new session with new objects of the same cycle
+    _twsa(trial,10,interrupt = True,cycles = [_cycle(tmp_path)])
+    assert _twsa(trial,10,cycles = [_cycle(tmp_path)]) == ['twsa']
+    assert _twsa(trial,10,cycles = [_cycle(tmp_path)]) == []
+    assert trial.twsaCalls == [False,False]
+
+
+def test_unkeyable_parameters_raise(tmp_path):
+    stages = rrapipeline.pipeline(str(tmp_path/'state.json'))
+    stages.add(rrapipeline.stage('a',None,params = {'callback': lambda: None}))
+    with pytest.raises(TypeError):
+        stages.key('a')
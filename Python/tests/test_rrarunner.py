@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import threading
+import pytest
+import rrarunner
+
+
+def _tool(tmp_path, script):
+    # stands in for opensim-cmd: "<tool> run-tool <setupfile>"
+    filename = str(tmp_path/'tool')
+    with open(filename,'w') as f:
+        f.write('#!' + sys.executable + '\nimport os, sys, time\n' + script)
+    os.chmod(filename,0o755)
+    return(filename)
+
+
+def test_cpusets_cover_every_slot():
+    with pytest.raises(ValueError):
+        rrarunner.rrarunner(maxConcurrent = 3,cpusets = [[0],[1]])
+    rrarunner.rrarunner(maxConcurrent = 2,cpusets = [[0],[1]])
+
+
+@pytest.mark.skipif(not hasattr(os,'sched_setaffinity'),reason = 'Linux only')
+def test_limits_applied_after_start(tmp_path):
+    cpu = sorted(os.sched_getaffinity(0))[0]
+    tool = _tool(tmp_path,'import resource\ntime.sleep(0.2)\n'
+                 'print(sorted(os.sched_getaffinity(0)), resource.getrlimit(resource.RLIMIT_AS)[0])\n')
+    runner = rrarunner.rrarunner(command = tool,cpusets = [[cpu]],memoryLimit = 2**32)
+    result = runner.run('setup.xml',str(tmp_path))
+    assert result.succeeded()
+    assert result.stdout.split() == ['[' + str(cpu) + ']',str(2**32)]
+
+
+def _sleeper(tmp_path):
+    # writes its pid next to the setup file, then sleeps
+    return(_tool(tmp_path,'open(sys.argv[2] + ".pid","w").write(str(os.getpid()))\ntime.sleep(30)\n'))
+
+
+def _gone(setupfile):
+    with open(setupfile + '.pid') as f:
+        pid = int(f.read())
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return(True)
+    return(False)
+
+
+def test_timeout_kills_run(tmp_path):
+    runner = rrarunner.rrarunner(command = _sleeper(tmp_path),timeout = 1)
+    setupfile = str(tmp_path/'a.xml')
+    result = runner.run(setupfile,str(tmp_path))
+    assert result.timedout and not result.succeeded()
+    assert result.status() == 'timeout'
+    assert result.walltime < 10
+    assert _gone(setupfile)
+
+
+def test_cancel_stragglers(tmp_path):
+    runner = rrarunner.rrarunner(maxConcurrent = 2,command = _sleeper(tmp_path))
+    jobs = [(str(tmp_path/'a.xml'),str(tmp_path)),(str(tmp_path/'b.xml'),str(tmp_path))]
+    timer = threading.Timer(1,runner.cancel)
+    timer.start()
+    results = runner.runAll(jobs)
+    assert [r.cancelled for r in results] == [True,True]
+    assert all(_gone(setupfile) for setupfile, cwd in jobs)
+
+
+def test_discard_submitted_run(tmp_path):
+    runner = rrarunner.rrarunner(command = _sleeper(tmp_path))
+    setupfile = str(tmp_path/'a.xml')
+    handle = runner.submit(setupfile,str(tmp_path))
+    while not os.path.isfile(setupfile + '.pid'):
+        time.sleep(0.05)
+    runner.discard([handle])
+    assert _gone(setupfile)
@@ -0,0 +1,53 @@
+import os
+import math
+import numpy as np
+import rrastorage
+from conftest import HAMNERTRIAL
+
+
+def test_roundtrip(tmp_path):
+    header, labels, data = rrastorage.readStorage(os.path.join(HAMNERTRIAL,'Run_40002_GRF.mot'))
+    filename = rrastorage.writeStorage(str(tmp_path/'grf.mot'),header,labels,data)
+    header2, labels2, data2 = rrastorage.readStorage(filename)
+    assert labels2 == labels
+    assert np.allclose(data2,data)
+    assert 'datarows ' + str(data.shape[0]) + '\n' in header2
+
+
+def test_write_updates_header(tmp_path):
+    header = ['name test\n','datacolumns 9\n','datarows 9\n','range 0 9\n','endheader\n']
+    data = np.column_stack([np.linspace(0,1,5),np.arange(0,5)])
+    header2, labels, data2 = rrastorage.readStorage(rrastorage.writeStorage(str(tmp_path/'a.sto'),header,['time','x'],data))
+    assert header2[1:4] == ['datacolumns 2\n','datarows 5\n','range 0.000000e+00 1.000000e+00\n']
+    assert rrastorage.countRows(str(tmp_path/'a.sto')) == 5
+    assert rrastorage.lastTime(str(tmp_path/'a.sto')) == 1.0
+
+
+def test_lastTime_without_rows(tmp_path):
+    filename = str(tmp_path/'empty.sto')
+    with open(filename,'w') as f:
+        f.write('name empty\nendheader\ntime\tx\n')
+    assert math.isnan(rrastorage.lastTime(filename))
+
+
+def test_crop_keeps_samples_around_window():
+    data = np.column_stack([np.arange(0,11)*0.1,np.arange(0,11)])
+    cropped = rrastorage.crop(data,0.25,0.55)
+    assert np.allclose(cropped[:,0],[0.2,0.3,0.4,0.5,0.6])
+    cropped = rrastorage.crop(data,0.25,0.55,pad = 0.1)
+    assert np.allclose(cropped[[0,-1],0],[0.1,0.7])
+    assert np.allclose(rrastorage.crop(data,-1,2),data)
+
+
+def test_resample_uniform_grid():
+    data = np.column_stack([[0.0,0.1,0.3],[0.0,1.0,3.0]])
+    out = rrastorage.resample(data,20)
+    assert np.allclose(out[:,0],np.arange(0,7)*0.05)
+    assert np.allclose(out[:,1],out[:,0]*10)
+
+
+def test_decimate_keeps_last_row():
+    data = np.column_stack([np.arange(0,10),np.arange(0,10)])
+    assert list(rrastorage.decimate(data,3)[:,0]) == [0,3,6,9]
+    assert list(rrastorage.decimate(data,4)[:,0]) == [0,4,8,9]
+    assert rrastorage.decimate(data,1).shape == data.shape
@@ -0,0 +1,70 @@
+import math
+import types
+import rrarunner
+import rrastudy
+import reduceresiduals
+
+
+class _trial:
+    # stands in for an rrasetup: every evaluation is one RRA run per cycle and improves the objective
+    def __init__(self, trialpath, ncycles = 0, failAt = None):
+        self.fileset = types.SimpleNamespace(trialpath = trialpath)
+        self.runner = rrarunner.rrarunner()
+        self.cycles = [_trial(trialpath + '_' + str(k)) for k in range(0,ncycles)]
+        self.failAt = failAt
+        self.finished = None
+        self.closed = False
+
+    def __evaluationRunner__(self):
+        return(self.runner)
+
+    def __evaluate__(self, S):
+        S.ObjFuncValues.append(10/(S.itr+1))
+        S.ScreenValues.append(math.nan)
+        S.Promoted.append(True)
+
+    def beginOptimization(self, max_itrs = 75, fcn_threshold = 2, **options):
+        S = reduceresiduals.rrasetup._optStruct()
+        S.i_max = max_itrs
+        S.thresh = fcn_threshold
+        S.itr = 0
+        self._session = [0,0]
+        self.__evaluate__(S)
+        return(S)
+
+    def stepOptimization(self, S):
+        S.itr = S.itr + 1
+        if S.itr == self.failAt:
+            raise RuntimeError('no RRA results')
+        self.__evaluate__(S)
+        return(S)
+
+    def stopCondition(self, S):
+        return('max_itrs' if S.itr >= S.i_max else None)
+
+    def finishOptimization(self, S, rerun_final = False):
+        self.finished = S.stopReason
+        return(S)
+
+    def __closeScratch__(self):
+        self.closed = True
+
+
+def test_budget_counts_rra_runs():
+    trials = [_trial('a'),_trial('b',ncycles = 1)]
+    study = rrastudy.studyscheduler(trials,12,workers = 1,fcn_threshold = 0)
+    results = study.run()
+    runs = [rrastudy.runCount(rra,study.states[rra.fileset.trialpath]) for rra in trials]
+    assert study.used == sum(runs)
+    assert 12 <= study.used <= 13 # the last step may run on both cycles
+    assert results == {'a': 'budget','b': 'budget'}
+
+
+def test_failed_trial_is_retired():
+    trials = [_trial('a',failAt = 2),_trial('b')]
+    study = rrastudy.studyscheduler(trials,100,workers = 2,max_itrs = 5,fcn_threshold = 0)
+    results = study.run()
+    assert results == {'a': 'failed','b': 'max_itrs'}
+    assert isinstance(study.errors['a'],RuntimeError)
+    assert trials[0].closed and trials[0].finished is None
+    assert trials[1].finished == 'max_itrs'
@@ -0,0 +1,108 @@
+import os
+import xml.etree.ElementTree as ET
+import pytest
+import rraxml
+import reduceresiduals
+from conftest import HAMNERMODEL
+
+SETUP = """<?xml version="1.0" encoding="UTF-8" ?>
+<OpenSimDocument Version="40000">
+	<!--RRA settings-->
+	<RRATool name="RRA">
+		<!--Directory used for writing results.-->
+		<results_directory>RRA_Results</results_directory>
+		<initial_time>0.5</initial_time>
+		<final_time>0.9</final_time>
+		<adjust_com_to_reduce_residuals>true</adjust_com_to_reduce_residuals>
+	</RRATool>
+</OpenSimDocument>
+"""
+
+TASKS = """<?xml version="1.0" encoding="UTF-8" ?>
+<OpenSimDocument Version="40000">
+	<CMC_TaskSet name="RRA_tasks">
+		<objects>
+			<CMC_Joint name="pelvis_tilt">
+				<weight> 1 1 1</weight>
+				<coordinate>pelvis_tilt</coordinate>
+			</CMC_Joint>
+			<CMC_Joint name="knee_angle_r">
+				<weight> 5 1 1</weight>
+				<coordinate>knee_angle_r</coordinate>
+			</CMC_Joint>
+		</objects>
+	</CMC_TaskSet>
+</OpenSimDocument>
+"""
+
+
+def _write(path, text):
+    with open(path,'w') as f:
+        f.write(text)
+    return(str(path))
+
+
+def test_setuptemplate_patches_copy_only(tmp_path):
+    template = rraxml.setuptemplate(_write(tmp_path/'RRA_Setup.xml',SETUP))
+    assert template.get('final_time') == '0.9'
+    assert template.get('cmc_time_window') is None
+
+    template.write(str(tmp_path/'opt_Setup.xml'),name = 'optItr',results_directory = 'Results',
+                   adjust_com_to_reduce_residuals = False,maximum_number_of_integrator_steps = 20000)
+    tool = ET.parse(str(tmp_path/'opt_Setup.xml')).getroot().find('RRATool')
+    assert tool.get('name') == 'optItr'
+    assert tool.findtext('results_directory') == 'Results'
+    assert tool.findtext('adjust_com_to_reduce_residuals') == 'false'
+    assert tool.findtext('maximum_number_of_integrator_steps') == '20000'
+
+    # the template itself is unchanged by write()
+    assert template.tool.get('name') == 'RRA'
+    assert template.get('results_directory') == 'RRA_Results'
+    assert template.get('maximum_number_of_integrator_steps') is None
+
+
+def test_tasktemplate_writes_weights(tmp_path):
+    template = rraxml.tasktemplate(_write(tmp_path/'RRA_tasks.xml',TASKS))
+    assert template.names == ['pelvis_tilt','knee_angle_r']
+    assert template.weights() == [1.0,5.0]
+
+    template.write(str(tmp_path/'opt_Tasks.xml'),['knee_angle_r'],[2.5])
+    written = rraxml.tasktemplate(str(tmp_path/'opt_Tasks.xml'))
+    assert written.weights() == [1.0,2.5]
+    # the template keeps its own weights for the next copy
+    template.write(str(tmp_path/'again.xml'),[],[])
+    assert rraxml.tasktemplate(str(tmp_path/'again.xml')).weights() == [1.0,5.0]
+
+
+def test_templatecache_reparses_changed_files(tmp_path):
+    filename = _write(tmp_path/'RRA_Setup.xml',SETUP)
+    cache = rraxml.templatecache()
+    first = cache.get(rraxml.setuptemplate,filename)
+    assert cache.get(rraxml.setuptemplate,filename) is first
+    _write(tmp_path/'RRA_Setup.xml',SETUP.replace('0.9','1.1'))
+    os.utime(filename,(0,1))
+    assert cache.get(rraxml.setuptemplate,filename).get('final_time') == '1.1'
+
+
+def test_modelinfo_hamner():
+    info = rraxml.modelinfo(HAMNERMODEL)
+    assert info.version == '40000'
+    assert len(info.coordinates) == 37
+    assert info.coordinates[:6] == ['pelvis_tilt','pelvis_list','pelvis_rotation','pelvis_tx','pelvis_ty','pelvis_tz']
+    assert info.joint['knee_angle_r'] == 'knee_r'
+    assert len(info.forces) == 92
+    assert all(tag == 'Thelen2003Muscle' for tag, name in info.forces)
+    assert abs(info.totalMass() - 72.84) < 1e-3
+    assert info.isConstrained('mtp_angle_r') and not info.isConstrained('knee_angle_r')
+
+
+def test_reserves_need_pelvis(tmp_path):
+    with open(HAMNERMODEL) as f:
+        model = f.read()
+    rra = reduceresiduals.rrasetup(str(tmp_path),'p','')
+    _write(rra.modfullpath,model.replace('<Body name="pelvis">','<Body name="hips">'))
+    with pytest.raises(ValueError,match = '"Pelvis" body'):
+        rra.createReservesFile()
+    _write(rra.modfullpath,model)
+    rra.createReservesFile()
+    assert len(ET.parse(os.path.join(str(tmp_path),rra.fileset.actuatorfile)).getroot().find('.//objects')) > 6
@@ -0,0 +1,19 @@
+import os
+import reduceresiduals
+
+
+def test_scratch_folders_cleaned_up(tmp_path):
+    rra = reduceresiduals.rrasetup(str(tmp_path/'Trial_1'),'p','')
+    rra.scratch = str(tmp_path/'scratch')
+    os.makedirs(rra.scratch)
+    rra.__openScratch__()
+    folder = rra._scratch
+    assert folder in reduceresiduals._SCRATCH and rra.fileset.workpath == folder
+    rra.__closeScratch__()
+    assert folder not in reduceresiduals._SCRATCH and not os.path.isdir(folder)
+
+    # left behind by a TWSA that never finished: removed by the exit handler
+    rra.__openScratch__()
+    folder = rra._scratch
+    reduceresiduals._removeScratch()
+    assert not os.path.isdir(folder) and not reduceresiduals._SCRATCH
@@ -0,0 +1,88 @@
+import os
+import math
+import random
+import shutil
+import numpy as np
+import pytest
+import rrarunner
+import reduceresiduals
+from conftest import HAMNERTRIAL, HAMNERMODEL
+
+SETUP = '''<?xml version="1.0" encoding="UTF-8" ?>
+<OpenSimDocument Version="40000">
+	<RRATool name="RRA">
+		<model_file>p_adj.osim</model_file>
+		<results_directory>RRA_Results</results_directory>
+		<initial_time>0.5</initial_time>
+		<final_time>0.9</final_time>
+		<task_set_file>RRA_tasks.xml</task_set_file>
+		<adjust_com_to_reduce_residuals>true</adjust_com_to_reduce_residuals>
+		<output_model_file>p_adj.osim</output_model_file>
+	</RRATool>
+</OpenSimDocument>
+'''
+
+
+def _trial(trialpath):
+    # a trial whose RRA runs are stubbed: runs succeed at once and are scored by a fixed (pseudo-random) function of the weights
+    os.makedirs(trialpath)
+    shutil.copy(HAMNERMODEL,os.path.join(trialpath,'p.osim'))
+    shutil.copy(HAMNERMODEL,os.path.join(trialpath,'p_adj.osim'))
+    shutil.copy(os.path.join(HAMNERTRIAL,'Run_40002_IK.mot'),os.path.join(trialpath,'Visual3d_SIMM_input.mot'))
+    rra = reduceresiduals.rrasetup(trialpath,'p','')
+    rra.createTasksFile()
+    with open(os.path.join(trialpath,rra.fileset.rrasetupfile),'w') as f:
+        f.write(SETUP)
+
+    def run(setupfile, resultsdir):
+        result = rrarunner.runresult(setupfile,resultsdir)
+        result.returncode = 0
+        result.walltime = 0.0
+        return(result)
+    rra.__runRRA__ = run
+    rra.__startRRA__ = lambda setupfile, resultsdir: (setupfile,resultsdir)
+    rra.__waitRRA__ = lambda handle: run(*handle)
+    rra.__discardRRA__ = lambda handles: None
+
+    def score(S, x, toolname, resultsdir, status = None, norms = None):
+        draw = random.Random(x.values.tobytes())
+        rmsErr = [draw.uniform(0,2)*S.rotNormF*math.pi/180 for name in x.names] # green, yellow and red coordinates
+        f = draw.uniform(0,1)
+        return(f, [f,f,0.0,f], rmsErr)
+    rra.__scoreResults__ = score
+
+    # the state every candidate of an iteration is drawn from (a redrawn candidate replaces a cancelled one)
+    rra.draws = {}
+    perturb = rra.__perturbWeights__
+    def perturbWeights(S, pending = ()):
+        rra.draws[S.itr] = (S.rng.getstate(), list(S.greenCount))
+        return(perturb(S,pending))
+    rra.__perturbWeights__ = perturbWeights
+    return(rra)
+
+
+def _search(trialpath, speculate, blockCoordinate):
+    rra = _trial(trialpath)
+    S = rra.beginOptimization(min_itrs = 30,max_itrs = 30,fcn_threshold = 0,speculate = speculate,
+                              blockCoordinate = blockCoordinate,groupItrs = 2,freezeItrs = 1)
+    S.rng.seed(7)
+    while rra.stopCondition(S) is None:
+        S = rra.stepOptimization(S)
+    rra.__closeScratch__()
+    return(rra, S)
+
+
+@pytest.mark.parametrize('blockCoordinate',[False,True])
+def test_speculation_matches_serial_search(tmp_path, blockCoordinate):
+    serial, S0 = _search(str(tmp_path/'serial'),0,blockCoordinate)
+    ahead, S2 = _search(str(tmp_path/'ahead'),2,blockCoordinate)
+
+    assert S2.speculate == 2 and S2.cancelledRuns > 0
+    assert np.array_equal(S0.TestedSolutions.array(),S2.TestedSolutions.array())
+    assert S0.Accepted == S2.Accepted
+    assert 1 < sum(S0.Accepted) < len(S0.Accepted) # both accepted and rejected candidates
+    assert np.array_equal(S0.ObjFuncValues.array(),S2.ObjFuncValues.array())
+    assert S0.greenCount == S2.greenCount
+    assert sorted(serial.draws) == list(range(1,S0.itr+1))
+    for itr in serial.draws:
+        assert serial.draws[itr] == ahead.draws[itr]